@@ -0,0 +1,183 @@
+"""
+Cadeia por eventos ingestão -> inferência -> notificação num único processo.
+
+As filas SQS são trocadas por `LocalQueue` e os serviços externos pelos de
+`bench.locais`. O histórico dos sites é carregado sem eventos; depois cada ciclo
+libera `--horas` horas novas no Visual Crossing falso e roda a ingestão, que publica
+os eventos. Duas threads consomem as filas como os consumidores de produção: a
+inferência (`handle_observations` de main.py) e a notificação (`lambda_handler`
+com os eventos). Ao final sai a latência por etapa (espera na fila e execução) e
+ponta a ponta, e o registro vai para `bench/resultados.json`.
+
+Uso (na raiz do repositório):
+    python -m bench.pipeline --sites 3 --ciclos 3 --horas 24
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import threading
+from contextlib import ExitStack
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bench.locais import FakeServices, local_postgres
+from bench.run import RAIZ, SEGREDO_BANCO, create_citrus1, git_commit, load_job
+from bench.sintetico import generate, make_sites
+
+def train_models(sites, dados, diretorio):
+    """Um modelo pequeno por site, exportado com manifesto; retorna os argumentos --modelo"""
+    from catboost import CatBoostClassifier
+    from citrus_comum.alvo import NOME_ALVO, make_target
+    from citrus_comum.features import LAGS, HORA_ANCORA, feature_names, make_lag_features
+    from citrus_comum.modelo import export_model
+
+    nomes = feature_names(LAGS)
+    argumentos = []
+    for site in sites:
+        df = dados[site['site']]
+        treino = make_lag_features(df, LAGS, hora=HORA_ANCORA).join(make_target(df), how='inner')
+        modelo = CatBoostClassifier(iterations=50, allow_writing_files=False, verbose=False)
+        modelo.fit(treino[nomes], treino[NOME_ALVO])
+        sistema = f"pulverizar_{site['site']}_bench"
+        caminho = os.path.join(diretorio, f"{sistema}.cbm")
+        export_model(modelo, caminho, sistema, nomes, extra={'site': site['site']})
+        argumentos.append(f"{sistema}={caminho}")
+    return argumentos
+
+def add_subscribers(sites, por_site):
+    from citrus_comum.db import transaction
+
+    with transaction() as cur:
+        cur.execute("DELETE FROM notificacoes1")
+        cur.execute("DELETE FROM subscribers1")
+        for site in sites:
+            for j in range(por_site):
+                cur.execute("""
+                    INSERT INTO subscribers1 (telefone, site, sistema)
+                    VALUES (%s, %s, %s)
+                """, [f"+5519{j:09d}", site['site'], f"pulverizar_{site['site']}_bench"])
+
+def summarize(latencias):
+    """Média, p95 e máximo (ms) de cada latência medida"""
+    resumo = {}
+    for nome in sorted({n for l in latencias for n in l}):
+        valores = np.array([l[nome] for l in latencias if nome in l])
+        resumo[nome] = {'media_ms': round(float(valores.mean()), 1),
+                        'p95_ms': round(float(np.percentile(valores, 95)), 1),
+                        'max_ms': round(float(valores.max()), 1)}
+    return resumo
+
+def run(n_sites, ciclos, horas, por_site, saida):
+    sites = make_sites(n_sites)
+    # ~120 dias por site: o suficiente para treinar e para o maior lag. Os dados
+    # terminam hoje: só previsões de hoje em diante são publicadas e notificadas
+    dados = generate(sites, escala=n_sites * 120 * 24 / 93_928,
+                     fim=pd.Timestamp.now().normalize() + pd.Timedelta(hours=23))
+    fim_total = min(df.index[-1] for df in dados.values())
+    fim_historico = fim_total - pd.Timedelta(hours=ciclos * horas)
+
+    latencias, mortas = [], []
+    with ExitStack() as pilha:
+        servicos = FakeServices(dados, sites).start()
+        pilha.callback(servicos.stop)
+        banco = pilha.enter_context(local_postgres())
+        diretorio = pilha.enter_context(tempfile.TemporaryDirectory(prefix='citrus_pipeline_'))
+        servicos.segredos[SEGREDO_BANCO] = {'username': banco['username'], 'password': banco['password']}
+        servicos.segredos['citrus_edge/visual_crossing_api_key'] = {'visual_crossing': 'bench'}
+        os.environ.update({'DB_HOST': banco['host'], 'DB_PORT': str(banco['port']),
+                           'DB_NAME': banco['database'], 'DB_SECRET': SEGREDO_BANCO,
+                           'CITRUS_CACHE_DIR': os.path.join(diretorio, 'cache'), 'SMS_POR_SEGUNDO': '1000'})
+        os.environ.update(servicos.environment())
+
+        sys.path.insert(0, os.path.join(RAIZ, 'deploy', 'inferencia_diaria', 'app'))
+        from citrus_comum import eventos
+        from citrus_comum.db import close_all, transaction
+        ingestao = load_job('ingestao_diaria', 'deploy/ingestao_diaria/lambda_function.py')
+        inferencia = load_job('inferencia_main', 'deploy/inferencia_diaria/app/main.py')
+        notificacao = load_job('notificacao_sms', 'deploy/notificacao_sms/lambda_function.py')
+
+        with transaction() as cur:
+            create_citrus1(cur)
+            inferencia.create_predictions_table_if_not_exists(cur)
+        notificacao.create_tables_if_not_exist()
+        add_subscribers(sites, por_site)
+
+        # Histórico sem filas configuradas: nenhum evento é publicado
+        print(f"Carregando histórico até {fim_historico}...")
+        ingestao.lambda_handler({'sites': sites, 'fim': fim_historico.isoformat()}, None)
+        modelos = inferencia.load_models_by_site(train_models(sites, dados, diretorio))
+
+        fila_inferencia, fila_notificacao = eventos.LocalQueue(), eventos.LocalQueue()
+        eventos.set_queue('inferencia', fila_inferencia)
+        eventos.set_queue('notificacao', fila_notificacao)
+
+        def notificar(evento):
+            resposta = notificacao.lambda_handler({'eventos': [evento]}, None)
+            if resposta.get('batchItemFailures'):
+                raise RuntimeError(f"{len(resposta['batchItemFailures'])} evento(s) com envio falho")
+            latencias.append(eventos.latencies(evento))
+
+        parar = threading.Event()
+        consumidores = [
+            threading.Thread(target=eventos.consume, daemon=True,
+                             args=(fila_inferencia, lambda e: inferencia.handle_observations(e, modelos)),
+                             kwargs={'parar': parar, 'espera': 0.1}),
+            threading.Thread(target=eventos.consume, daemon=True, args=(fila_notificacao, notificar),
+                             kwargs={'parar': parar, 'espera': 0.1}),
+        ]
+        for consumidor in consumidores:
+            consumidor.start()
+
+        for ciclo in range(1, ciclos + 1):
+            fim = fim_historico + pd.Timedelta(hours=ciclo * horas)
+            print(f"Ciclo {ciclo}: ingestão até {fim}")
+            ingestao.lambda_handler({'sites': sites, 'fim': fim.isoformat()}, None)
+            # Inferência antes da notificação: os eventos de previsões saem ao fim da primeira
+            fila_inferencia.join()
+            fila_notificacao.join()
+
+        parar.set()
+        for consumidor in consumidores:
+            consumidor.join()
+        mortas = fila_inferencia.mortas + fila_notificacao.mortas
+        eventos.set_queue('inferencia', None)
+        eventos.set_queue('notificacao', None)
+        close_all()
+
+    registro = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'maquina': f"{platform.machine()} {os.cpu_count()} núcleos",
+        'parametros': {'sites': n_sites, 'ciclos': ciclos, 'horas': horas, 'assinantes_por_site': por_site},
+        'etapas': {'pipeline': {'cadeias': len(latencias), 'eventos_descartados': len(mortas),
+                                'latencias': summarize(latencias)}},
+    }
+    print(json.dumps(registro, indent=2, ensure_ascii=False))
+
+    historico = []
+    if os.path.exists(saida):
+        with open(saida) as f:
+            historico = json.load(f)
+    historico.append(registro)
+    with open(saida, 'w') as f:
+        json.dump(historico, f, indent=1, ensure_ascii=False)
+    return registro
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cadeia por eventos com filas em memória e serviços locais")
+    parser.add_argument("--sites", type=int, default=3)
+    parser.add_argument("--ciclos", type=int, default=3, help="rodadas de ingestão com horas novas")
+    parser.add_argument("--horas", type=int, default=24, help="horas novas por ciclo")
+    parser.add_argument("--assinantes", type=int, default=10, help="assinantes por site")
+    parser.add_argument("--saida", default=os.path.join(RAIZ, 'bench', 'resultados.json'))
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.sites, args.ciclos, args.horas, args.assinantes, args.saida)
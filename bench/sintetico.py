@@ -0,0 +1,101 @@
+"""
+Gerador de clima horário sintético com o esquema de citrus1.
+
+Ciclos anual e diário, ruído autocorrelacionado (AR(1)) e chuva concentrada no
+verão, o suficiente para o alvo e as features terem distribuições plausíveis.
+Tudo vetorizado: dezenas de milhões de horas saem em segundos.
+"""
+import json
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from citrus_comum.features import VARIAVEIS
+
+# Volume atual de citrus1 (README do model_dev)
+LINHAS_BASE = 93_928
+FIM_PADRAO = pd.Timestamp('2025-09-18 23:00')
+
+BLOCO_AR = 256
+
+def ar1(rng, n, phi, sigma):
+    """
+    Série AR(1) estacionária de tamanho `n`, calculada em blocos vetorizados.
+
+    Dentro de cada bloco x_i = phi^i * cumsum(e_j * phi^-j); o estado do fim do
+    bloco anterior entra com peso phi^(i+1) (o termo seguinte, phi^(2*BLOCO_AR), é
+    desprezível para phi <= 0.99).
+    """
+    blocos = -(-n // BLOCO_AR)
+    ruido = rng.normal(0, sigma * np.sqrt(1 - phi ** 2), (blocos, BLOCO_AR))
+    ruido[0, 0] = rng.normal(0, sigma)
+    potencias = phi ** np.arange(BLOCO_AR)
+    local = np.cumsum(ruido / potencias, axis=1) * potencias
+    anterior = np.concatenate([[0.0], local[:-1, -1]])
+    return (local + anterior[:, None] * potencias * phi).ravel()[:n]
+
+def generate_site(site, horas=LINHAS_BASE, fim=FIM_PADRAO, latitude=-22.59, semente=0):
+    """Observações horárias de um site: DataFrame indexado por timestamp com VARIAVEIS"""
+    rng = np.random.default_rng(zlib.crc32(f"{site}:{semente}".encode()))
+    timestamps = pd.date_range(end=fim, periods=horas, freq='h')
+    n = len(timestamps)
+
+    dia_ano = timestamps.dayofyear.to_numpy()
+    hora = timestamps.hour.to_numpy()
+    anual = np.cos(2 * np.pi * (dia_ano - 20) / 365.25)      # 1 no verão (jan), -1 no inverno
+    diario = np.sin(2 * np.pi * (hora - 9) / 24)             # máximo às 15h
+
+    # Sites mais ao sul são um pouco mais frios
+    temp = 22 + 0.4 * (latitude + 22.59) + 3.5 * anual + 6 * diario + ar1(rng, n, 0.97, 2.0)
+    umidade_latente = ar1(rng, n, 0.95, 8.0)
+    humidity = np.clip(72 - 2.2 * (temp - 22) + 6 * anual + umidade_latente, 12, 100)
+    dew = temp - (100 - humidity) / 5
+    pressure = 1016 - 4 * anual - 0.3 * (temp - 22) + ar1(rng, n, 0.995, 3.0)
+    windspeed = np.clip(6 + 4 * np.maximum(diario, 0) + ar1(rng, n, 0.9, 3.0), 0, 60)
+    winddir = np.mod(120 + np.cumsum(rng.normal(0, 15, n)), 360)
+
+    # Chuva: eventos quando o latente de umidade é alto, mais frequentes no verão
+    chance = 0.02 + 0.06 * (anual + 1) / 2 + 0.04 * np.maximum(diario, 0)
+    chove = (rng.random(n) < chance) & (umidade_latente > 0)
+    precip = np.where(chove, np.round(rng.exponential(2.0, n), 1), 0.0)
+    cloudcover = np.clip(45 + 25 * anual + 3 * umidade_latente + 40 * chove, 0, 100)
+    visibility = np.clip(20 - 0.8 * precip - 0.05 * cloudcover + rng.normal(0, 1, n), 0.5, 30)
+
+    colunas = {'temp': temp, 'pressure': pressure, 'humidity': humidity, 'dew': dew,
+               'windspeed': windspeed, 'winddir': winddir, 'precip': precip,
+               'visibility': visibility, 'cloudcover': cloudcover}
+    df = pd.DataFrame({col: np.round(colunas[col], 1) for col in VARIAVEIS}, index=timestamps)
+    df.index.name = 'timestamp'
+    return df
+
+def make_sites(n_sites, latitude=-22.5901, longitude=-47.4600):
+    """`n_sites` sites fictícios espalhados em torno do site original ('c1' é o primeiro)"""
+    return [{'site': f"c{i + 1}",
+             'latitude': round(latitude - 0.37 * i, 4),
+             'longitude': round(longitude + 0.29 * i, 4)} for i in range(n_sites)]
+
+def generate(sites, escala=1, fim=FIM_PADRAO, semente=0):
+    """Divide `escala` x LINHAS_BASE horas entre os sites; retorna {site: DataFrame}"""
+    horas = max(int(LINHAS_BASE * escala) // len(sites), 24)
+    return {s['site']: generate_site(s['site'], horas, fim, s['latitude'], semente) for s in sites}
+
+def timeline_chunks(df, latitude, longitude):
+    """Resposta "timeline" do Visual Crossing para `df`, gerada dia a dia em bytes"""
+    yield json.dumps({'queryCost': 1, 'latitude': latitude, 'longitude': longitude,
+                      'resolvedAddress': f"{latitude},{longitude}", 'timezone': 'America/Sao_Paulo'})[:-1].encode()
+    yield b', "days": ['
+    if not df.empty:
+        valores = df[VARIAVEIS].to_numpy(dtype=np.float64).tolist()
+        dias = df.index.strftime('%Y-%m-%d').tolist()
+        horas = df.index.strftime('%H:%M:%S').tolist()
+        inicio = 0
+        for i in range(1, len(df) + 1):
+            if i < len(df) and dias[i] == dias[inicio]:
+                continue
+            dia = {'datetime': dias[inicio],
+                   'hours': [dict(zip(VARIAVEIS, valores[j]), datetime=horas[j], source='obs')
+                             for j in range(inicio, i)]}
+            yield (b'' if inicio == 0 else b',') + json.dumps(dia).encode()
+            inicio = i
+    yield b']}'
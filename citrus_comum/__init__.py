@@ -0,0 +1,4 @@
+"""Código compartilhado entre ingestão, inferência, notificação e desenvolvimento do modelo."""
+
+# O site original continua em citrus1; os demais ficam em citrus_sites1
+SITE_LEGADO = 'c1'
@@ -0,0 +1,113 @@
+"""
+Alvos de janelas de aplicação, avaliados sobre um cubo (dia x hora x variável).
+
+O histórico é projetado uma única vez num array NumPy com uma linha por dia
+calendário e uma coluna por hora; qualquer número de regras (faixas de vento,
+janelas de horário, culturas diferentes) é avaliado de uma vez sobre esse cubo.
+
+Uma regra é um dict com as condições que precisam valer em todas as horas da
+janela de cada uma e quantos dias à frente da âncora ela é avaliada:
+
+    {'condicoes': [{'variavel': 'windspeed', 'min': 3, 'max': 10, 'horas': (6, 8)}, ...],
+     'dias_a_frente': 1}
+
+`min`/`max` são inclusivos e opcionais; `horas` é um intervalo fechado. Hora sem
+observação conta como condição não atendida.
+"""
+import numpy as np
+import pandas as pd
+
+from citrus_comum.features import HORA_ANCORA
+
+NOME_ALVO = 'pulverizar_amanha'
+
+REGRAS = {
+    # Nas horas 6-8 vento entre 3 e 10 km/h, umidade >= 50% e temperatura <= 30 °C;
+    # nenhuma chuva das 6h às 13h
+    NOME_ALVO: {
+        'condicoes': [
+            {'variavel': 'windspeed', 'min': 3, 'max': 10, 'horas': (6, 8)},
+            {'variavel': 'humidity', 'min': 50, 'horas': (6, 8)},
+            {'variavel': 'temp', 'max': 30, 'horas': (6, 8)},
+            {'variavel': 'precip', 'min': 0, 'max': 0, 'horas': (6, 13)},
+        ],
+        'dias_a_frente': 1,
+    },
+}
+
+def rule_variables(regras=REGRAS):
+    """Variáveis usadas pelas regras, na ordem da primeira aparição"""
+    return list(dict.fromkeys(c['variavel'] for regra in regras.values() for c in regra['condicoes']))
+
+def daily_cube(df, variaveis):
+    """
+    Projeta as observações de `df` (indexado por timestamp) num cubo (dia x 24 x variável).
+
+    Retorna (dias, cubo): `dias` é o DatetimeIndex dos dias calendário entre a primeira e
+    a última observação; horas sem observação ficam NaN.
+    """
+    timestamps = pd.DatetimeIndex(df.index).floor('h')
+    primeiro = timestamps.min().normalize()
+    dias = pd.date_range(primeiro, timestamps.max().normalize(), freq='D')
+
+    posicoes = ((timestamps - primeiro) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+    cubo = np.full((len(dias) * 24, len(variaveis)), np.nan)
+    # Em timestamps duplicados vale a primeira observação, como em hourly_grid
+    cubo[posicoes[::-1]] = df[variaveis].to_numpy(dtype=np.float64)[::-1]
+    return dias, cubo.reshape(len(dias), 24, len(variaveis))
+
+def evaluate_rules(dias, cubo, variaveis, regras=REGRAS):
+    """
+    Avalia todas as regras em cada dia do cubo numa única passada.
+
+    Retorna um array booleano (dia x regra): a regra foi atendida naquele dia.
+    """
+    condicoes = [c for regra in regras.values() for c in regra['condicoes']]
+    inicios = np.cumsum([0] + [len(regra['condicoes']) for regra in regras.values()])[:-1]
+
+    colunas = np.array([variaveis.index(c['variavel']) for c in condicoes])
+    minimos = np.array([c.get('min', -np.inf) for c in condicoes], dtype=np.float64)
+    maximos = np.array([c.get('max', np.inf) for c in condicoes], dtype=np.float64)
+    horas = np.arange(24)
+    janelas = np.array([(horas >= c['horas'][0]) & (horas <= c['horas'][1]) for c in condicoes])
+
+    valores = cubo[:, :, colunas]                                # dia x hora x condição
+    atendida = (valores >= minimos) & (valores <= maximos)       # NaN -> False
+    por_condicao = (atendida | ~janelas.T[None, :, :]).all(axis=1)  # dia x condição
+    return np.logical_and.reduceat(por_condicao, inicios, axis=1)
+
+def realized_outcomes(df, regras=REGRAS):
+    """Resultado observado de cada regra por dia calendário (0/1, sem deslocamento)"""
+    variaveis = rule_variables(regras)
+    dias, cubo = daily_cube(df, variaveis)
+    return pd.DataFrame(evaluate_rules(dias, cubo, variaveis, regras).astype('int8'),
+                        index=dias, columns=list(regras))
+
+def make_targets(df, regras=REGRAS, hora=HORA_ANCORA):
+    """
+    Um alvo binário por regra nas âncoras de `df` (linhas da hora `hora`), com o
+    resultado do dia `dias_a_frente` após a âncora. Dias além do fim do histórico
+    valem 0.
+    """
+    df = df.sort_index()
+    timestamps = pd.DatetimeIndex(df.index)
+    ancoras = timestamps[timestamps.hour == hora]
+    if len(ancoras) == 0:
+        return pd.DataFrame(columns=list(regras), index=ancoras, dtype='int8')
+
+    variaveis = rule_variables(regras)
+    dias, cubo = daily_cube(df, variaveis)
+    resultado = evaluate_rules(dias, cubo, variaveis, regras)
+    # Uma linha de False ao final atende os dias posteriores ao histórico
+    resultado = np.vstack([resultado, np.zeros((1, len(regras)), dtype=bool)])
+
+    dia_ancora = ((ancoras.normalize() - dias[0]) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+    a_frente = np.array([regra.get('dias_a_frente', 1) for regra in regras.values()])
+    indices = np.minimum(dia_ancora[:, None] + a_frente[None, :], len(dias))
+
+    return pd.DataFrame(resultado[indices, np.arange(len(regras))].astype('int8'),
+                        index=ancoras, columns=list(regras))
+
+def make_target(df, hora=HORA_ANCORA):
+    """Alvo `pulverizar_amanha` nas âncoras de `df`"""
+    return make_targets(df, {NOME_ALVO: REGRAS[NOME_ALVO]}, hora)
@@ -0,0 +1,276 @@
+"""
+Armazenamento das observações horárias: partições por ano, índice BRIN e agregados diários.
+
+citrus1 e citrus_sites1 passam a ser particionadas por faixa de timestamp, uma
+partição por ano (um ano de um site tem 8760 linhas; partições mensais seriam
+centenas de tabelas minúsculas). As partições são criadas sob demanda antes de cada
+gravação e uma leitura por período só abre as partições do período. O índice BRIN em
+timestamp ocupa poucas páginas por partição e atende as varreduras por faixa.
+
+Dois agregados para consultas e análises por dia em SQL:
+- citrus_diario1: estatísticas do dia por site (mínimo, máximo, média, chuva total)
+- citrus_15h1: a observação da hora das âncoras (15h) por site e dia
+Nenhum job os lê (treino e inferência usam features_hourly), então a gravação das
+observações não os atualiza: são recalculados sob demanda com --agregados (todos os
+sites sem --site) e refletem as observações até a última atualização.
+
+Migração (uma vez, na raiz do repositório; a tabela original fica como <tabela>_legado):
+    python -m citrus_comum.armazenamento --migrar
+    python -m citrus_comum.armazenamento --agregados
+    python -m citrus_comum.armazenamento --agregados --site c2 --inicio 2025-01-01
+"""
+import argparse
+import threading
+
+import pandas as pd
+
+from citrus_comum import SITE_LEGADO
+from citrus_comum.clima import observation_table
+from citrus_comum.features import VARIAVEIS, HORA_ANCORA
+
+# Restrição única de cada tabela de observações (precisa conter a chave de partição)
+RESTRICOES = {
+    'citrus1': 'UNIQUE (timestamp)',
+    'citrus_sites1': 'PRIMARY KEY (site, timestamp)',
+}
+
+TABELA_DIARIO = 'citrus_diario1'
+TABELA_ANCORA = 'citrus_15h1'
+
+# Agregações diárias por variável: sufixo da coluna -> função SQL.
+# winddir fica de fora (média de ângulos não faz sentido com AVG)
+AGREGADOS = {
+    'temp': {'min': 'MIN', 'max': 'MAX', 'media': 'AVG'},
+    'humidity': {'min': 'MIN', 'max': 'MAX', 'media': 'AVG'},
+    'dew': {'media': 'AVG'},
+    'pressure': {'media': 'AVG'},
+    'windspeed': {'max': 'MAX', 'media': 'AVG'},
+    'precip': {'total': 'SUM', 'max': 'MAX'},
+    'visibility': {'media': 'AVG'},
+    'cloudcover': {'media': 'AVG'},
+}
+
+# Partições e tabelas particionadas já vistas neste processo, guardadas só depois do
+# commit da transação que as criou: evita consultar o catálogo a cada lote
+_particoes = set()
+_particionadas = set()
+_lock = threading.Lock()
+
+def daily_columns():
+    """Colunas de citrus_diario1 além de site, dia e contagens: {nome: expressão SQL}"""
+    return {f"{var}_{sufixo}": f"{funcao}({var})"
+            for var, funcoes in AGREGADOS.items() for sufixo, funcao in funcoes.items()}
+
+def is_partitioned(cur, tabela):
+    """True se `tabela` já é uma tabela particionada (só o True fica guardado: a migração pode vir depois)"""
+    from citrus_comum.db import after_commit
+
+    if tabela in _particionadas:
+        return True
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+        )
+    """, [tabela])
+    particionada = bool(cur.fetchone()[0])
+    if particionada:
+        # Na migração a tabela particionada ainda pode ser desta transação
+        after_commit(cur, lambda: _particionadas.add(tabela))
+    return particionada
+
+def ensure_partitions(cur, inicio, fim, tabela='citrus1'):
+    """Cria as partições anuais de `tabela` que cobrem [inicio, fim]; nada se ela não é particionada"""
+    from citrus_comum.db import after_commit
+
+    if not is_partitioned(cur, tabela):
+        return 0
+    criadas = 0
+    for ano in range(pd.Timestamp(inicio).year, pd.Timestamp(fim).year + 1):
+        nome = f"{tabela}_{ano}"
+        with _lock:
+            if nome in _particoes:
+                continue
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {nome} PARTITION OF {tabela}
+            FOR VALUES FROM ('{ano}-01-01') TO ('{ano + 1}-01-01')
+        """)
+        after_commit(cur, lambda nome=nome: _remember_partition(nome))
+        criadas += 1
+    return criadas
+
+def _remember_partition(nome):
+    with _lock:
+        _particoes.add(nome)
+
+def create_brin_index_if_not_exists(cur, tabela='citrus1'):
+    """Índice BRIN em timestamp (numa tabela particionada, vale para todas as partições)"""
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {tabela}_timestamp_brin
+        ON {tabela} USING brin (timestamp)
+    """)
+
+def migrate_to_partitions(cur, tabela='citrus1'):
+    """
+    Converte `tabela` numa tabela particionada por ano, na transação de `cur`.
+
+    A original é renomeada para <tabela>_legado e copiada para a nova; fica no banco
+    para conferência e pode ser removida depois. Sequências (colunas SERIAL) passam a
+    pertencer à nova tabela, para não irem embora junto com a antiga.
+    """
+    cur.execute("SELECT to_regclass(%s)", [tabela])
+    if cur.fetchone()[0] is None:
+        print(f"{tabela} não existe")
+        return False
+    if is_partitioned(cur, tabela):
+        print(f"{tabela} já é particionada")
+        return False
+
+    legado = f"{tabela}_legado"
+    cur.execute(f"ALTER TABLE {tabela} RENAME TO {legado}")
+    cur.execute(f"""
+        CREATE TABLE {tabela} (LIKE {legado} INCLUDING DEFAULTS INCLUDING STORAGE)
+        PARTITION BY RANGE (timestamp)
+    """)
+    cur.execute(f"ALTER TABLE {tabela} ADD {RESTRICOES[tabela]}")
+
+    cur.execute("""
+        SELECT column_name, pg_get_serial_sequence(%s, column_name)
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+          AND position('nextval' in column_default) = 1
+    """, [legado, legado])
+    for coluna, sequencia in cur.fetchall():
+        if sequencia:
+            cur.execute(f"ALTER SEQUENCE {sequencia} OWNED BY {tabela}.{coluna}")
+
+    cur.execute(f"SELECT MIN(timestamp), MAX(timestamp), COUNT(*) FROM {legado}")
+    minimo, maximo, linhas = cur.fetchone()
+    if linhas:
+        ensure_partitions(cur, minimo, maximo, tabela)
+        cur.execute(f"INSERT INTO {tabela} SELECT * FROM {legado}")
+    create_brin_index_if_not_exists(cur, tabela)
+    cur.execute(f"ANALYZE {tabela}")
+    print(f"{tabela}: {linhas} linhas copiadas para partições anuais ({legado} mantida)")
+    return True
+
+def create_rollup_tables_if_not_exist(cur):
+    """Cria citrus_diario1 e citrus_15h1"""
+    colunas = ',\n'.join(f"{nome} FLOAT" for nome in daily_columns())
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELA_DIARIO} (
+            site VARCHAR(100) NOT NULL,
+            dia DATE NOT NULL,
+            horas INTEGER NOT NULL,
+            horas_chuva INTEGER NOT NULL,
+            {colunas},
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site, dia)
+        )
+    """)
+    colunas = ',\n'.join(f"{var} FLOAT" for var in VARIAVEIS)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELA_ANCORA} (
+            site VARCHAR(100) NOT NULL,
+            dia DATE NOT NULL,
+            {colunas},
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site, dia)
+        )
+    """)
+
+def refresh_rollups(cur, inicio=None, fim=None, site=SITE_LEGADO, hora=HORA_ANCORA):
+    """
+    Recalcula os agregados dos dias tocados por [inicio, fim] (sem limites: o histórico todo).
+
+    Os dias são recalculados inteiros a partir das observações, então um dia que
+    recebe horas em dois lotes termina com os mesmos valores de uma carga única.
+    """
+    filtros, params = [], []
+    if site != SITE_LEGADO:
+        filtros.append("site = %s")
+        params.append(site)
+    if inicio is not None:
+        filtros.append("timestamp >= %s")
+        params.append(pd.Timestamp(inicio).normalize().to_pydatetime())
+    if fim is not None:
+        filtros.append("timestamp < %s")
+        params.append((pd.Timestamp(fim).normalize() + pd.Timedelta(days=1)).to_pydatetime())
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    tabela = observation_table(site)
+
+    colunas = daily_columns()
+    cur.execute(f"""
+        INSERT INTO {TABELA_DIARIO} (site, dia, horas, horas_chuva, {', '.join(colunas)})
+        SELECT %s, timestamp::date, COUNT(*), COUNT(*) FILTER (WHERE precip > 0),
+               {', '.join(colunas.values())}
+        FROM {tabela}
+        {where}
+        GROUP BY timestamp::date
+        ON CONFLICT (site, dia) DO UPDATE SET
+            horas = EXCLUDED.horas,
+            horas_chuva = EXCLUDED.horas_chuva,
+            {', '.join(f"{nome} = EXCLUDED.{nome}" for nome in colunas)},
+            updated_at = CURRENT_TIMESTAMP
+    """, [site] + params)
+    dias = max(cur.rowcount, 0)
+
+    filtro_hora = f"{where} AND" if where else "WHERE"
+    cur.execute(f"""
+        INSERT INTO {TABELA_ANCORA} (site, dia, {', '.join(VARIAVEIS)})
+        SELECT %s, timestamp::date, {', '.join(VARIAVEIS)}
+        FROM {tabela}
+        {filtro_hora} EXTRACT(HOUR FROM timestamp) = %s AND EXTRACT(MINUTE FROM timestamp) = 0
+        ON CONFLICT (site, dia) DO UPDATE SET
+            {', '.join(f"{var} = EXCLUDED.{var}" for var in VARIAVEIS)},
+            updated_at = CURRENT_TIMESTAMP
+    """, [site] + params + [hora])
+    return dias
+
+def observed_sites(cur):
+    """Sites com observações, só das tabelas que existem neste banco"""
+    cur.execute("SELECT to_regclass('citrus1'), to_regclass('citrus_sites1')")
+    legado, sites_novos = cur.fetchone()
+    sites = [SITE_LEGADO] if legado is not None else []
+    if sites_novos is not None:
+        cur.execute("SELECT DISTINCT site FROM citrus_sites1")
+        sites += [linha[0] for linha in cur.fetchall() if linha[0] != SITE_LEGADO]
+    return sites
+
+def refresh_all_rollups(sites=None, inicio=None, fim=None):
+    """Recalcula os agregados de `sites` (sem `sites`: todos com observações), uma transação por site"""
+    from citrus_comum.db import transaction
+
+    with transaction() as cur:
+        create_rollup_tables_if_not_exist(cur)
+        if sites is None:
+            sites = observed_sites(cur)
+    for site in sites:
+        with transaction() as cur:
+            print(f"{site}: {refresh_rollups(cur, inicio, fim, site)} dias agregados")
+
+def migrate(tabelas=tuple(RESTRICOES)):
+    """Particiona as tabelas de observações e preenche os agregados de todos os sites"""
+    from citrus_comum.db import transaction
+
+    for tabela in tabelas:
+        with transaction() as cur:
+            migrate_to_partitions(cur, tabela)
+    refresh_all_rollups()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partições e agregados das observações")
+    parser.add_argument("--migrar", action="store_true", help="particiona citrus1/citrus_sites1 e preenche os agregados")
+    parser.add_argument("--agregados", action="store_true", help="recalcula os agregados (todos os sites sem --site)")
+    parser.add_argument("--site", default=None)
+    parser.add_argument("--inicio", default=None)
+    parser.add_argument("--fim", default=None)
+    args = parser.parse_args()
+
+    if args.migrar:
+        migrate()
+    elif args.agregados:
+        refresh_all_rollups(None if args.site is None else [args.site], args.inicio, args.fim)
+    else:
+        parser.print_help()
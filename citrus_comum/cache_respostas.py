@@ -0,0 +1,126 @@
+"""
+Cache em disco das respostas brutas da API do Visual Crossing.
+
+Cada resposta é gravada uma vez, comprimida, com o nome do SHA-256 do conteúdo
+(`objetos/`); um índice por site (`indice/<site>.json`) liga cada pedido (local e
+faixa de horas) ao objeto. Um pedido é atendido pelo cache quando alguma entrada
+válida do mesmo local cobre a faixa pedida, então uma nova tentativa que já avançou
+o watermark continua sem chamar a API paga. Entradas mais velhas que o TTL são
+ignoradas e removidas em `evict()`.
+
+Na Lambda o diretório padrão é /tmp, que sobrevive entre invocações "quentes".
+"""
+import os
+import json
+import gzip
+import time
+import uuid
+import hashlib
+import threading
+
+DIRETORIO_PADRAO = os.environ.get('CITRUS_CACHE_DIR', '/tmp/citrus_cache')
+TTL_PADRAO = int(os.environ.get('CITRUS_CACHE_TTL', 24 * 3600))
+
+TAMANHO_PEDACO = 64 * 1024
+
+class ResponseCache:
+    def __init__(self, diretorio=DIRETORIO_PADRAO, ttl=TTL_PADRAO):
+        self.diretorio = diretorio
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(diretorio, 'objetos'), exist_ok=True)
+        os.makedirs(os.path.join(diretorio, 'indice'), exist_ok=True)
+
+    def _caminho_indice(self, site):
+        return os.path.join(self.diretorio, 'indice', f"{site}.json")
+
+    def _caminho_objeto(self, digest):
+        return os.path.join(self.diretorio, 'objetos', f"{digest}.json.gz")
+
+    def _ler_indice(self, site):
+        try:
+            with open(self._caminho_indice(site)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _gravar_indice(self, site, entradas):
+        caminho = self._caminho_indice(site)
+        temporario = f"{caminho}.{uuid.uuid4().hex}"
+        with open(temporario, 'w') as f:
+            json.dump(entradas, f)
+        os.replace(temporario, caminho)
+
+    def lookup(self, site, local, inicio, fim):
+        """Digest de uma resposta válida de `local` que cubra [inicio, fim], ou None"""
+        agora = time.time()
+        for entrada in reversed(self._ler_indice(site)):
+            if (entrada['local'] == local and agora - entrada['criado'] < self.ttl
+                    and entrada['inicio'] <= inicio and entrada['fim'] >= fim
+                    and os.path.exists(self._caminho_objeto(entrada['digest']))):
+                return entrada['digest']
+        return None
+
+    def read(self, digest, tamanho_pedaco=TAMANHO_PEDACO):
+        """Pedaços de bytes da resposta gravada"""
+        with gzip.open(self._caminho_objeto(digest), 'rb') as f:
+            while True:
+                pedaco = f.read(tamanho_pedaco)
+                if not pedaco:
+                    return
+                yield pedaco
+
+    def store(self, site, local, inicio, fim, pedacos):
+        """
+        Repassa os pedaços de `pedacos` gravando-os no cache.
+
+        A entrada só é registrada quando a resposta termina inteira; uma leitura
+        interrompida não deixa nada no índice.
+        """
+        temporario = os.path.join(self.diretorio, 'objetos', f".{uuid.uuid4().hex}.tmp")
+        sha = hashlib.sha256()
+        completo = False
+        try:
+            with gzip.open(temporario, 'wb', compresslevel=5) as f:
+                for pedaco in pedacos:
+                    sha.update(pedaco)
+                    f.write(pedaco)
+                    yield pedaco
+            completo = True
+        finally:
+            if not completo:
+                os.remove(temporario)
+
+        digest = sha.hexdigest()
+        with self._lock:
+            # Mesmo conteúdo, mesmo objeto: uma resposta repetida não ocupa espaço de novo
+            if os.path.exists(self._caminho_objeto(digest)):
+                os.remove(temporario)
+            else:
+                os.replace(temporario, self._caminho_objeto(digest))
+
+            entradas = self._ler_indice(site)
+            entradas.append({'local': local, 'inicio': inicio, 'fim': fim,
+                             'digest': digest, 'criado': time.time()})
+            self._gravar_indice(site, entradas)
+
+    def evict(self):
+        """Remove entradas vencidas e objetos que nenhuma entrada usa; retorna quantos objetos saíram"""
+        agora = time.time()
+        usados = set()
+        with self._lock:
+            for nome in os.listdir(os.path.join(self.diretorio, 'indice')):
+                if not nome.endswith('.json'):
+                    continue
+                site = nome[:-len('.json')]
+                entradas = [e for e in self._ler_indice(site) if agora - e['criado'] < self.ttl]
+                self._gravar_indice(site, entradas)
+                usados.update(e['digest'] for e in entradas)
+
+            removidos = 0
+            diretorio_objetos = os.path.join(self.diretorio, 'objetos')
+            for nome in os.listdir(diretorio_objetos):
+                if nome.endswith('.json.gz') and nome[:-len('.json.gz')] not in usados:
+                    os.remove(os.path.join(diretorio_objetos, nome))
+                    removidos += 1
+        return removidos
@@ -0,0 +1,86 @@
+"""
+Leitura das observações horárias, independente da tabela onde cada site é gravado,
+e o GET com retentativas usado pela ingestão diária e pela carga histórica.
+"""
+import time
+
+import pandas as pd
+
+from citrus_comum import SITE_LEGADO
+from citrus_comum.features import VARIAVEIS
+
+MAX_TENTATIVAS = 5
+
+def get_with_retry(url, tentativas=MAX_TENTATIVAS, espera_base=1.0, timeout=60, stream=False):
+    """GET com backoff exponencial em 429/5xx, respeitando o Retry-After quando presente"""
+    # Import adiado: a inferência e o notebook usam este módulo sem o requests
+    import requests
+
+    for tentativa in range(tentativas):
+        response = requests.get(url, timeout=timeout, stream=stream)
+        if response.status_code != 429 and response.status_code < 500:
+            break
+        if tentativa == tentativas - 1:
+            break
+        response.close()
+        espera = espera_base * 2 ** tentativa
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            espera = max(espera, float(retry_after))
+        print(f"HTTP {response.status_code}, nova tentativa em {espera:.1f}s")
+        time.sleep(espera)
+    response.raise_for_status()
+    return response
+
+def observation_table(site=SITE_LEGADO):
+    """Tabela com as observações de `site`"""
+    return 'citrus1' if site == SITE_LEGADO else 'citrus_sites1'
+
+def create_sites_table_if_not_exists(cur):
+    """Cria a tabela citrus_sites1 (mesmas colunas de citrus1, chaveada por site)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS citrus_sites1 (
+            site VARCHAR(100) NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            temp FLOAT,
+            pressure FLOAT,
+            humidity FLOAT,
+            dew FLOAT,
+            windspeed FLOAT,
+            winddir FLOAT,
+            precip FLOAT,
+            visibility FLOAT,
+            cloudcover FLOAT,
+            source VARCHAR(20),
+            qualidade SMALLINT,
+            PRIMARY KEY (site, timestamp)
+        )
+    """)
+
+def load_observations(cur, inicio=None, fim=None, site=SITE_LEGADO, variaveis=VARIAVEIS):
+    """Observações de `site` em [inicio, fim] (limites opcionais), indexadas por timestamp"""
+    filtros, params = [], []
+    tabela = observation_table(site)
+    if site != SITE_LEGADO:
+        filtros.append("site = %s")
+        params.append(site)
+    if inicio is not None:
+        filtros.append("timestamp >= %s")
+        params.append(inicio)
+    if fim is not None:
+        filtros.append("timestamp <= %s")
+        params.append(fim)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+
+    cur.execute(f"""
+        SELECT timestamp, {', '.join(variaveis)}
+        FROM {tabela}
+        {where}
+        ORDER BY timestamp
+    """, params)
+
+    columns = [desc[0] for desc in cur.description]
+    df = pd.DataFrame(cur.fetchall(), columns=columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df.index = df['timestamp']
+    return df
@@ -0,0 +1,198 @@
+"""
+Acesso ao banco compartilhado pelos jobs: cache de secrets e conexões reaproveitadas.
+
+Tudo fica em variáveis de módulo, que sobrevivem entre invocações "quentes" da Lambda
+e entre chamadas dentro do mesmo processo do container de inferência.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import boto3
+import pg8000
+
+from citrus_comum import metricas
+
+# Variáveis de ambiente permitem apontar para um Postgres local (ex.: bench/)
+DB_HOST = os.environ.get('DB_HOST', "citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com")
+DB_PORT = int(os.environ.get('DB_PORT', 5432))
+DB_NAME = os.environ.get('DB_NAME', "citrusedge")
+DB_SECRET = os.environ.get('DB_SECRET', 'citrus_edge/citrus_edge_db')
+
+SECRET_TTL = 300          # segundos até buscar o secret de novo
+HEALTHCHECK_APOS = 30     # conexões ociosas há mais tempo que isso são testadas antes do uso
+POOL_MAX = 4              # conexões ociosas mantidas no pool
+
+_clients = {}
+_secrets = {}
+_livres = []
+_lock = threading.Lock()
+
+
+def get_client(servico):
+    """Cliente boto3 reaproveitado por serviço"""
+    with _lock:
+        if servico not in _clients:
+            _clients[servico] = boto3.client(servico)
+        return _clients[servico]
+
+
+def get_secret(secret_name, ttl=SECRET_TTL):
+    """Busca secret do Secrets Manager, com cache em memória por `ttl` segundos"""
+    cache = _secrets.get(secret_name)
+    if cache and time.monotonic() - cache[0] < ttl:
+        return cache[1]
+
+    try:
+        with metricas.span('secret'):
+            response = get_client('secretsmanager').get_secret_value(SecretId=secret_name)
+        valor = json.loads(response['SecretString'])
+    except Exception as e:
+        print(f"Erro ao buscar secret {secret_name}: {str(e)}")
+        raise
+
+    _secrets[secret_name] = (time.monotonic(), valor)
+    return valor
+
+
+def _connect():
+    with metricas.span('conexao'):
+        return _open_connection()
+
+
+# SQLSTATE de senha inválida (invalid_password)
+SENHA_INVALIDA = '28P01'
+
+
+def _sqlstate(erro):
+    """Código SQLSTATE de um pg8000.DatabaseError (o pg8000 passa os campos da resposta num dict)"""
+    campos = erro.args[0] if erro.args else None
+    return campos.get('C') if isinstance(campos, dict) else None
+
+
+def _open_connection():
+    db_secret = get_secret(DB_SECRET)
+    try:
+        return pg8000.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=db_secret['username'],
+            password=db_secret['password']
+        )
+    except pg8000.DatabaseError as e:
+        if _sqlstate(e) != SENHA_INVALIDA:
+            raise
+        # Senha rotacionada: descarta o cache e tenta uma vez com o secret novo
+        print("Senha do banco recusada; buscando o secret de novo")
+        _secrets.pop(DB_SECRET, None)
+        db_secret = get_secret(DB_SECRET)
+        return pg8000.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=db_secret['username'],
+            password=db_secret['password']
+        )
+
+
+def _is_alive(conn):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def acquire():
+    """Retira uma conexão do pool (ou abre uma nova), testando as que estavam ociosas"""
+    while True:
+        with _lock:
+            if not _livres:
+                break
+            conn, ultimo_uso = _livres.pop()
+        if time.monotonic() - ultimo_uso < HEALTHCHECK_APOS or _is_alive(conn):
+            return conn
+        _close(conn)
+    return _connect()
+
+
+def release(conn, descartar=False):
+    """Devolve a conexão ao pool; conexões com erro de rede são descartadas"""
+    with _lock:
+        if not descartar and len(_livres) < POOL_MAX:
+            _livres.append((conn, time.monotonic()))
+            return
+    _close(conn)
+
+
+def close_all():
+    """Fecha todas as conexões ociosas do pool"""
+    with _lock:
+        conexoes = [conn for conn, _ in _livres]
+        _livres.clear()
+    for conn in conexoes:
+        _close(conn)
+
+
+# Funções a rodar depois do commit, por cursor de transaction() aberta
+_apos_commit = {}
+
+
+def after_commit(cur, funcao):
+    """
+    Agenda `funcao()` para depois do commit da transação de `cur`; num rollback ela
+    é descartada. Útil para caches em memória do que a transação criou. Com um
+    cursor aberto fora de `transaction()`, roda na hora.
+    """
+    funcoes = _apos_commit.get(id(cur))
+    if funcoes is None:
+        funcao()
+    else:
+        funcoes.append(funcao)
+
+
+@contextmanager
+def transaction():
+    """
+    Cursor dentro de uma transação: commit ao sair, rollback em caso de erro.
+
+    Uso:
+        with transaction() as cur:
+            cur.execute(...)
+    """
+    conn = acquire()
+    descartar = False
+    funcoes = []
+    try:
+        with conn.cursor() as cur:
+            _apos_commit[id(cur)] = funcoes
+            try:
+                yield cur
+            finally:
+                _apos_commit.pop(id(cur), None)
+        conn.commit()
+        for funcao in funcoes:
+            funcao()
+    except pg8000.InterfaceError:
+        descartar = True
+        raise
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            descartar = True
+        raise
+    finally:
+        release(conn, descartar)
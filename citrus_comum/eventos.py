@@ -0,0 +1,255 @@
+"""
+Eventos entre os jobs: ingestão -> inferência -> notificação.
+
+Cada etapa concluída publica um evento para a próxima:
+- 'observacoes' (fila 'inferencia'): site e faixa de horas gravadas pela ingestão
+- 'previsoes' (fila 'notificacao'): previsões novas ou com score alterado
+
+As filas são SQS em produção (URL em FILA_INFERENCIA / FILA_NOTIFICACAO) e
+`LocalQueue` (fila em memória com as mesmas operações) nos testes locais. Sem fila
+configurada `publish` não faz nada e os jobs seguem rodando só pelo agendamento.
+
+Cada evento carrega o instante de origem da cadeia e, por etapa, o início e o fim do
+processamento; `latencies` transforma isso em espera na fila e duração de cada
+etapa, mais a latência ponta a ponta.
+"""
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+
+from citrus_comum import metricas
+
+FILAS = ('inferencia', 'notificacao')
+
+MAX_TENTATIVAS = 5
+ESPERA_BASE = 1.0
+TAMANHO_DEDUPE = 10_000
+
+_filas = {}
+_lock = threading.Lock()
+
+def event_id(tipo, dados, origem_em):
+    """
+    Identificador determinístico dentro de uma execução da cadeia: o mesmo evento
+    republicado (retry de quem o publica) é reconhecido como repetido, mas uma nova
+    ingestão da mesma faixa tem outra origem e é processada de novo.
+    """
+    return hashlib.sha256(json.dumps([tipo, dados, origem_em], sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+def make_event(tipo, anterior=None, origem_em=None, **dados):
+    """
+    Evento `tipo` com `dados`; com `anterior`, herda a origem e as etapas da cadeia.
+    Sem `anterior`, a origem é `origem_em` (epoch, s) ou o momento da criação.
+    """
+    agora = time.time()
+    origem = anterior['origem_em'] if anterior else (origem_em or agora)
+    return {
+        'tipo': tipo,
+        'id': event_id(tipo, dados, origem),
+        'criado_em': agora,
+        'origem_em': origem,
+        'etapas': list(anterior['etapas']) if anterior else [],
+        **dados,
+    }
+
+def record_stage(evento, etapa, inicio, fim=None):
+    """Registra no evento o início e o fim (epoch, s) de uma etapa"""
+    evento['etapas'].append({'etapa': etapa, 'inicio': inicio, 'fim': fim or time.time()})
+    return evento
+
+def latencies(evento):
+    """
+    Latências em ms: `<etapa>` (processamento), `<etapa>_espera` (da publicação
+    anterior até o início da etapa) e `ponta_a_ponta` (da origem ao fim da última)
+    """
+    resultado = {}
+    anterior = evento['origem_em']
+    for etapa in evento['etapas']:
+        resultado[f"{etapa['etapa']}_espera"] = max(etapa['inicio'] - anterior, 0) * 1000
+        resultado[etapa['etapa']] = (etapa['fim'] - etapa['inicio']) * 1000
+        anterior = etapa['fim']
+    if evento['etapas']:
+        resultado['ponta_a_ponta'] = (evento['etapas'][-1]['fim'] - evento['origem_em']) * 1000
+    return resultado
+
+def report_latencies(evento):
+    """Soma as latências do evento nos spans `latencia_<nome>` da execução e as imprime"""
+    resultado = latencies(evento)
+    for nome, ms in resultado.items():
+        metricas.record(f"latencia_{nome}", ms)
+    print(f"Latências do evento {evento['tipo']} {evento['id']} (ms): "
+          + ', '.join(f"{nome}={ms:.0f}" for nome, ms in resultado.items()))
+    return resultado
+
+class LocalQueue:
+    """
+    Fila em memória com a semântica usada do SQS: receive/ack/nack.
+
+    Uma mensagem recebida e não confirmada volta à fila (nack) com atraso; depois de
+    `max_tentativas` recebimentos vai para `mortas`, como a redrive policy do SQS.
+    """
+
+    def __init__(self, max_tentativas=MAX_TENTATIVAS):
+        self.max_tentativas = max_tentativas
+        self.mortas = []
+        self._fila = queue.Queue()
+        self._tentativas = {}
+        self._pendentes = 0
+        self._cond = threading.Condition()
+
+    def send(self, evento):
+        with self._cond:
+            self._pendentes += 1
+        self._fila.put(json.dumps(evento))
+
+    def receive(self, espera=1.0):
+        """Próximo (recibo, evento) ou None se nada chegar em `espera` segundos"""
+        try:
+            corpo = self._fila.get(timeout=espera)
+        except queue.Empty:
+            return None
+        evento = json.loads(corpo)
+        recibo = (evento['id'], corpo)
+        self._tentativas[recibo] = self._tentativas.get(recibo, 0) + 1
+        return recibo, evento
+
+    def ack(self, recibo):
+        self._tentativas.pop(recibo, None)
+        self._done()
+
+    def nack(self, recibo, atraso=0.0):
+        if self._tentativas.get(recibo, 0) >= self.max_tentativas:
+            self.mortas.append(json.loads(recibo[1]))
+            self._tentativas.pop(recibo, None)
+            self._done()
+            return
+        if atraso:
+            threading.Timer(atraso, self._fila.put, args=(recibo[1],)).start()
+        else:
+            self._fila.put(recibo[1])
+
+    def attempts(self, recibo):
+        return self._tentativas.get(recibo, 1)
+
+    def _done(self):
+        with self._cond:
+            self._pendentes -= 1
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Espera até todas as mensagens enviadas serem confirmadas ou descartadas"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pendentes == 0, timeout)
+
+class SqsQueue:
+    """Fila SQS com a mesma interface de `LocalQueue` (retentativas pela redrive policy da fila)"""
+
+    def __init__(self, url):
+        self.url = url
+
+    @property
+    def _client(self):
+        from citrus_comum.db import get_client
+        return get_client('sqs')
+
+    def send(self, evento):
+        self._client.send_message(QueueUrl=self.url, MessageBody=json.dumps(evento))
+
+    def receive(self, espera=20):
+        resposta = self._client.receive_message(QueueUrl=self.url, MaxNumberOfMessages=1,
+                                                WaitTimeSeconds=int(espera),
+                                                AttributeNames=['ApproximateReceiveCount'])
+        mensagens = resposta.get('Messages', [])
+        if not mensagens:
+            return None
+        mensagem = mensagens[0]
+        recibo = (mensagem['ReceiptHandle'], int(mensagem['Attributes'].get('ApproximateReceiveCount', 1)))
+        return recibo, json.loads(mensagem['Body'])
+
+    def ack(self, recibo):
+        self._client.delete_message(QueueUrl=self.url, ReceiptHandle=recibo[0])
+
+    def nack(self, recibo, atraso=0.0):
+        self._client.change_message_visibility(QueueUrl=self.url, ReceiptHandle=recibo[0],
+                                               VisibilityTimeout=int(atraso))
+
+    def attempts(self, recibo):
+        return recibo[1]
+
+def set_queue(nome, fila):
+    """Substitui a fila `nome` (ex.: por uma LocalQueue nos testes); None volta ao padrão"""
+    with _lock:
+        if fila is None:
+            _filas.pop(nome, None)
+        else:
+            _filas[nome] = fila
+
+def get_queue(nome):
+    """Fila `nome`: a definida por `set_queue` ou a SQS de FILA_<NOME>; None se não houver"""
+    with _lock:
+        if nome not in _filas:
+            url = os.environ.get(f"FILA_{nome.upper()}")
+            if not url:
+                return None
+            _filas[nome] = SqsQueue(url)
+        return _filas[nome]
+
+def publish(nome, evento):
+    """Publica `evento` na fila `nome`; retorna False se não há fila configurada"""
+    fila = get_queue(nome)
+    if fila is None:
+        return False
+    fila.send(evento)
+    return True
+
+class Dedupe:
+    """Identificadores de eventos já processados (os mais recentes, limitado a `tamanho`)"""
+
+    def __init__(self, tamanho=TAMANHO_DEDUPE):
+        self.tamanho = tamanho
+        self._vistos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, chave):
+        with self._lock:
+            return chave in self._vistos
+
+    def add(self, chave):
+        with self._lock:
+            self._vistos[chave] = True
+            self._vistos.move_to_end(chave)
+            while len(self._vistos) > self.tamanho:
+                self._vistos.popitem(last=False)
+
+def consume(fila, handler, parar=None, dedupe=None, espera=1.0, espera_base=ESPERA_BASE):
+    """
+    Processa eventos de `fila` com `handler(evento)` até `parar` (threading.Event) ser sinalizado.
+
+    Sucesso confirma a mensagem; exceção devolve a mensagem com backoff exponencial
+    (nova tentativa). Eventos já processados (mesmo id) são só confirmados.
+    """
+    dedupe = dedupe or Dedupe()
+    parar = parar or threading.Event()
+    while not parar.is_set():
+        recebido = fila.receive(espera)
+        if recebido is None:
+            continue
+        recibo, evento = recebido
+        if dedupe.seen(evento['id']):
+            fila.ack(recibo)
+            continue
+        try:
+            handler(evento)
+        except Exception as e:
+            tentativa = fila.attempts(recibo)
+            atraso = espera_base * 2 ** (tentativa - 1)
+            print(f"Evento {evento['tipo']} {evento['id']}: erro na tentativa {tentativa} ({e}); "
+                  f"nova tentativa em {atraso:.1f}s")
+            fila.nack(recibo, atraso)
+            continue
+        dedupe.add(evento['id'])
+        fila.ack(recibo)
@@ -0,0 +1,146 @@
+"""
+Tabela features_hourly: features de lag pré-calculadas, atualizadas pela ingestão.
+
+Cada lote novo de horas recalcula só as âncoras cujos lags alcançam essas horas, e
+inferência/treino leem as features prontas por faixa de datas em vez de remontá-las
+a partir do histórico bruto.
+
+Cada linha guarda em `esquema` o hash da lista de features com que foi calculada
+(o mesmo hash de feature_schemas1). Quando LAGS ou VARIAVEIS mudam, as colunas
+novas são acrescentadas na criação da tabela e a leitura só devolve linhas do
+esquema atual: as âncoras antigas somem da leitura até serem recalculadas, e quem
+lê calcula as que faltarem a partir das observações.
+"""
+import numpy as np
+import pandas as pd
+
+from citrus_comum.clima import SITE_LEGADO, load_observations
+from citrus_comum.features import LAGS, HORA_ANCORA, all_lags, feature_names, make_lag_features
+from citrus_comum.snapshots import schema_hash
+
+TABELA = 'features_hourly'
+
+# 75 parâmetros por linha (site, timestamp, esquema e 72 features) x 500 linhas,
+# abaixo do limite de 65535 do protocolo
+TAMANHO_LOTE = 500
+
+def feature_set_version(lags=LAGS):
+    """Hash da lista de features de `lags`, gravado em `esquema` em cada linha"""
+    return schema_hash(feature_names(lags))
+
+def _missing_columns(cur, nomes):
+    """Colunas de `nomes` (e `esquema`) ausentes em features_hourly; todas se a tabela não existe"""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    """, [TABELA])
+    existentes = {linha[0] for linha in cur.fetchall()}
+    return [nome for nome in ['esquema'] + list(nomes) if nome not in existentes]
+
+def create_feature_table_if_not_exists(cur, lags=LAGS):
+    """Cria features_hourly e acrescenta as colunas de features que ainda não existem"""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELA} (
+            site VARCHAR(100) NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site, timestamp)
+        )
+    """)
+    # ALTER só com colunas faltando: mesmo sem efeito ele trava a tabela
+    faltantes = _missing_columns(cur, feature_names(lags))
+    if faltantes:
+        colunas = [f"{nome} {'CHAR(64)' if nome == 'esquema' else 'FLOAT'}" for nome in faltantes]
+        cur.execute(f"""
+            ALTER TABLE {TABELA}
+            {', '.join(f"ADD COLUMN IF NOT EXISTS {coluna}" for coluna in colunas)}
+        """)
+
+def upsert_features(cur, features, site=SITE_LEGADO):
+    """Grava (ou sobrescreve) as linhas de `features`, indexado por timestamp"""
+    if features.empty:
+        return 0
+
+    nomes = list(features.columns)
+    colunas = ['site', 'timestamp', 'esquema'] + nomes
+    esquema = schema_hash(nomes)
+    placeholder = '(' + ', '.join(['%s'] * len(colunas)) + ')'
+    atualizacao = ', '.join(f"{nome} = EXCLUDED.{nome}" for nome in nomes)
+
+    valores = features.to_numpy(dtype=np.float64)
+    valores = np.where(np.isnan(valores), None, valores).tolist()
+    timestamps = [ts.to_pydatetime() for ts in features.index]
+
+    for i in range(0, len(features), TAMANHO_LOTE):
+        params = []
+        for ts, linha in zip(timestamps[i:i + TAMANHO_LOTE], valores[i:i + TAMANHO_LOTE]):
+            params.append(site)
+            params.append(ts)
+            params.append(esquema)
+            params.extend(linha)
+        n_linhas = len(params) // len(colunas)
+        cur.execute(f"""
+            INSERT INTO {TABELA} ({', '.join(colunas)})
+            VALUES {', '.join([placeholder] * n_linhas)}
+            ON CONFLICT (site, timestamp) DO UPDATE SET
+                esquema = EXCLUDED.esquema,
+                {atualizacao},
+                updated_at = CURRENT_TIMESTAMP
+        """, params)
+    return len(features)
+
+def refresh_features(cur, inicio, fim, site=SITE_LEGADO, lags=LAGS, hora=HORA_ANCORA):
+    """
+    Recalcula as âncoras afetadas por novas horas em [inicio, fim].
+
+    Uma hora nova entra nos lags das âncoras até max(lag) horas depois dela, então a
+    faixa atualizada é [inicio, fim + max(lag)], lendo max(lag) horas antes de `inicio`.
+    """
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+    maior_lag = pd.Timedelta(hours=max(all_lags(lags)))
+
+    obs = load_observations(cur, (inicio - maior_lag).to_pydatetime(), (fim + maior_lag).to_pydatetime(), site)
+    if obs.empty:
+        return 0
+
+    features = make_lag_features(obs, lags, hora=hora)
+    features = features[(features.index >= inicio) & (features.index <= fim + maior_lag)]
+    return upsert_features(cur, features, site)
+
+def read_features(cur, inicio=None, fim=None, site=SITE_LEGADO, lags=LAGS):
+    """
+    Features pré-calculadas de `site` em [inicio, fim], na ordem de colunas do modelo.
+
+    Só linhas calculadas com o conjunto de features de `lags`; se a tabela ainda não
+    tem as colunas dele, devolve um DataFrame vazio (quem lê calcula a partir das
+    observações).
+    """
+    nomes = feature_names(lags)
+    if _missing_columns(cur, nomes):
+        return pd.DataFrame(columns=nomes, index=pd.DatetimeIndex([], name='timestamp'), dtype=np.float64)
+    filtros, params = ["site = %s", "esquema = %s"], [site, feature_set_version(lags)]
+    if inicio is not None:
+        filtros.append("timestamp >= %s")
+        params.append(inicio)
+    if fim is not None:
+        filtros.append("timestamp <= %s")
+        params.append(fim)
+
+    cur.execute(f"""
+        SELECT timestamp, {', '.join(nomes)}
+        FROM {TABELA}
+        WHERE {' AND '.join(filtros)}
+        ORDER BY timestamp
+    """, params)
+
+    df = pd.DataFrame(cur.fetchall(), columns=['timestamp'] + nomes)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.set_index('timestamp')
+    return df.astype(np.float64)
+
+def rebuild_features(cur, site=SITE_LEGADO, lags=LAGS, hora=HORA_ANCORA):
+    """Recalcula a tabela inteira para `site` a partir do histórico (carga inicial)"""
+    obs = load_observations(cur, site=site)
+    if obs.empty:
+        return 0
+    return upsert_features(cur, make_lag_features(obs, lags, hora=hora), site)
@@ -0,0 +1,75 @@
+"""
+Features de lag sobre a grade horária regular, compartilhadas entre treino e inferência.
+"""
+import numpy as np
+import pandas as pd
+
+VARIAVEIS = ['temp', 'pressure', 'humidity', 'dew', 'windspeed',
+             'winddir', 'precip', 'visibility', 'cloudcover']
+
+# Ordem dos grupos, dos lags e das variáveis define a ordem das colunas do modelo
+LAGS = {
+    'short': [1, 3, 6],
+    'long': [12, 18, 24, 48, 72],
+}
+
+HORA_ANCORA = 15
+
+def all_lags(lags=LAGS):
+    """Lista achatada dos lags, na ordem das colunas"""
+    return [lag for lags_grupo in lags.values() for lag in lags_grupo]
+
+def feature_names(lags=LAGS, variaveis=VARIAVEIS):
+    """Nomes das features no formato '{variavel}_{tag}_lag{lag}h'"""
+    return [f'{col}_{tag}_lag{lag}h'
+            for tag, lags_grupo in lags.items()
+            for lag in lags_grupo
+            for col in variaveis]
+
+def hourly_grid(df, variaveis=VARIAVEIS):
+    """
+    Projeta as observações numa grade horária regular.
+
+    Retorna (inicio, grade, posicoes): `grade` tem uma linha por hora entre a primeira e a
+    última observação (NaN nas horas ausentes) e `posicoes` é a linha de cada observação.
+    """
+    timestamps = pd.DatetimeIndex(df.index).floor('h')
+    inicio = timestamps.min()
+    posicoes = ((timestamps - inicio) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+
+    grade = np.full((posicoes.max() + 1, len(variaveis)), np.nan)
+    # Em timestamps duplicados vale a primeira observação, como no drop_duplicates da ingestão
+    grade[posicoes[::-1]] = df[variaveis].to_numpy(dtype=np.float64)[::-1]
+    return inicio, grade, posicoes
+
+def make_lag_features(df, lags=LAGS, hora=None, variaveis=VARIAVEIS):
+    """
+    Monta o bloco (timestamp x lag x variável) com um único gather sobre a grade horária.
+
+    `df` é indexado por timestamp. Horas ausentes viram NaN nos lags em vez de desalinhar
+    as linhas seguintes, como acontecia com shift posicional. Com `hora` só as linhas
+    daquela hora do dia são avaliadas (ex.: 15 para as âncoras do modelo).
+    """
+    df = df.sort_index()
+    if hora is not None:
+        mascara = df.index.hour == hora
+    else:
+        mascara = np.ones(len(df), dtype=bool)
+
+    if not mascara.any():
+        return pd.DataFrame(columns=feature_names(lags, variaveis), index=df.index[:0], dtype=np.float64)
+
+    _, grade, posicoes = hourly_grid(df, variaveis)
+    ancoras = posicoes[mascara]
+    lags_array = np.asarray(all_lags(lags), dtype=np.int64)
+
+    # Uma linha extra de NaN no início da grade atende os lags anteriores à primeira observação
+    grade = np.vstack([np.full((1, grade.shape[1]), np.nan), grade])
+    indices = np.maximum(ancoras[:, None] - lags_array[None, :] + 1, 0)
+    bloco = grade[indices]
+
+    return pd.DataFrame(
+        bloco.reshape(len(ancoras), -1),
+        index=df.index[mascara],
+        columns=feature_names(lags, variaveis),
+    )
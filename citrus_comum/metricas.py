@@ -0,0 +1,155 @@
+"""
+Instrumentação leve dos jobs: tempos por etapa, contadores e pico de memória.
+
+Uso:
+    with metricas.span('busca'):
+        ...
+    metricas.count('linhas_inseridas', n)
+
+    @metricas.instrumented('ingestao_diaria')
+    def lambda_handler(event, context): ...
+
+Ao fim de cada execução instrumentada sai uma linha JSON no formato Embedded Metric
+Format (EMF) do CloudWatch: o CloudWatch Logs a transforma em métricas do namespace
+CitrusEdge sem nenhuma chamada de API. Os spans acumulam a duração por nome (somando
+threads e repetições).
+
+Perfil opcional: CITRUS_PROFILE=cprofile (ou pyinstrument, se instalado) grava o
+perfil de cada execução em CITRUS_PROFILE_DIR (padrão /tmp). Sem a variável, o custo
+de um span é o de duas leituras de relógio e uma soma.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+NAMESPACE = 'CitrusEdge'
+
+_duracoes = {}
+_contagens = {}
+_contadores = {}
+_lock = threading.Lock()
+
+@contextmanager
+def span(nome):
+    """Soma a duração do bloco em `span.<nome>` (ms)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(nome, (time.perf_counter() - inicio) * 1000)
+
+def record(nome, ms):
+    """Soma uma duração medida fora de um span (ex.: latência entre etapas) em `span.<nome>`"""
+    with _lock:
+        _duracoes[nome] = _duracoes.get(nome, 0.0) + ms
+        _contagens[nome] = _contagens.get(nome, 0) + 1
+
+def count(nome, valor=1):
+    """Soma `valor` ao contador `nome` (linhas, bytes, mensagens...)"""
+    with _lock:
+        _contadores[nome] = _contadores.get(nome, 0) + valor
+
+def peak_rss_mb():
+    """Pico de memória residente do processo, em MB"""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+def reset():
+    with _lock:
+        _duracoes.clear()
+        _contagens.clear()
+        _contadores.clear()
+
+def snapshot():
+    """Cópia das métricas acumuladas: {'spans': {nome: (ms, n)}, 'contadores': {...}}"""
+    with _lock:
+        return {'spans': {nome: (_duracoes[nome], _contagens[nome]) for nome in _duracoes},
+                'contadores': dict(_contadores)}
+
+def emf_record(servico, dimensoes=None):
+    """Registro EMF com os spans, contadores e pico de RSS acumulados"""
+    dimensoes = {'servico': servico, **(dimensoes or {})}
+    atual = snapshot()
+    valores, definicoes = {}, []
+    for nome, (ms, _) in sorted(atual['spans'].items()):
+        valores[f"span.{nome}"] = round(ms, 2)
+        definicoes.append({'Name': f"span.{nome}", 'Unit': 'Milliseconds'})
+    for nome, valor in sorted(atual['contadores'].items()):
+        valores[nome] = valor
+        definicoes.append({'Name': nome, 'Unit': 'Bytes' if nome.startswith('bytes') else 'Count'})
+    valores['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    definicoes.append({'Name': 'peak_rss_mb', 'Unit': 'Megabytes'})
+
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensoes)],
+                'Metrics': definicoes,
+            }],
+        },
+        **dimensoes,
+        **valores,
+        # Número de vezes que cada span rodou: contexto no log, fora das métricas
+        'span_execucoes': {nome: n for nome, (_, n) in atual['spans'].items()},
+    }
+
+def flush(servico, **dimensoes):
+    """Emite a linha EMF no stdout (CloudWatch Logs na Lambda e no container) e zera o estado"""
+    print(json.dumps(emf_record(servico, dimensoes), ensure_ascii=False), flush=True)
+    reset()
+
+@contextmanager
+def _profiler(servico):
+    modo = os.environ.get('CITRUS_PROFILE', '').lower()
+    if not modo:
+        yield
+        return
+
+    diretorio = os.environ.get('CITRUS_PROFILE_DIR', '/tmp')
+    os.makedirs(diretorio, exist_ok=True)
+    base = os.path.join(diretorio, f"{servico}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    if modo == 'pyinstrument':
+        from pyinstrument import Profiler
+        perfil = Profiler()
+        perfil.start()
+        try:
+            yield
+        finally:
+            perfil.stop()
+            with open(base + '.html', 'w') as f:
+                f.write(perfil.output_html())
+            print(f"Perfil gravado em {base}.html")
+        return
+
+    import cProfile
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        perfil.dump_stats(base + '.prof')
+        print(f"Perfil gravado em {base}.prof")
+
+def instrumented(servico):
+    """Decora o ponto de entrada de um job: mede o total, aplica o perfil opcional e emite o EMF"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def executar(*args, **kwargs):
+            reset()
+            try:
+                with _profiler(servico), span('total'):
+                    return funcao(*args, **kwargs)
+            finally:
+                flush(servico)
+        return executar
+    return decorador
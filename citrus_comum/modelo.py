@@ -0,0 +1,77 @@
+"""
+Artefatos de modelo no formato nativo do CatBoost (.cbm) com manifesto de versão.
+
+Cada modelo `cb_vN.cbm` tem ao lado um `cb_vN.json` com o sistema, o hash SHA-256 do
+arquivo, a versão do CatBoost e a lista de features. O carregamento confere o hash
+(lido via mmap, sem copiar o arquivo para a memória do Python) e as features antes
+de entregar o modelo.
+
+Conversão de um pickle antigo:
+    python -m citrus_comum.modelo cb_v0.pkl cb_v0.cbm pulverizar_c1_v0
+"""
+import os
+import sys
+import json
+import mmap
+import pickle
+import hashlib
+from datetime import datetime
+
+def manifest_path(caminho_modelo):
+    return os.path.splitext(caminho_modelo)[0] + ".json"
+
+def file_sha256(caminho):
+    """SHA-256 do arquivo lido por mmap"""
+    with open(caminho, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.sha256(mm).hexdigest()
+
+def export_model(modelo, caminho_modelo, sistema, features, extra=None):
+    """Salva `modelo` em .cbm e escreve o manifesto ao lado (com os campos de `extra`)"""
+    import catboost
+
+    modelo.save_model(caminho_modelo, format="cbm")
+    manifesto = {
+        'sistema': sistema,
+        'arquivo': os.path.basename(caminho_modelo),
+        'sha256': file_sha256(caminho_modelo),
+        'catboost_version': catboost.__version__,
+        'features': list(features),
+        'criado_em': datetime.now().isoformat(),
+        **(extra or {}),
+    }
+    with open(manifest_path(caminho_modelo), "w") as f:
+        json.dump(manifesto, f, indent=2)
+    return manifesto
+
+def read_manifest(caminho_modelo):
+    with open(manifest_path(caminho_modelo)) as f:
+        return json.load(f)
+
+def load_model(caminho_modelo, features=None):
+    """
+    Carrega um .cbm conferindo hash e, se informado, a lista de features esperada.
+    Retorna (modelo, manifesto).
+    """
+    manifesto = read_manifest(caminho_modelo)
+
+    sha256 = file_sha256(caminho_modelo)
+    if sha256 != manifesto['sha256']:
+        raise ValueError(f"Hash de {caminho_modelo} não confere com o manifesto: {sha256}")
+    if features is not None and list(features) != manifesto['features']:
+        raise ValueError(f"Features do modelo {manifesto['sistema']} diferem das features atuais")
+
+    # Import adiado: é o módulo mais pesado do container
+    from catboost import CatBoostClassifier
+
+    modelo = CatBoostClassifier()
+    modelo.load_model(caminho_modelo, format="cbm")
+    return modelo, manifesto
+
+def convert_pickle(caminho_pickle, caminho_modelo, sistema):
+    """Converte um modelo salvo com pickle (formato antigo) para .cbm + manifesto"""
+    with open(caminho_pickle, "rb") as f:
+        modelo = pickle.load(f)
+    return export_model(modelo, caminho_modelo, sistema, modelo.feature_names_)
+
+if __name__ == "__main__":
+    print(json.dumps(convert_pickle(*sys.argv[1:4]), indent=2))
@@ -0,0 +1,266 @@
+"""
+Leitura das previsões: última por site/sistema e histórico por faixa de datas.
+
+A tabela predictions1_latest guarda uma linha por (site, sistema) e é mantida por
+quem grava em predictions1 (`record_latest`), então "a última previsão" vira uma
+busca por chave em vez de uma ordenação da tabela inteira. As leituras passam por
+um cache LRU em memória, descartado quando predictions1_latest muda de versão
+(maior updated_at). A versão é consultada no máximo a cada TTL_VERSAO segundos;
+gravações deste processo (`record_latest`) invalidam o cache na hora, as de outro
+processo aparecem em até TTL_VERSAO segundos.
+
+Servidor HTTP local:
+    python -m citrus_comum.previsoes --porta 8080
+    GET /latest?site=c1&sistema=pulverizar_c1_v0
+    GET /history?sistema=pulverizar_c1_v0&inicio=2025-01-01&fim=2025-01-31
+"""
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from citrus_comum.db import after_commit, transaction
+
+TABELA_ULTIMAS = 'predictions1_latest'
+
+TAMANHO_CACHE = 256
+TTL_VERSAO = 5.0          # segundos entre consultas da versão de predictions1_latest
+
+def create_prediction_indexes_if_not_exist(cur):
+    """
+    Índices de predictions1 e a tabela de últimas previsões. Na primeira criação,
+    predictions1_latest é preenchida a partir do que já existe em predictions1.
+    """
+    # Histórico por sistema e faixa de datas
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS predictions1_sistema_dia_idx
+        ON predictions1 (sistema, dia_previsto)
+    """)
+    # Última previsão geral (ORDER BY dia_previsto DESC, created_at DESC LIMIT 1)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS predictions1_dia_created_idx
+        ON predictions1 (dia_previsto DESC, created_at DESC)
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELA_ULTIMAS} (
+            site VARCHAR(100) NOT NULL,
+            sistema VARCHAR(100) NOT NULL,
+            dia_previsto DATE NOT NULL,
+            score FLOAT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+            PRIMARY KEY (site, sistema)
+        )
+    """)
+    cur.execute(f"""
+        INSERT INTO {TABELA_ULTIMAS} (site, sistema, dia_previsto, score, created_at)
+        SELECT DISTINCT ON (site, sistema) site, sistema, dia_previsto, score, created_at
+        FROM predictions1
+        WHERE NOT EXISTS (SELECT 1 FROM {TABELA_ULTIMAS})
+        ORDER BY site, sistema, dia_previsto DESC, created_at DESC
+        ON CONFLICT (site, sistema) DO NOTHING
+    """)
+
+def record_latest(cur, previsoes):
+    """
+    Atualiza predictions1_latest com previsões recém-gravadas em predictions1
+    (tuplas site, sistema, dia_previsto, score). Só avança o dia de cada
+    (site, sistema); repontuar dias antigos não substitui a última previsão, mas
+    muda a versão e com isso invalida o cache do histórico, depois do commit:
+    antes dele outra leitura ainda veria e guardaria a versão anterior.
+    """
+    ultimas = {}
+    for site, sistema, dia_previsto, score in previsoes:
+        chave = (site, sistema)
+        if chave not in ultimas or dia_previsto >= ultimas[chave][0]:
+            ultimas[chave] = (dia_previsto, score)
+    if not ultimas:
+        return
+
+    params = []
+    for (site, sistema), (dia_previsto, score) in ultimas.items():
+        params.extend([site, sistema, dia_previsto, score])
+    # Com empate no dia vale a gravação mais nova, como no ORDER BY created_at DESC
+    cur.execute(f"""
+        INSERT INTO {TABELA_ULTIMAS} AS u (site, sistema, dia_previsto, score, created_at)
+        SELECT v.site, v.sistema, v.dia_previsto::date, v.score::float, CURRENT_TIMESTAMP
+        FROM (VALUES {', '.join(['(%s, %s, %s, %s)'] * len(ultimas))}) AS v (site, sistema, dia_previsto, score)
+        ON CONFLICT (site, sistema) DO UPDATE SET
+            dia_previsto = CASE WHEN EXCLUDED.dia_previsto >= u.dia_previsto THEN EXCLUDED.dia_previsto ELSE u.dia_previsto END,
+            score = CASE WHEN EXCLUDED.dia_previsto >= u.dia_previsto THEN EXCLUDED.score ELSE u.score END,
+            created_at = CASE WHEN EXCLUDED.dia_previsto >= u.dia_previsto THEN EXCLUDED.created_at ELSE u.created_at END,
+            updated_at = clock_timestamp()
+    """, params)
+    after_commit(cur, cache.clear)
+
+class LRUCache:
+    """Cache LRU thread-safe, esvaziado quando a versão informada muda"""
+
+    def __init__(self, tamanho=TAMANHO_CACHE):
+        self.tamanho = tamanho
+        self.versao = None
+        self._verificada = None
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checked_version(self, ttl):
+        """(versão,) se ela foi lida do banco há menos de `ttl` segundos; senão None"""
+        with self._lock:
+            if self._verificada and time.monotonic() - self._verificada[0] < ttl:
+                return (self._verificada[1],)
+            return None
+
+    def set_checked_version(self, versao):
+        with self._lock:
+            self._verificada = (time.monotonic(), versao)
+
+    def get(self, chave, versao):
+        with self._lock:
+            if versao != self.versao:
+                self._itens.clear()
+                self.versao = versao
+                return None
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def put(self, chave, versao, valor):
+        with self._lock:
+            if versao != self.versao:
+                return
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self.versao = None
+            self._verificada = None
+
+cache = LRUCache()
+
+def _version(cur):
+    verificada = cache.checked_version(TTL_VERSAO)
+    if verificada is not None:
+        return verificada[0]
+    cur.execute(f"SELECT max(updated_at) FROM {TABELA_ULTIMAS}")
+    versao = cur.fetchone()[0]
+    cache.set_checked_version(versao)
+    return versao
+
+def _cached(cur, chave, consulta):
+    versao = _version(cur)
+    resultado = cache.get(chave, versao)
+    if resultado is None:
+        resultado = consulta()
+        cache.put(chave, versao, resultado)
+    return resultado
+
+def _isoformat(valor):
+    return valor.isoformat() if hasattr(valor, 'isoformat') else valor
+
+def latest_predictions(cur, site=None, sistema=None):
+    """Última previsão de cada (site, sistema), opcionalmente filtrada"""
+    def consulta():
+        filtros, params = [], []
+        if site is not None:
+            filtros.append("site = %s")
+            params.append(site)
+        if sistema is not None:
+            filtros.append("sistema = %s")
+            params.append(sistema)
+        where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+        cur.execute(f"""
+            SELECT site, sistema, dia_previsto, score, created_at
+            FROM {TABELA_ULTIMAS}
+            {where}
+            ORDER BY site, sistema
+        """, params)
+        return [{
+            'site': row[0],
+            'sistema': row[1],
+            'dia_previsto': _isoformat(row[2]),
+            'score': None if row[3] is None else float(row[3]),
+            'created_at': _isoformat(row[4]),
+        } for row in cur.fetchall()]
+
+    return _cached(cur, ('latest', site, sistema), consulta)
+
+def prediction_history(cur, sistema, inicio, fim, site=None):
+    """Previsões de `sistema` com dia_previsto em [inicio, fim], em ordem de data"""
+    def consulta():
+        filtro_site = "AND site = %s" if site is not None else ""
+        params = [sistema, inicio, fim] + ([site] if site is not None else [])
+        cur.execute(f"""
+            SELECT site, dia_previsto, score, created_at
+            FROM predictions1
+            WHERE sistema = %s AND dia_previsto BETWEEN %s AND %s {filtro_site}
+            ORDER BY dia_previsto
+        """, params)
+        return [{
+            'site': row[0],
+            'sistema': sistema,
+            'dia_previsto': _isoformat(row[1]),
+            'score': None if row[2] is None else float(row[2]),
+            'created_at': _isoformat(row[3]),
+        } for row in cur.fetchall()]
+
+    return _cached(cur, ('history', sistema, str(inicio), str(fim), site), consulta)
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """GET /latest e GET /history, respostas em JSON"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            with transaction() as cur:
+                if url.path == '/latest':
+                    corpo = latest_predictions(cur, params.get('site'), params.get('sistema'))
+                elif url.path == '/history':
+                    if 'sistema' not in params:
+                        return self._send(400, {'error': "Parâmetro 'sistema' é obrigatório"})
+                    fim = date.fromisoformat(params.get('fim', date.today().isoformat()))
+                    inicio = date.fromisoformat(params.get('inicio', fim.replace(day=1).isoformat()))
+                    corpo = prediction_history(cur, params['sistema'], inicio, fim, params.get('site'))
+                else:
+                    return self._send(404, {'error': f"Rota desconhecida: {url.path}"})
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': str(e)})
+        self._send(200, corpo)
+
+    def _send(self, status, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+def serve(host='127.0.0.1', porta=8080):
+    with transaction() as cur:
+        create_prediction_indexes_if_not_exist(cur)
+    servidor = ThreadingHTTPServer((host, porta), PredictionHandler)
+    print(f"Servindo previsões em http://{host}:{porta} ({datetime.now().isoformat()})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API local de leitura das previsões")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8080)
+    args = parser.parse_args()
+    serve(args.host, args.porta)
@@ -0,0 +1,247 @@
+"""
+Etapa de qualidade da ingestão: grade horária regular, checagens e preenchimento de lacunas.
+
+Cada lote vira uma matriz float64 (horas x variáveis) numa única conversão por
+coluna, é projetado na grade horária (`hourly_grid`) e passa por checagens
+vetorizadas:
+- faixa física de cada variável (fora da faixa vira NaN)
+- horas ausentes na resposta e valores nulos
+- lacunas de até `max_lacuna` horas preenchidas pelo método da variável
+  (interpolação linear, repetição do valor anterior ou nenhum)
+
+Cada hora recebe uma máscara de bits (QUALIDADE_*); horas criadas pelo
+preenchimento saem com source 'interp' e são substituídas se a observação real
+chegar depois.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from citrus_comum.features import VARIAVEIS, hourly_grid
+
+# Bits da máscara de qualidade por hora
+QUALIDADE_OK = 0
+QUALIDADE_HORA_AUSENTE = 1      # hora não veio na resposta (linha inteira preenchida)
+QUALIDADE_VALOR_AUSENTE = 2     # alguma variável veio nula
+QUALIDADE_FORA_FAIXA = 4        # alguma variável fora da faixa física (descartada)
+QUALIDADE_PREENCHIDA = 8        # alguma variável foi preenchida
+QUALIDADE_DUPLICADA = 16        # timestamp repetido no lote (vale a primeira)
+
+# Faixas físicas aceitas (unidades métricas do Visual Crossing)
+LIMITES = {
+    'temp': (-20.0, 50.0),
+    'pressure': (850.0, 1085.0),
+    'humidity': (0.0, 100.0),
+    'dew': (-40.0, 40.0),
+    'windspeed': (0.0, 200.0),
+    'winddir': (0.0, 360.0),
+    'precip': (0.0, 300.0),
+    'visibility': (0.0, 100.0),
+    'cloudcover': (0.0, 100.0),
+}
+
+# Preenchimento por variável: 'linear', 'anterior' ou None (não preenche).
+# Direção do vento é circular (interpolar 350 -> 10 passaria por 180); chuva
+# ausente não é inventada
+METODOS = {'winddir': 'anterior', 'precip': None}
+
+MAX_LACUNA = int(os.environ.get('QUALIDADE_MAX_LACUNA', 3))
+
+def to_matrix(registros, variaveis=VARIAVEIS):
+    """Timestamps e matriz float64 de uma lista de registros, numa única conversão"""
+    timestamps = pd.to_datetime([r['timestamp'] for r in registros], format='%Y-%m-%d %H:%M:%S')
+    brutos = [[r.get(var) for var in variaveis] for r in registros]
+    try:
+        # None vira NaN e textos numéricos são convertidos pelo próprio NumPy
+        valores = np.array(brutos, dtype=np.float64).reshape(len(registros), len(variaveis))
+    except (TypeError, ValueError):
+        # Algum valor não numérico: conversão por coluna, com NaN no lugar do inválido
+        colunas = [pd.to_numeric(pd.Series(coluna, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+                   for coluna in zip(*brutos)]
+        valores = np.column_stack(colunas)
+    return timestamps, valores
+
+def range_mask(valores, variaveis=VARIAVEIS, limites=LIMITES):
+    """Matriz booleana dos valores fora da faixa física de cada variável"""
+    minimos = np.array([limites.get(v, (-np.inf, np.inf))[0] for v in variaveis])
+    maximos = np.array([limites.get(v, (-np.inf, np.inf))[1] for v in variaveis])
+    with np.errstate(invalid='ignore'):
+        return (valores < minimos) | (valores > maximos)
+
+def fill_gaps(grade, max_lacuna=MAX_LACUNA, metodos=None, variaveis=VARIAVEIS):
+    """
+    Preenche lacunas internas de até `max_lacuna` horas, coluna a coluna e sem laços em Python.
+
+    Só lacunas com valor válido antes e depois são preenchidas (pontas ficam NaN).
+    Retorna (grade preenchida, matriz booleana dos valores preenchidos).
+    """
+    n = len(grade)
+    preenchida = grade.copy()
+    preenchidos = np.zeros(grade.shape, dtype=bool)
+    if n == 0 or max_lacuna <= 0:
+        return preenchida, preenchidos
+
+    metodos = {**METODOS, **(metodos or {})}
+    valido = ~np.isnan(grade)
+    linhas = np.arange(n)[:, None]
+    # Índice do último valor válido até cada linha e do próximo a partir dela
+    anterior = np.maximum.accumulate(np.where(valido, linhas, -1), axis=0)
+    posterior = np.minimum.accumulate(np.where(valido, linhas, n)[::-1], axis=0)[::-1]
+    tamanho = posterior - anterior - 1
+    alvo = ~valido & (anterior >= 0) & (posterior < n) & (tamanho <= max_lacuna)
+
+    colunas = np.arange(grade.shape[1])[None, :]
+    antes = grade[np.clip(anterior, 0, n - 1), colunas]
+    depois = grade[np.clip(posterior, 0, n - 1), colunas]
+    peso = (linhas - anterior) / np.maximum(posterior - anterior, 1)
+    linear = antes + (depois - antes) * peso
+
+    for j, var in enumerate(variaveis):
+        metodo = metodos.get(var, 'linear')
+        if metodo is None:
+            alvo[:, j] = False
+        elif metodo == 'anterior':
+            linear[:, j] = antes[:, j]
+        elif metodo != 'linear':
+            raise ValueError(f"Método de preenchimento desconhecido para {var}: {metodo}")
+
+    preenchida[alvo] = linear[alvo]
+    preenchidos[alvo] = True
+    return preenchida, preenchidos
+
+def check_quality(timestamps, valores, max_lacuna=MAX_LACUNA, metodos=None, variaveis=VARIAVEIS,
+                  limites=LIMITES):
+    """
+    Checagens e preenchimento de um bloco de horas.
+
+    Retorna (timestamps da grade, valores, mascara, observada): uma linha por hora
+    entre a primeira e a última de `timestamps`; `observada` indica as horas que
+    vieram na resposta.
+    """
+    if len(timestamps) == 0:
+        return pd.DatetimeIndex([]), np.empty((0, len(variaveis))), np.empty(0, dtype=np.int16), np.empty(0, dtype=bool)
+
+    df = pd.DataFrame(valores, index=pd.DatetimeIndex(timestamps), columns=variaveis)
+    inicio, grade, posicoes = hourly_grid(df, variaveis)
+    n = len(grade)
+
+    observada = np.zeros(n, dtype=bool)
+    observada[posicoes] = True
+    duplicada = np.bincount(posicoes, minlength=n) > 1
+
+    ausente = np.isnan(grade) & observada[:, None]
+    fora = range_mask(grade, variaveis, limites)
+    grade[fora] = np.nan
+
+    grade, preenchidos = fill_gaps(grade, max_lacuna, metodos, variaveis)
+
+    mascara = np.zeros(n, dtype=np.int16)
+    mascara[~observada] |= QUALIDADE_HORA_AUSENTE
+    mascara[ausente.any(axis=1)] |= QUALIDADE_VALOR_AUSENTE
+    mascara[fora.any(axis=1)] |= QUALIDADE_FORA_FAIXA
+    mascara[preenchidos.any(axis=1)] |= QUALIDADE_PREENCHIDA
+    mascara[duplicada] |= QUALIDADE_DUPLICADA
+
+    horas = inicio + pd.to_timedelta(np.arange(n), unit='h')
+    return horas, grade, mascara, observada
+
+class QualityStage:
+    """
+    Etapa de qualidade aplicada lote a lote.
+
+    Guarda a última hora já entregue como contexto à esquerda e retém no fim do lote
+    as horas ainda sem solução (lacuna de até `max_lacuna` horas encostada no fim,
+    que o próximo lote pode fechar). Assim uma lacuna na divisa entre dois lotes é
+    detectada e preenchida como se os dados viessem num lote só; `flush` entrega o
+    que ficou retido no fim. `contexto` (timestamp, valores) é a última hora já
+    gravada, para a primeira lacuna também ter o lado esquerdo.
+    """
+
+    def __init__(self, max_lacuna=MAX_LACUNA, metodos=None, variaveis=VARIAVEIS, contexto=None):
+        self.max_lacuna = max_lacuna
+        self.metodos = metodos
+        self.variaveis = variaveis
+        # Horas por situação, somadas ao longo dos lotes
+        self.contagens = {'horas_criadas': 0, 'horas_preenchidas': 0,
+                          'horas_fora_faixa': 0, 'horas_valor_ausente': 0}
+        self._anterior = None
+        if contexto is not None:
+            self._anterior = (pd.Timestamp(contexto[0]), np.asarray(contexto[1], dtype=np.float64))
+        # Registros brutos (timestamps, valores) depois da última hora entregue
+        self._retidos = (pd.DatetimeIndex([]), np.empty((0, len(variaveis))))
+
+    def _pending_hours(self, grade):
+        """Horas do fim da grade numa lacuna que ainda pode ser preenchida pelo próximo lote"""
+        metodos = {**METODOS, **(self.metodos or {})}
+        if self.max_lacuna <= 0:
+            return 0
+        retidas = 0
+        for j, var in enumerate(self.variaveis):
+            if metodos.get(var, 'linear') is None:
+                continue
+            validos = np.flatnonzero(~np.isnan(grade[:, j]))
+            final = len(grade) - 1 - validos[-1] if len(validos) else len(grade)
+            if final <= self.max_lacuna:
+                retidas = max(retidas, final)
+        return retidas
+
+    def process(self, registros, final=False):
+        """Registros do lote na grade regular, com `qualidade` e as horas preenchidas"""
+        if registros:
+            timestamps, valores = to_matrix(registros, self.variaveis)
+        else:
+            timestamps, valores = pd.DatetimeIndex([]), np.empty((0, len(self.variaveis)))
+        if self._anterior is not None:
+            novos = timestamps > self._anterior[0]
+            timestamps, valores = timestamps[novos], valores[novos]
+        # Retidos antes dos novos: com timestamp repetido vale o que chegou primeiro
+        timestamps = self._retidos[0].append(timestamps)
+        valores = np.vstack([self._retidos[1], valores])
+        ordem = np.argsort(timestamps.values, kind='stable')
+        timestamps, valores = timestamps[ordem], valores[ordem]
+        if len(timestamps) == 0:
+            return []
+
+        contexto = self._anterior is not None
+        if contexto:
+            ultimo, linha = self._anterior
+            timestamps = timestamps.insert(0, ultimo)
+            valores = np.vstack([linha[None, :], valores])
+
+        horas, grade, mascara, observada = check_quality(timestamps, valores, self.max_lacuna,
+                                                         self.metodos, self.variaveis)
+        retidas = 0 if final else self._pending_hours(grade)
+        if contexto:
+            # A hora de contexto já foi entregue antes
+            horas, grade, mascara, observada = horas[1:], grade[1:], mascara[1:], observada[1:]
+            timestamps, valores = timestamps[1:], valores[1:]
+        entregar = len(horas) - min(retidas, len(horas))
+        horas, grade, mascara, observada = horas[:entregar], grade[:entregar], mascara[:entregar], observada[:entregar]
+        if entregar:
+            self._anterior = (horas[-1], grade[-1])
+            pendentes = timestamps > horas[-1]
+            self._retidos = (timestamps[pendentes], valores[pendentes])
+        else:
+            self._retidos = (timestamps, valores)
+
+        # Horas ausentes que continuaram sem nenhum valor não viram linha
+        manter = observada | ~np.isnan(grade).all(axis=1)
+        horas, grade, mascara, observada = horas[manter], grade[manter], mascara[manter], observada[manter]
+
+        self.contagens['horas_criadas'] += int((~observada).sum())
+        self.contagens['horas_preenchidas'] += int(((mascara & QUALIDADE_PREENCHIDA) > 0).sum())
+        self.contagens['horas_fora_faixa'] += int(((mascara & QUALIDADE_FORA_FAIXA) > 0).sum())
+        self.contagens['horas_valor_ausente'] += int(((mascara & QUALIDADE_VALOR_AUSENTE) > 0).sum())
+
+        textos = horas.strftime('%Y-%m-%d %H:%M:%S')
+        linhas = np.where(np.isnan(grade), None, grade).tolist()
+        return [
+            {'timestamp': texto, **dict(zip(self.variaveis, linha)),
+             'source': 'obs' if obs else 'interp', 'qualidade': int(m)}
+            for texto, linha, obs, m in zip(textos, linhas, observada.tolist(), mascara.tolist())
+        ]
+
+    def flush(self):
+        """Entrega as horas retidas no fim do último lote (sem mais dados para fechar a lacuna)"""
+        return self.process([], final=True)
@@ -0,0 +1,138 @@
+"""
+Estatísticas em janelas móveis de tempo (3D/15D) avaliadas só nas horas âncora.
+
+Equivale a `df.rolling(janela, min_periods=1, closed='both')` seguido do filtro das 15h,
+mas sem calcular as estatísticas em todas as linhas: para cada âncora a janela
+[t - janela, t] é recortada por searchsorted, ordenada uma vez (NaN ao final) e
+min, max e quantis saem por índice. O estado incremental guarda só a cauda do
+histórico, então a inferência avalia âncoras novas sem recalcular o histórico.
+"""
+import numpy as np
+import pandas as pd
+
+from citrus_comum.features import VARIAVEIS, HORA_ANCORA
+
+JANELAS = {
+    'short': '3D',
+    'long': '15D',
+}
+
+ESTATISTICAS = ['min', 'max', 'mean', 'p25', 'p50', 'p75', 'std']
+QUANTIS = [0.25, 0.50, 0.75]
+
+def rolling_feature_names(janelas=JANELAS, variaveis=VARIAVEIS):
+    """Nomes no formato '{variavel}_{tag}_{estatistica}', na ordem do notebook"""
+    return [f'{col}_{tag}_{stat}'
+            for tag in janelas
+            for stat in ESTATISTICAS
+            for col in variaveis]
+
+def window_stats(timestamps, valores, ancoras, janela):
+    """
+    Estatísticas de `valores` (linha x variável) nas janelas [t - janela, t] de cada âncora.
+
+    `timestamps` é ordenado e `ancoras` são posições em `timestamps`. Retorna um array
+    (âncora x estatística x variável).
+    """
+    # Tudo em nanossegundos, independente da resolução do índice
+    t = timestamps.to_numpy().astype('datetime64[ns]').astype(np.int64)
+    fins = ancoras + 1
+    inicios = np.searchsorted(t, t[ancoras] - pd.Timedelta(janela).value, side='left')
+    tamanho = max(int((fins - inicios).max()), 1)
+
+    # Janelas alinhadas à direita; posições antes do início apontam para uma linha de NaN
+    deslocamento = np.arange(-tamanho, 0)
+    indices = fins[:, None] + deslocamento[None, :]
+    indices = np.where(indices >= inicios[:, None], indices + 1, 0)
+    valores = np.vstack([np.full((1, valores.shape[1]), np.nan), valores])
+
+    resultado = np.full((len(ancoras), len(ESTATISTICAS), valores.shape[1]), np.nan)
+    linhas = np.arange(len(ancoras))
+    for j in range(valores.shape[1]):
+        janelas = np.sort(valores[indices, j], axis=1)  # NaN vão para o fim
+        n = (~np.isnan(janelas)).sum(axis=1)
+        validas = n > 0
+        if not validas.any():
+            continue
+        ultimo = np.maximum(n - 1, 0)
+
+        resultado[validas, 0, j] = janelas[validas, 0]
+        resultado[validas, 1, j] = janelas[linhas, ultimo][validas]
+
+        soma = np.nansum(janelas, axis=1)
+        media = np.where(validas, soma / np.maximum(n, 1), np.nan)
+        resultado[:, 2, j] = media
+
+        # Quantis com interpolação linear, como pandas/numpy
+        for k, q in enumerate(QUANTIS):
+            posicao = q * ultimo
+            baixo = np.floor(posicao).astype(np.int64)
+            alto = np.minimum(baixo + 1, ultimo)
+            fracao = posicao - baixo
+            v_baixo = janelas[linhas, baixo]
+            v_alto = janelas[linhas, alto]
+            resultado[validas, 3 + k, j] = (v_baixo + (v_alto - v_baixo) * fracao)[validas]
+
+        desvios = np.nansum((janelas - media[:, None]) ** 2, axis=1)
+        resultado[:, 6, j] = np.where(n > 1, np.sqrt(desvios / np.maximum(n - 1, 1)), np.nan)
+
+    return resultado
+
+def make_rolling_features(df, janelas=JANELAS, hora=HORA_ANCORA, variaveis=VARIAVEIS, desde=None):
+    """
+    Features de janela móvel de `df` (indexado por timestamp) nas horas âncora.
+
+    Com `desde`, só as âncoras posteriores a ele são avaliadas (o restante de `df`
+    serve de histórico para as janelas).
+    """
+    df = df.sort_index()
+    timestamps = pd.DatetimeIndex(df.index)
+    mascara = np.ones(len(df), dtype=bool) if hora is None else np.asarray(timestamps.hour == hora)
+    if desde is not None:
+        mascara &= np.asarray(timestamps > desde)
+    ancoras = np.flatnonzero(mascara)
+
+    nomes = rolling_feature_names(janelas, variaveis)
+    if len(ancoras) == 0:
+        return pd.DataFrame(columns=nomes, index=timestamps[:0], dtype=np.float64)
+
+    valores = df[variaveis].to_numpy(dtype=np.float64)
+    blocos = [window_stats(timestamps, valores, ancoras, janela).reshape(len(ancoras), -1)
+              for janela in janelas.values()]
+
+    return pd.DataFrame(np.hstack(blocos), index=timestamps[ancoras], columns=nomes)
+
+def history_needed(janelas=JANELAS):
+    """Histórico mínimo para avaliar uma âncora nova com todas as janelas completas"""
+    return max(pd.Timedelta(janela) for janela in janelas.values())
+
+class RollingFeatures:
+    """
+    Estado incremental das janelas móveis.
+
+    Guarda só a cauda do histórico (a maior janela); `update` recebe horas novas e
+    devolve as features das âncoras entre elas.
+    """
+
+    def __init__(self, janelas=JANELAS, hora=HORA_ANCORA, variaveis=VARIAVEIS):
+        self.janelas = janelas
+        self.hora = hora
+        self.variaveis = variaveis
+        self.ultimo_timestamp = None
+        self._cauda = None
+
+    def update(self, df):
+        """Processa as linhas de `df` posteriores à última já vista"""
+        novos = df.sort_index()[self.variaveis]
+        if self.ultimo_timestamp is not None:
+            novos = novos[novos.index > self.ultimo_timestamp]
+        if novos.empty:
+            return make_rolling_features(novos, self.janelas, self.hora, self.variaveis)
+
+        historico = novos if self._cauda is None else pd.concat([self._cauda, novos])
+        features = make_rolling_features(historico, self.janelas, self.hora, self.variaveis,
+                                         desde=self.ultimo_timestamp)
+
+        self.ultimo_timestamp = historico.index[-1]
+        self._cauda = historico[historico.index >= self.ultimo_timestamp - history_needed(self.janelas)]
+        return features
@@ -0,0 +1,181 @@
+"""
+Snapshots das features usadas em cada previsão, em formato binário compacto.
+
+Cada previsão guarda o vetor de features como float32 little-endian em
+predictions1.features_bin (72 features = 288 bytes) e o número da versão do
+esquema em features_versao. A tabela feature_schemas1 registra, por versão, a
+lista ordenada de nomes (a versão é achada pelo hash da lista, então o mesmo
+conjunto de features sempre cai na mesma versão).
+
+A leitura em massa junta os bytes de todas as linhas e decodifica de uma vez com
+`np.frombuffer`, sem parsing por linha. Linhas antigas com a coluna JSONB
+`features` podem ser convertidas com:
+    python -m citrus_comum.snapshots --converter
+"""
+import json
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+TABELA_ESQUEMAS = 'feature_schemas1'
+TIPO = np.dtype('<f4')
+
+# 3 parâmetros (dia, sistema, bytes) por linha do UPDATE; lotes de 500 linhas
+TAMANHO_LOTE = 500
+
+_versoes = {}
+_lock = threading.Lock()
+
+def schema_hash(nomes):
+    return hashlib.sha256(json.dumps(list(nomes)).encode()).hexdigest()
+
+def create_snapshot_columns_if_not_exist(cur):
+    """Cria feature_schemas1 e as colunas binárias de predictions1"""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABELA_ESQUEMAS} (
+            versao SERIAL PRIMARY KEY,
+            hash CHAR(64) NOT NULL UNIQUE,
+            nomes JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        ALTER TABLE predictions1
+        ADD COLUMN IF NOT EXISTS features_bin BYTEA,
+        ADD COLUMN IF NOT EXISTS features_versao INTEGER
+    """)
+
+def _remember_version(chave, versao):
+    with _lock:
+        _versoes[chave] = versao
+
+def _cached_version(chave):
+    with _lock:
+        return _versoes.get(chave)
+
+def register_schema(cur, nomes):
+    """
+    Versão do esquema com a lista `nomes`, criada na primeira vez. Fica guardada no
+    processo depois do commit da transação (num rollback a versão não existe).
+    """
+    from citrus_comum.db import after_commit
+
+    chave = schema_hash(nomes)
+    versao = _cached_version(chave)
+    if versao is not None:
+        return versao
+    cur.execute(f"""
+        INSERT INTO {TABELA_ESQUEMAS} (hash, nomes)
+        VALUES (%s, %s)
+        ON CONFLICT (hash) DO NOTHING
+    """, [chave, json.dumps(list(nomes))])
+    cur.execute(f"SELECT versao FROM {TABELA_ESQUEMAS} WHERE hash = %s", [chave])
+    versao = cur.fetchone()[0]
+    after_commit(cur, lambda: _remember_version(chave, versao))
+    return versao
+
+def schema_version(cur, nomes):
+    """Versão já registrada do esquema `nomes`, só com leitura; ValueError se não existe"""
+    chave = schema_hash(nomes)
+    versao = _cached_version(chave)
+    if versao is not None:
+        return versao
+    cur.execute(f"SELECT versao FROM {TABELA_ESQUEMAS} WHERE hash = %s", [chave])
+    linha = cur.fetchone()
+    if linha is None:
+        raise ValueError(f"Esquema de features sem versão registrada ({len(nomes)} features, hash {chave[:12]})")
+    _remember_version(chave, linha[0])
+    return linha[0]
+
+def schema_names(cur, versao):
+    """Lista de nomes de uma versão do esquema"""
+    cur.execute(f"SELECT nomes FROM {TABELA_ESQUEMAS} WHERE versao = %s", [versao])
+    linha = cur.fetchone()
+    if linha is None:
+        raise ValueError(f"Versão de esquema de features desconhecida: {versao}")
+    nomes = linha[0]
+    return json.loads(nomes) if isinstance(nomes, str) else nomes
+
+def encode(valores):
+    """Bytes de cada linha de `valores` (vetor ou matriz linhas x features) em float32"""
+    matriz = np.ascontiguousarray(np.atleast_2d(valores), dtype=TIPO)
+    dados = matriz.tobytes()
+    tamanho = matriz.shape[1] * TIPO.itemsize
+    return [dados[i:i + tamanho] for i in range(0, len(dados), tamanho)]
+
+def decode(dados, n_features):
+    """Matriz (linhas x n_features) a partir de uma sequência de snapshots em bytes"""
+    buffer = b''.join(bytes(d) for d in dados)
+    return np.frombuffer(buffer, dtype=TIPO).reshape(-1, n_features)
+
+def load_snapshots(cur, nomes, sistema=None, inicio=None, fim=None, site=None):
+    """
+    Snapshots gravados com o esquema `nomes`: (linhas, X).
+
+    `linhas` é uma lista de (dia_previsto, sistema, site, score) e X a matriz float32
+    alinhada a ela, com as colunas na ordem de `nomes`. Só lê: um esquema que nunca
+    foi gravado dá ValueError.
+    """
+    versao = schema_version(cur, nomes)
+    filtros, params = ["features_versao = %s"], [versao]
+    for coluna, operador, valor in (('sistema', '=', sistema), ('site', '=', site),
+                                    ('dia_previsto', '>=', inicio), ('dia_previsto', '<=', fim)):
+        if valor is not None:
+            filtros.append(f"{coluna} {operador} %s")
+            params.append(valor)
+
+    cur.execute(f"""
+        SELECT dia_previsto, sistema, site, score, features_bin
+        FROM predictions1
+        WHERE {' AND '.join(filtros)}
+        ORDER BY sistema, dia_previsto
+    """, params)
+    resultado = cur.fetchall()
+    linhas = [tuple(r[:4]) for r in resultado]
+    return linhas, decode([r[4] for r in resultado], len(nomes))
+
+def convert_json_snapshots(cur, nomes):
+    """Converte as linhas que só têm a coluna JSONB `features`; retorna quantas"""
+    versao = register_schema(cur, nomes)
+    cur.execute("""
+        SELECT dia_previsto, sistema, features
+        FROM predictions1
+        WHERE features_bin IS NULL AND features IS NOT NULL
+    """)
+    pendentes = cur.fetchall()
+
+    for i in range(0, len(pendentes), TAMANHO_LOTE):
+        lote = pendentes[i:i + TAMANHO_LOTE]
+        valores = []
+        for _, _, features in lote:
+            features = json.loads(features) if isinstance(features, str) else features
+            valores.append([np.nan if features.get(nome) is None else features[nome] for nome in nomes])
+        params = []
+        for (dia_previsto, sistema, _), dados in zip(lote, encode(np.array(valores, dtype=np.float64))):
+            params.extend([dia_previsto, sistema, dados])
+        cur.execute(f"""
+            UPDATE predictions1 p SET
+                features_bin = v.dados,
+                features_versao = %s,
+                features = NULL
+            FROM (VALUES {', '.join(['(%s::date, %s, %s::bytea)'] * len(lote))}) AS v(dia, sistema, dados)
+            WHERE p.dia_previsto = v.dia AND p.sistema = v.sistema
+        """, [versao] + params)
+    return len(pendentes)
+
+if __name__ == "__main__":
+    from citrus_comum.db import transaction
+    from citrus_comum.features import LAGS, feature_names
+
+    parser = argparse.ArgumentParser(description="Snapshots binários das features das previsões")
+    parser.add_argument("--converter", action="store_true", help="converte as linhas antigas em JSONB")
+    args = parser.parse_args()
+
+    if args.converter:
+        with transaction() as cur:
+            create_snapshot_columns_if_not_exist(cur)
+            print(f"{convert_json_snapshots(cur, feature_names(LAGS))} previsões convertidas")
+    else:
+        parser.print_help()
@@ -0,0 +1,149 @@
+"""
+Leitura incremental das respostas "timeline" do Visual Crossing.
+
+A resposta é lida em pedaços: o cabeçalho é percorrido até a chave "days" de nível
+superior e, a partir daí, cada dia é decodificado e descartado assim que suas horas
+são emitidas. A memória fica limitada a um dia + um pedaço da resposta, qualquer que
+seja o tamanho do período pedido.
+"""
+import json
+import codecs
+from itertools import islice
+
+from citrus_comum import metricas
+
+VARIAVEIS = ['temp', 'pressure', 'humidity', 'dew', 'windspeed',
+             'winddir', 'precip', 'visibility', 'cloudcover']
+
+TAMANHO_PEDACO = 64 * 1024
+
+def convert_to_float(value):
+    """Converte valor para float, retorna None se não conseguir"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def iter_array_items(chunks, chave='days'):
+    """Decodifica um a um os itens do array `chave` do objeto de nível superior"""
+    fonte = iter(chunks)
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    texto = ''
+    pos = 0
+
+    def ler():
+        nonlocal texto, pos
+        chunk = next(fonte, None)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytes):
+            chunk = decodificador.decode(chunk)
+        # Descarta o que já foi consumido para não acumular a resposta inteira
+        texto = texto[pos:] + chunk
+        pos = 0
+        return True
+
+    # Cabeçalho: procura `"chave": [` no nível 1, ignorando o conteúdo de strings
+    profundidade = 0
+    em_string = escape = aguardando = False
+    atual, ultima_string = [], None
+    while True:
+        if pos >= len(texto):
+            if not ler():
+                return
+            continue
+        c = texto[pos]
+        pos += 1
+        if em_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                em_string = False
+                ultima_string = ''.join(atual) if profundidade == 1 else None
+                continue
+            if profundidade == 1:
+                atual.append(c)
+        elif c == '"':
+            em_string, atual = True, []
+        elif c == ':':
+            aguardando = profundidade == 1 and ultima_string == chave
+        elif c == '[' and aguardando:
+            break
+        elif c in '{[':
+            profundidade += 1
+            aguardando = False
+        elif c in '}]':
+            profundidade -= 1
+        elif not c.isspace():
+            aguardando = False
+
+    # Itens do array: cada um é decodificado assim que estiver completo no buffer
+    while True:
+        while pos < len(texto) and texto[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(texto):
+            if not ler():
+                raise ValueError(f"Resposta terminou dentro do array '{chave}'")
+            continue
+        if texto[pos] == ']':
+            return
+        try:
+            item, fim = decoder.raw_decode(texto, pos)
+        except json.JSONDecodeError:
+            if not ler():
+                raise
+            continue
+        yield item
+        pos = fim
+
+def iter_observations(chunks, converter=convert_to_float):
+    """Registros horários observados (source == 'obs'), sem timestamps repetidos
+
+    Com `converter=None` os valores saem como vieram no JSON, para uma conversão
+    vetorizada posterior (ver citrus_comum.qualidade).
+    """
+    dias_vistos = set()
+    for dia in iter_array_items(chunks, 'days'):
+        data_dia = dia['datetime']
+        # Um dia repetido no array traria só horas já emitidas
+        if data_dia in dias_vistos:
+            continue
+        dias_vistos.add(data_dia)
+        # Dentro do dia, horas repetidas vêm da troca de horário de verão
+        vistos = set()
+        for hora in dia.get('hours', []):
+            if hora.get('source') != 'obs':
+                continue
+            timestamp = f"{data_dia} {hora['datetime']}"
+            if timestamp in vistos:
+                continue
+            vistos.add(timestamp)
+
+            registro = {'timestamp': timestamp}
+            for col in VARIAVEIS:
+                registro[col] = hora.get(col) if converter is None else converter(hora.get(col))
+            registro['source'] = 'obs'
+            yield registro
+
+def iter_batches(registros, tamanho):
+    """Agrupa um iterador de registros em listas de até `tamanho` itens"""
+    registros = iter(registros)
+    while True:
+        lote = list(islice(registros, tamanho))
+        if not lote:
+            return
+        yield lote
+
+def stream_response(response, tamanho_pedaco=TAMANHO_PEDACO):
+    """Pedaços de bytes de uma resposta requests aberta com stream=True"""
+    try:
+        for pedaco in response.iter_content(chunk_size=tamanho_pedaco):
+            metricas.count('bytes_http', len(pedaco))
+            yield pedaco
+    finally:
+        response.close()
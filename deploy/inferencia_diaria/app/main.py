@@ -1,218 +1,217 @@
-import json
-import pickle
-import pg8000
-import boto3
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-from catboost import Pool
-import decimal
+import time
+import argparse
+import importlib
+import threading
+from datetime import datetime
 
+from citrus_comum import SITE_LEGADO, eventos, metricas
+from citrus_comum.db import transaction
+from citrus_comum.previsoes import create_prediction_indexes_if_not_exist
 
-def get_secret(secret_name):
-    """Busca secret do Secrets Manager"""
-    secrets_client = boto3.client('secretsmanager')
-    try:
-        response = secrets_client.get_secret_value(SecretId=secret_name)
-        return json.loads(response['SecretString'])
-    except Exception as e:
-        print(f"Erro ao buscar secret {secret_name}: {str(e)}")
-        raise
 
-def get_data_from_db():
-    """Busca todos os dados da tabela citrus1"""
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
-    
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge",
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
-    
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT timestamp, temp, pressure, humidity, dew, 
-                       windspeed, winddir, precip, visibility, cloudcover
-                FROM citrus1
-                ORDER BY timestamp
-            """)
-            
-            columns = [desc[0] for desc in cur.description]
-            data = cur.fetchall()
-            df = pd.DataFrame(data, columns=columns)
-            
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df.index = df['timestamp']
-            
-            return df
-    finally:
-        conn.close()
+SISTEMA = "pulverizar_c1_v0"
+MODELO = "cb_v0.cbm"
 
-def create_predictions_table_if_not_exists():
+def create_predictions_table_if_not_exists(cur):
     """Cria a tabela predictions1 se ela não existir"""
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS predictions1 (
+            dia_previsto DATE NOT NULL,
+            sistema VARCHAR(100) NOT NULL,
+            score FLOAT,
+            features JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (dia_previsto, sistema)
+        )
+    """)
+    # Site da previsão, usado para casar com os assinantes das notificações
+    cur.execute(f"""
+        ALTER TABLE predictions1
+        ADD COLUMN IF NOT EXISTS site VARCHAR(100) NOT NULL DEFAULT '{SITE_LEGADO}'
+    """)
+    create_prediction_indexes_if_not_exist(cur)
+    # Importado aqui: snapshots traz o numpy, que a thread de pré-carga já está importando
+    from citrus_comum.snapshots import create_snapshot_columns_if_not_exist
+    create_snapshot_columns_if_not_exist(cur)
+    print("Tabela predictions1 criada/verificada com sucesso")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Previsão diária ou repontuação em lote")
+    parser.add_argument("--from", dest="inicio", help="início do período em lote (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="fim", help="fim do período em lote (YYYY-MM-DD, inclusivo)")
+    parser.add_argument("--modelo", action="append", default=[], metavar="SISTEMA=ARQUIVO",
+                        help=f"modelos a pontuar no modo em lote (padrão: {SISTEMA}={MODELO})")
+    parser.add_argument("--backcheck", action="store_true",
+                        help="compara as previsões de --from/--to com o resultado observado")
+    parser.add_argument("--eventos", action="store_true",
+                        help="consome os eventos de observações da fila FILA_INFERENCIA")
+    args = parser.parse_args()
+    if args.backcheck and not args.inicio:
+        parser.error("--backcheck requer --from")
+    if args.eventos and eventos.get_queue('inferencia') is None:
+        parser.error("--eventos requer a variável FILA_INFERENCIA")
+    return args
+
+def preload():
+    """
+    Importa pandas/catboost/features numa thread enquanto a thread principal busca o
+    secret e abre a conexão; o import seguinte de `previsao` só espera o que faltar.
+    """
+    thread = threading.Thread(target=importlib.import_module, args=("previsao",), daemon=True)
+    thread.start()
+    return thread
+
+def main_batch(args):
+    """Modo em lote: --from/--to com um ou mais modelos"""
+    carregamento = preload()
     
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge",
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
+    with metricas.span('ddl'), transaction() as cur:
+        create_predictions_table_if_not_exists(cur)
     
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS predictions1 (
-                    dia_previsto DATE NOT NULL,
-                    sistema VARCHAR(100) NOT NULL,
-                    score FLOAT,
-                    features JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (dia_previsto, sistema)
-                )
-            """)
-            conn.commit()
-            print("Tabela predictions1 criada/verificada com sucesso")
-    finally:
-        conn.close()
-
-def insert_prediction(dia_previsto, sistema, score, features_dict):
-    """Insere previsão na tabela predictions1"""
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
+    with metricas.span('imports'):
+        carregamento.join()
+    import pandas as pd
+    import previsao
     
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge",
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
+    modelos_args = args.modelo or [f"{SISTEMA}={MODELO}"]
+    modelos = {}
+    for item in modelos_args:
+        sistema, caminho = item.split("=", 1)
+        print(f"Carregando modelo {sistema} de {caminho}...")
+        with metricas.span('carregar_modelo'):
+            modelos[sistema], _ = previsao.load_checked_model(caminho)
     
-    try:
-        with conn.cursor() as cur:
-            def json_converter(o):
-                if isinstance(o, (np.float32, np.float64, np.int32, np.int64)):
-                    return float(o)
-                if isinstance(o, decimal.Decimal):
-                    return float(o)
-                if isinstance(o, (pd.Timestamp, datetime)):
-                    return o.isoformat()
-                raise TypeError(f"Tipo não serializável: {type(o)}")
+    fim = args.fim or datetime.now().date().isoformat()
+    # --to é inclusivo: vai até o fim do dia
+    fim = pd.Timestamp(fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    
+    with transaction() as cur:
+        previsoes = previsao.score_range(cur, modelos, args.inicio, fim)
+    
+    print(f"Repontuação concluída: {len(previsoes)} previsões de {args.inicio} a {fim.date()}")
 
-            features_json = json.dumps(features_dict, default=json_converter)
-            
-            cur.execute("""
-                INSERT INTO predictions1 (dia_previsto, sistema, score, features)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (dia_previsto, sistema) 
-                DO UPDATE SET 
-                    score = EXCLUDED.score,
-                    features = EXCLUDED.features,
-                    created_at = CURRENT_TIMESTAMP
-            """, [dia_previsto, sistema, score, features_json])
-            
-            conn.commit()
-            print(f"Previsão inserida: {dia_previsto} - Sistema: {sistema} - Score: {score}")
-    finally:
-        conn.close()
+def load_models_by_site(modelos_args):
+    """{site: {sistema: modelo}}; o site vem do manifesto (modelos antigos: site legado)"""
+    import previsao
+    
+    por_site = {}
+    for item in modelos_args or [f"{SISTEMA}={MODELO}"]:
+        sistema, caminho = item.split("=", 1)
+        print(f"Carregando modelo {sistema} de {caminho}...")
+        with metricas.span('carregar_modelo'):
+            modelo, manifesto = previsao.load_checked_model(caminho)
+        por_site.setdefault(manifesto.get('site', SITE_LEGADO), {})[sistema] = modelo
+    return por_site
+
+def handle_observations(evento, modelos_por_site):
+    """
+    Evento 'observacoes' da ingestão: repontua as âncoras afetadas do site e publica
+    as previsões novas ou alteradas para a notificação. Dias passados repontuados
+    ficam gravados, mas só os de hoje em diante são publicados. Retorna o evento
+    publicado (None se nada a notificar mudou).
+    """
+    import previsao
+    
+    inicio_etapa = time.time()
+    site = evento['site']
+    modelos = modelos_por_site.get(site)
+    if not modelos:
+        print(f"[{site}] Nenhum modelo carregado para o site; evento ignorado")
+        return None
+    
+    with transaction() as cur:
+        alteradas = previsao.score_changed(cur, modelos, site, evento['inicio'], evento['fim'])
+    hoje = datetime.now().date()
+    alteradas = [p for p in alteradas if p[0] >= hoje]
+    if not alteradas:
+        eventos.report_latencies(eventos.record_stage(evento, 'inferencia', inicio_etapa))
+        return None
+    
+    novo = eventos.make_event('previsoes', anterior=evento, site=site, previsoes=[
+        {'site': site, 'sistema': sistema, 'dia_previsto': str(dia_previsto), 'score': score}
+        for dia_previsto, sistema, score, _ in alteradas
+    ])
+    eventos.record_stage(novo, 'inferencia', inicio_etapa)
+    eventos.publish('notificacao', novo)
+    eventos.report_latencies(novo)
+    return novo
 
-def make_lags(df2, lags_hours, tag):
-    """Cria features de lag para horas específicas no passado"""
-    cols = ['temp', 'pressure', 'humidity', 'dew', 'windspeed',
-            'winddir', 'precip', 'visibility', 'cloudcover']
+def main_events(args, parar=None):
+    """
+    Modo --eventos: consome a fila da inferência com os modelos carregados uma vez.
+    Cada evento é uma execução instrumentada própria (uma linha EMF por evento).
+    """
+    carregamento = preload()
+    
+    with transaction() as cur:
+        create_predictions_table_if_not_exists(cur)
+    carregamento.join()
+    modelos_por_site = load_models_by_site(args.modelo)
     
-    lag_features = []
+    @metricas.instrumented('inferencia_eventos')
+    def processar(evento):
+        return handle_observations(evento, modelos_por_site)
     
-    for lag in lags_hours:
-        lagged = df2[cols].shift(lag).add_suffix(f'_{tag}_lag{lag}h')
-        lag_features.append(lagged)
+    print(f"Consumindo eventos de observações para os sites {sorted(modelos_por_site)}")
+    eventos.consume(eventos.get_queue('inferencia'), processar, parar=parar)
+
+def main_backcheck(args):
+    """Modo --backcheck: previsões do período contra o que de fato aconteceu"""
+    import previsao
     
-    return pd.concat(lag_features, axis=1)
+    sistemas = [item.split("=", 1)[0] for item in args.modelo] or [SISTEMA]
+    fim = args.fim or datetime.now().date().isoformat()
+    with transaction() as cur:
+        for sistema in sistemas:
+            resultado = previsao.backcheck(cur, sistema, args.inicio, fim)
+            if resultado.empty:
+                print(f"{sistema}: nenhuma previsão de {args.inicio} a {fim}")
+                continue
+            print(resultado[['dia_previsto', 'score', 'realizado']].to_string(index=False))
+            avaliados = resultado.dropna(subset=['realizado'])
+            acertos = ((avaliados['score'] >= 0.5) == (avaliados['realizado'] == 1)).mean()
+            print(f"{sistema}: {len(avaliados)} dias avaliados, acerto com limiar 0.5: {acertos:.1%}")
 
 def main():
+    args = parse_args()
+    if args.eventos:
+        main_events(args)
+        return
+    run(args)
+
+@metricas.instrumented('inferencia_diaria')
+def run(args):
+    if args.backcheck:
+        main_backcheck(args)
+        return
+    if args.inicio:
+        main_batch(args)
+        return
+    
     try:
-        print("Iniciando processamento pulverizar_c1_v0")
+        print(f"Iniciando processamento {SISTEMA}")
+        carregamento = preload()
         
-        create_predictions_table_if_not_exists()
+        with metricas.span('ddl'), transaction() as cur:
+            create_predictions_table_if_not_exists(cur)
         
-        print("Carregando modelo CatBoost Classifier...")
-        with open("cb_v0.pkl", "rb") as f:
-            cb = pickle.load(f)
-        
-        print("Buscando dados da tabela citrus1...")
-        df = get_data_from_db()
-        if df.empty:
-            print("Nenhum dado encontrado na tabela citrus1")
-            return
+        # Só o tempo que a thread de pré-carga ainda não tinha coberto
+        with metricas.span('imports'):
+            carregamento.join()
+        import previsao
         
-        df2 = df.sort_index()
-        cutoff = pd.Timestamp.now() - pd.Timedelta(hours=80)
-        df_last_80 = df2.loc[df2.index >= cutoff]
-        if df_last_80.empty:
-            print("Dados insuficientes nas últimas 80 horas")
-            return
-        
-        print("Criando features de lag...")
-        lags_curtos = [1, 3, 6]
-        lags_longos = [12, 18, 24, 48, 72]
-        feat_lag_short = make_lags(df_last_80, lags_curtos, 'short')
-        feat_lag_long = make_lags(df_last_80, lags_longos, 'long')
-        features_full = pd.concat([feat_lag_short, feat_lag_long], axis=1)
+        print("Carregando modelo CatBoost Classifier...")
+        with metricas.span('carregar_modelo'):
+            cb, manifesto = previsao.load_checked_model(MODELO)
         
-        features = features_full[features_full.index.hour == 15].reset_index()
-        if features.empty:
-            print("Nenhum dado disponível às 15h")
+        with transaction() as cur:
+            previsao.create_feature_table_if_not_exists(cur)
+            resultado = previsao.predict(cur, cb, manifesto['sistema'])
+        if resultado is None:
             return
         
-        dia_em_avaliacao = features.iloc[[-1]].copy()
-        
-        features_names = [
-            'temp_short_lag1h', 'pressure_short_lag1h', 'humidity_short_lag1h', 'dew_short_lag1h', 
-            'windspeed_short_lag1h', 'winddir_short_lag1h', 'precip_short_lag1h', 'visibility_short_lag1h', 
-            'cloudcover_short_lag1h', 'temp_short_lag3h', 'pressure_short_lag3h', 'humidity_short_lag3h', 
-            'dew_short_lag3h', 'windspeed_short_lag3h', 'winddir_short_lag3h', 'precip_short_lag3h', 
-            'visibility_short_lag3h', 'cloudcover_short_lag3h', 'temp_short_lag6h', 'pressure_short_lag6h', 
-            'humidity_short_lag6h', 'dew_short_lag6h', 'windspeed_short_lag6h', 'winddir_short_lag6h', 
-            'precip_short_lag6h', 'visibility_short_lag6h', 'cloudcover_short_lag6h', 'temp_long_lag12h', 
-            'pressure_long_lag12h', 'humidity_long_lag12h', 'dew_long_lag12h', 'windspeed_long_lag12h', 
-            'winddir_long_lag12h', 'precip_long_lag12h', 'visibility_long_lag12h', 'cloudcover_long_lag12h', 
-            'temp_long_lag18h', 'pressure_long_lag18h', 'humidity_long_lag18h', 'dew_long_lag18h', 
-            'windspeed_long_lag18h', 'winddir_long_lag18h', 'precip_long_lag18h', 'visibility_long_lag18h', 
-            'cloudcover_long_lag18h', 'temp_long_lag24h', 'pressure_long_lag24h', 'humidity_long_lag24h', 
-            'dew_long_lag24h', 'windspeed_long_lag24h', 'winddir_long_lag24h', 'precip_long_lag24h', 
-            'visibility_long_lag24h', 'cloudcover_long_lag24h', 'temp_long_lag48h', 'pressure_long_lag48h', 
-            'humidity_long_lag48h', 'dew_long_lag48h', 'windspeed_long_lag48h', 'winddir_long_lag48h', 
-            'precip_long_lag48h', 'visibility_long_lag48h', 'cloudcover_long_lag48h', 'temp_long_lag72h', 
-            'pressure_long_lag72h', 'humidity_long_lag72h', 'dew_long_lag72h', 'windspeed_long_lag72h', 
-            'winddir_long_lag72h', 'precip_long_lag72h', 'visibility_long_lag72h', 'cloudcover_long_lag72h'
-        ]
-        
-        print("Fazendo previsão com CatBoost...")
-        pred_pool = Pool(data=dia_em_avaliacao[features_names])
-        prediction = float(cb.predict_proba(pred_pool)[:, 1][0])
-        print("Previsão feita com sucesso")
-        print(prediction)
-        
-        features_object = dia_em_avaliacao[features_names].iloc[0].to_dict()
-        features_object = {k: (None if pd.isna(v) else v) for k, v in features_object.items()}
-        
-        sistema = "pulverizar_c1_v0"
-        dia_previsto = (datetime.now() + timedelta(days=1)).date()
-        
-        print(f"Salvando previsão para {dia_previsto}...")
-        insert_prediction(dia_previsto, sistema, prediction, features_object)
-        
         print("Previsão realizada com sucesso")
-        print({
-            'dia_previsto': str(dia_previsto),
-            'sistema': sistema,
-            'score': prediction,
-            'timestamp_processamento': datetime.now().isoformat()
-        })
+        print(resultado)
         
     except Exception as e:
         print(f"Erro no processamento: {str(e)}")
@@ -0,0 +1,266 @@
+"""Etapas pesadas da inferência (pandas/catboost), importadas em segundo plano por main.py"""
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from catboost import Pool
+
+from citrus_comum import SITE_LEGADO, metricas
+from citrus_comum.alvo import NOME_ALVO, realized_outcomes
+from citrus_comum.clima import load_observations
+from citrus_comum.feature_store import create_feature_table_if_not_exists, read_features
+from citrus_comum.features import LAGS, HORA_ANCORA, all_lags, feature_names, make_lag_features
+from citrus_comum.modelo import load_model
+from citrus_comum.previsoes import prediction_history, record_latest
+from citrus_comum.snapshots import encode, register_schema
+
+
+MARGEM_HORAS = 8
+
+# 5 parâmetros por previsão; lotes de 1000 linhas por INSERT
+TAMANHO_LOTE = 1000
+
+# Diferença de score abaixo da qual uma repontuação não conta como mudança
+TOLERANCIA_SCORE = 1e-6
+
+def get_data_from_db(cur, inicio=None):
+    """Busca dados da tabela citrus1 a partir de `inicio` (ou todos, se None)"""
+    if inicio is None:
+        cur.execute("""
+            SELECT timestamp, temp, pressure, humidity, dew, 
+                   windspeed, winddir, precip, visibility, cloudcover
+            FROM citrus1
+            ORDER BY timestamp
+        """)
+    else:
+        # O filtro usa o índice único de timestamp (o mesmo do ON CONFLICT) e evita trazer o histórico inteiro
+        cur.execute("""
+            SELECT timestamp, temp, pressure, humidity, dew, 
+                   windspeed, winddir, precip, visibility, cloudcover
+            FROM citrus1
+            WHERE timestamp >= %s
+            ORDER BY timestamp
+        """, [inicio])
+    
+    columns = [desc[0] for desc in cur.description]
+    data = cur.fetchall()
+    df = pd.DataFrame(data, columns=columns)
+    
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df.index = df['timestamp']
+    
+    return df
+
+def get_window_from_db(cur, lags_hours, margem_horas=MARGEM_HORAS, agora=None):
+    """Busca apenas as horas necessárias para o maior lag, mais uma margem de segurança"""
+    agora = agora or pd.Timestamp.now()
+    inicio = agora - pd.Timedelta(hours=max(lags_hours) + margem_horas)
+    return get_data_from_db(cur, inicio.to_pydatetime())
+
+def insert_prediction(cur, dia_previsto, sistema, score, valores, site=SITE_LEGADO):
+    """Insere previsão na tabela predictions1 e atualiza predictions1_latest
+
+    `valores` são as features na ordem de feature_names(LAGS), gravadas como float32.
+    """
+    versao = register_schema(cur, feature_names(LAGS))
+    
+    cur.execute("""
+        INSERT INTO predictions1 (dia_previsto, sistema, site, score, features, features_bin, features_versao)
+        VALUES (%s, %s, %s, %s, NULL, %s, %s)
+        ON CONFLICT (dia_previsto, sistema) 
+        DO UPDATE SET 
+            site = EXCLUDED.site,
+            score = EXCLUDED.score,
+            features = NULL,
+            features_bin = EXCLUDED.features_bin,
+            features_versao = EXCLUDED.features_versao,
+            created_at = CURRENT_TIMESTAMP
+    """, [dia_previsto, sistema, site, score, encode(valores)[0], versao])
+    record_latest(cur, [(site, sistema, dia_previsto, score)])
+    
+    print(f"Previsão inserida: {dia_previsto} - Sistema: {sistema} - Score: {score}")
+
+def predict(cur, cb, sistema):
+    """Lê as features, faz a previsão e grava usando o mesmo cursor (uma transação)"""
+    janela_horas = max(all_lags(LAGS)) + MARGEM_HORAS
+    inicio = pd.Timestamp.now() - pd.Timedelta(hours=janela_horas)
+    
+    print("Buscando features pré-calculadas em features_hourly...")
+    with metricas.span('ler_features'):
+        features = read_features(cur, inicio=inicio.to_pydatetime())
+    
+    if features.empty:
+        # Ingestão ainda não populou a tabela (ou o conjunto de features mudou): monta a partir de citrus1
+        print(f"Buscando últimas {janela_horas} horas da tabela citrus1...")
+        with metricas.span('ler_observacoes'):
+            df = get_window_from_db(cur, all_lags(LAGS))
+        if df.empty:
+            print(f"Dados insuficientes nas últimas {janela_horas} horas")
+            return None
+        
+        print("Criando features de lag...")
+        with metricas.span('features_lag'):
+            features = make_lag_features(df.sort_index(), LAGS, hora=HORA_ANCORA)
+    
+    features = features.reset_index()
+    if features.empty:
+        print(f"Nenhum dado disponível às {HORA_ANCORA}h")
+        return None
+    
+    dia_em_avaliacao = features.iloc[[-1]].copy()
+    
+    features_names = feature_names(LAGS)
+    
+    print("Fazendo previsão com CatBoost...")
+    with metricas.span('predict_proba'):
+        pred_pool = Pool(data=dia_em_avaliacao[features_names])
+        prediction = float(cb.predict_proba(pred_pool)[:, 1][0])
+    print("Previsão feita com sucesso")
+    print(prediction)
+    
+    valores = dia_em_avaliacao[features_names].to_numpy(dtype=np.float32)[0]
+    
+    dia_previsto = (datetime.now() + timedelta(days=1)).date()
+    
+    print(f"Salvando previsão para {dia_previsto}...")
+    with metricas.span('gravar'):
+        insert_prediction(cur, dia_previsto, sistema, prediction, valores)
+    metricas.count('previsoes')
+    
+    return {
+        'dia_previsto': str(dia_previsto),
+        'sistema': sistema,
+        'score': prediction,
+        'timestamp_processamento': datetime.now().isoformat()
+    }
+
+def insert_predictions(cur, previsoes, site=SITE_LEGADO):
+    """Grava várias previsões (dia_previsto, sistema, score, snapshot em bytes) com INSERTs em lote"""
+    versao = register_schema(cur, feature_names(LAGS))
+    for i in range(0, len(previsoes), TAMANHO_LOTE):
+        lote = previsoes[i:i + TAMANHO_LOTE]
+        params = []
+        for dia_previsto, sistema, score, dados in lote:
+            params.extend([dia_previsto, sistema, site, score, dados, versao])
+        cur.execute(f"""
+            INSERT INTO predictions1 (dia_previsto, sistema, site, score, features_bin, features_versao)
+            VALUES {', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(lote))}
+            ON CONFLICT (dia_previsto, sistema) 
+            DO UPDATE SET 
+                site = EXCLUDED.site,
+                score = EXCLUDED.score,
+                features = NULL,
+                features_bin = EXCLUDED.features_bin,
+                features_versao = EXCLUDED.features_versao,
+                created_at = CURRENT_TIMESTAMP
+        """, params)
+    record_latest(cur, [(site, sistema, dia_previsto, score) for dia_previsto, sistema, score, _ in previsoes])
+    print(f"{len(previsoes)} previsões inseridas")
+
+def _score_anchors(cur, modelos, inicio, fim, site):
+    """Previsões (dia_previsto, sistema, score, snapshot) das âncoras em [inicio, fim], sem gravar"""
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+    maior_lag = pd.Timedelta(hours=max(all_lags(LAGS)))
+    
+    print(f"Buscando observações de {site} de {inicio - maior_lag} até {fim}...")
+    with metricas.span('ler_observacoes'):
+        df = load_observations(cur, (inicio - maior_lag).to_pydatetime(), fim.to_pydatetime(), site)
+    if df.empty:
+        print("Nenhum dado encontrado no período")
+        return []
+    metricas.count('linhas_lidas', len(df))
+    
+    with metricas.span('features_lag'):
+        features = make_lag_features(df, LAGS, hora=HORA_ANCORA)
+    features = features[(features.index >= inicio) & (features.index <= fim)]
+    if features.empty:
+        print(f"Nenhuma âncora às {HORA_ANCORA}h no período")
+        return []
+    
+    features_names = feature_names(LAGS)
+    pool = Pool(data=features[features_names])
+    dias_previstos = [(ts + pd.Timedelta(days=1)).date() for ts in features.index]
+    
+    # Um snapshot float32 por âncora, compartilhado pelos modelos (NaN é preservado)
+    snapshots = encode(features[features_names].to_numpy(dtype=np.float32))
+    
+    previsoes = []
+    for sistema, modelo in modelos.items():
+        print(f"Pontuando {len(features)} âncoras com {sistema}...")
+        with metricas.span('predict_proba'):
+            scores = modelo.predict_proba(pool)[:, 1]
+        previsoes.extend(zip(dias_previstos, [sistema] * len(scores), scores.tolist(), snapshots))
+    return previsoes
+
+def score_range(cur, modelos, inicio, fim, site=SITE_LEGADO):
+    """
+    Pontua todas as âncoras das 15h em [inicio, fim] com cada modelo de `modelos`
+    ({sistema: modelo}); um único Pool é compartilhado entre os modelos.
+    """
+    previsoes = _score_anchors(cur, modelos, inicio, fim, site)
+    if previsoes:
+        with metricas.span('gravar'):
+            insert_predictions(cur, previsoes, site)
+    metricas.count('previsoes', len(previsoes))
+    return previsoes
+
+def existing_scores(cur, sistemas, inicio, fim, site=SITE_LEGADO):
+    """Scores já gravados em predictions1 para `site`: {(dia_previsto, site, sistema): score}"""
+    cur.execute(f"""
+        SELECT dia_previsto, site, sistema, score
+        FROM predictions1
+        WHERE site = %s
+          AND sistema IN ({', '.join(['%s'] * len(sistemas))})
+          AND dia_previsto BETWEEN %s AND %s
+    """, [site] + list(sistemas) + [inicio, fim])
+    return {(dia_previsto, site, sistema): score for dia_previsto, site, sistema, score in cur.fetchall()}
+
+def score_changed(cur, modelos, site, inicio, fim, tolerancia=TOLERANCIA_SCORE):
+    """
+    Repontua só as âncoras afetadas por horas novas em [inicio, fim] de `site` e grava
+    as previsões novas ou com score diferente do já gravado.
+
+    Uma âncora usa as horas até o maior lag antes dela, então as afetadas vão de
+    `inicio` até `fim` + maior lag. Retorna as previsões gravadas.
+    """
+    inicio = pd.Timestamp(inicio)
+    fim = pd.Timestamp(fim) + pd.Timedelta(hours=max(all_lags(LAGS)))
+    previsoes = _score_anchors(cur, modelos, inicio, fim, site)
+    if not previsoes:
+        return []
+    
+    dias = [dia for dia, _, _, _ in previsoes]
+    anteriores = existing_scores(cur, list(modelos), min(dias), max(dias), site)
+    alteradas = [
+        p for p in previsoes
+        if anteriores.get((p[0], site, p[1])) is None
+        or abs(anteriores[(p[0], site, p[1])] - p[2]) > tolerancia
+    ]
+    print(f"[{site}] {len(alteradas)} de {len(previsoes)} previsões novas ou alteradas")
+    if alteradas:
+        with metricas.span('gravar'):
+            insert_predictions(cur, alteradas, site)
+    metricas.count('previsoes', len(alteradas))
+    return alteradas
+
+def backcheck(cur, sistema, inicio, fim, site=SITE_LEGADO):
+    """
+    Previsões de `sistema` com dia_previsto em [inicio, fim] ao lado do resultado
+    observado naquele dia (NaN quando ainda não há observações)
+    """
+    previsoes = pd.DataFrame(prediction_history(cur, sistema, inicio, fim, site))
+    if previsoes.empty:
+        return previsoes
+    
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+    df = load_observations(cur, inicio.to_pydatetime(), (fim + pd.Timedelta(days=1)).to_pydatetime(), site)
+    dias = pd.to_datetime(previsoes['dia_previsto'])
+    if df.empty:
+        previsoes['realizado'] = np.nan
+    else:
+        realizados = realized_outcomes(df)[NOME_ALVO]
+        previsoes['realizado'] = dias.map(realizados)
+    return previsoes
+
+def load_checked_model(caminho):
+    """Carrega o .cbm conferindo hash e features contra o builder atual"""
+    return load_model(caminho, features=feature_names(LAGS))
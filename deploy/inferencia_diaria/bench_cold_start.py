@@ -0,0 +1,65 @@
+"""
+Mede a partida a frio do container: do início do processo até o modelo carregado.
+
+Compara o caminho antigo (imports no topo de main.py + pickle.load) com o novo
+(main.py leve, imports pesados em segundo plano, .cbm conferido por hash). Cada
+medição roda num processo novo. O banco não é acessado: o tempo de secret + conexão
++ DDL é simulado por um sleep de `latencia` segundos, que no caminho novo corre em
+paralelo com os imports.
+
+Uso (na raiz do repositório):
+    python deploy/inferencia_diaria/bench_cold_start.py cb_v0.pkl cb_v0.cbm [repeticoes] [latencia]
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+
+ANTES = """
+import json, pickle, pg8000, boto3, pandas, numpy, decimal, time
+from catboost import Pool
+time.sleep({latencia})
+with open({pkl!r}, "rb") as f:
+    cb = pickle.load(f)
+"""
+
+DEPOIS = """
+import time
+import main
+carregamento = main.preload()
+time.sleep({latencia})
+carregamento.join()
+import previsao
+cb, manifesto = previsao.load_checked_model({cbm!r})
+"""
+
+
+def run(codigo, repeticoes):
+    ambiente = dict(os.environ, PYTHONPATH=os.pathsep.join([RAIZ, APP]))
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, "-c", codigo], check=True, env=ambiente)
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main(pkl, cbm, repeticoes, latencia):
+    resultado = {'latencia_simulada_s': latencia}
+    for nome, codigo in [('antes', ANTES.format(pkl=pkl, latencia=latencia)),
+                         ('depois', DEPOIS.format(cbm=cbm, latencia=latencia))]:
+        tempos = run(codigo, repeticoes)
+        resultado[nome] = {'mediana_s': round(statistics.median(tempos), 3),
+                           'min_s': round(min(tempos), 3)}
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    main(os.path.abspath(sys.argv[1]), os.path.abspath(sys.argv[2]),
+         int(sys.argv[3]) if len(sys.argv) > 3 else 5,
+         float(sys.argv[4]) if len(sys.argv) > 4 else 0.5)
@@ -0,0 +1,44 @@
+"""
+Compara o insert linha a linha com o insert em lote numa tabela temporária.
+
+Uso: python bench_insert.py [n_registros]
+Usa as mesmas credenciais do Secrets Manager da Lambda; nada é gravado em citrus1.
+Rodar com a raiz do repositório no PYTHONPATH (para importar citrus_comum).
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from citrus_comum.db import transaction
+from lambda_function import insert_rows, insert_batch
+
+
+def fake_records(n, inicio=datetime(2015, 1, 1)):
+    """Gera n registros horários no formato de stream_meteorological_data"""
+    return [{
+        'timestamp': (inicio + timedelta(hours=i)).strftime('%Y-%m-%d %H:%M:%S'),
+        'temp': 20.0, 'pressure': 1013.0, 'humidity': 70.0, 'dew': 15.0,
+        'windspeed': 5.0, 'winddir': 180.0, 'precip': 0.0,
+        'visibility': 10.0, 'cloudcover': 50.0, 'source': 'obs'
+    } for i in range(n)]
+
+
+def main(n):
+    registros = fake_records(n)
+
+    for nome, func in [('linha', insert_rows), ('lote', insert_batch)]:
+        with transaction() as cur:
+            cur.execute("CREATE TEMP TABLE citrus1_bench (LIKE citrus1 INCLUDING ALL) ON COMMIT DROP")
+
+            inicio = time.perf_counter()
+            inseridos = func(cur, registros, tabela='citrus1_bench')
+            # Segunda passada mede o custo dos conflitos (nada deve ser inserido)
+            repetidos = func(cur, registros, tabela='citrus1_bench')
+            duracao = time.perf_counter() - inicio
+
+        print(f"{nome:>5}: {n} registros x2 em {duracao:.2f}s "
+              f"(inseridos={inseridos}, reinseridos={repetidos})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,183 +1,372 @@
+import os
 import json
-import requests
-import pg8000
-import boto3
-from datetime import datetime
-
-def get_secret(secret_name):
-    """Busca secret do Secrets Manager"""
-    secrets_client = boto3.client('secretsmanager')
-    try:
-        response = secrets_client.get_secret_value(SecretId=secret_name)
-        return json.loads(response['SecretString'])
-    except Exception as e:
-        print(f"Erro ao buscar secret {secret_name}: {str(e)}")
-        raise
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from citrus_comum import eventos, metricas
+from citrus_comum.armazenamento import ensure_partitions
+from citrus_comum.cache_respostas import ResponseCache
+from citrus_comum.clima import SITE_LEGADO, create_sites_table_if_not_exists, get_with_retry, observation_table
+from citrus_comum.db import get_secret, transaction
+from citrus_comum.feature_store import create_feature_table_if_not_exists, refresh_features
+from citrus_comum.features import VARIAVEIS
+from citrus_comum.qualidade import QualityStage
+from citrus_comum.timeline import convert_to_float, iter_batches, iter_observations, stream_response
+
+BASE_URL = os.environ.get(
+    'VISUAL_CROSSING_URL',
+    "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/"
+)
+
+# Site original (citrus1); usado quando o evento não traz a lista de sites
+SITES_PADRAO = [{'site': SITE_LEGADO, 'latitude': -22.5901, 'longitude': -47.4600}]
+
+MAX_CONCORRENCIA = 8
+
+TABELA_ESTADO = 'ingestao_estado1'
+# Primeira hora buscada para um site sem nenhuma observação
+INICIO_PADRAO = datetime(2024, 1, 1)
+FORMATO_HORA = '%Y-%m-%dT%H:%M:%S'
 
-def get_meteorological_data(latitude: float, longitude: float, data_inicio: str, data_fim: str, chave_api: str) -> list:
+# Respostas brutas em /tmp: novas tentativas e reprocessamentos não pagam a API de novo
+_cache_respostas = None
+
+def get_response_cache():
+    """Cache de respostas reaproveitado entre invocações; criado na primeira, não no import"""
+    global _cache_respostas
+    if _cache_respostas is None:
+        _cache_respostas = ResponseCache()
+    return _cache_respostas
+
+def stream_meteorological_data(latitude: float, longitude: float, data_inicio: str, data_fim: str, chave_api: str,
+                               cache=None, site=None, bruto=False):
     """
-    Obtém dados meteorológicos horários do Visual Crossing e retorna como lista
+    Itera os registros horários observados do Visual Crossing enquanto a resposta chega,
+    sem carregar o JSON inteiro na memória
+
+    `data_inicio`/`data_fim` são datas (YYYY-MM-DD) ou horas (YYYY-MM-DDTHH:MM:SS). Com
+    `cache` e `site`, uma resposta em cache que cubra a faixa é lida do disco e uma
+    resposta nova é gravada nele enquanto é lida. Com `bruto`, os valores não são
+    convertidos (a etapa de qualidade converte o lote inteiro de uma vez).
     """
+    converter = None if bruto else convert_to_float
+    local = f"{latitude},{longitude}"
+    if cache is not None and site is not None:
+        digest = cache.lookup(site, local, data_inicio, data_fim)
+        if digest:
+            print(f"[{site}] Resposta em cache para {data_inicio} até {data_fim}")
+            metricas.count('cache_respostas')
+            return _read_all(cache.read(digest), converter)
     
     url = (
-        f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/"
-        f"{latitude},{longitude}/{data_inicio}/{data_fim}"
+        f"{BASE_URL}"
+        f"{local}/{data_inicio}/{data_fim}"
         f"?unitGroup=metric&key={chave_api}&contentType=json&include=hours"
     )
     
-    response = requests.get(url) 
-    response.raise_for_status()
-    dados = response.json()
+    response = get_with_retry(url, stream=True)
+    pedacos = stream_response(response)
+    if cache is not None and site is not None:
+        pedacos = cache.store(site, local, data_inicio, data_fim, pedacos)
+    return _read_all(pedacos, converter)
+
+def _read_all(pedacos, converter=convert_to_float):
+    """Observações da resposta, lendo também o que vem depois de "days" (o cache só grava respostas inteiras)"""
+    pedacos = iter(pedacos)
+    yield from iter_observations(pedacos, converter)
+    for _ in pedacos:
+        pass
+
+def get_last_timestamp_from_db(site=None):
+    """Busca o último timestamp no banco de dados (em citrus1 ou, com `site`, em citrus_sites1); None se vazio"""
+    with transaction() as cur:
+        if site is None:
+            cur.execute("SELECT MAX(timestamp) FROM citrus1")
+        else:
+            cur.execute("SELECT MAX(timestamp) FROM citrus_sites1 WHERE site = %s", [site])
+        return cur.fetchone()[0]
+
+def create_state_table_if_not_exists():
+    """Cria a tabela de estado da ingestão: última hora gravada por site"""
+    with transaction() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABELA_ESTADO} (
+                site VARCHAR(100) PRIMARY KEY,
+                ultimo_timestamp TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+def get_watermark(site):
+    """
+    Última hora já gravada do site.
+
+    Vem da tabela de estado; na primeira execução de um site (sem linha de estado)
+    é o MAX(timestamp) das observações: citrus1 para o site legado, que tem o
+    histórico completo, e citrus_sites1 para os demais.
+    """
+    with transaction() as cur:
+        cur.execute(f"SELECT ultimo_timestamp FROM {TABELA_ESTADO} WHERE site = %s", [site])
+        linha = cur.fetchone()
+    if linha:
+        return linha[0]
+    return get_last_timestamp_from_db(None if site == SITE_LEGADO else site)
+
+def get_stored_hour(site, timestamp):
+    """(timestamp, valores) gravados do site nessa hora, contexto da etapa de qualidade; None se não há"""
+    tabela = observation_table(site)
+    filtro, params = ("site = %s AND ", [site]) if tabela == 'citrus_sites1' else ("", [])
+    with transaction() as cur:
+        cur.execute(f"SELECT {', '.join(VARIAVEIS)} FROM {tabela} WHERE {filtro}timestamp = %s",
+                    params + [timestamp])
+        linha = cur.fetchone()
+    return None if linha is None else (timestamp, list(linha))
+
+def save_watermark(cur, site, timestamp):
+    """Avança o watermark do site (nunca volta: reprocessar um período antigo não o altera)"""
+    cur.execute(f"""
+        INSERT INTO {TABELA_ESTADO} (site, ultimo_timestamp)
+        VALUES (%s, %s)
+        ON CONFLICT (site) DO UPDATE SET
+            ultimo_timestamp = GREATEST({TABELA_ESTADO}.ultimo_timestamp, EXCLUDED.ultimo_timestamp),
+            updated_at = CURRENT_TIMESTAMP
+    """, [site, timestamp])
+
+COLUNAS = ['timestamp', 'temp', 'pressure', 'humidity', 'dew', 'windspeed',
+           'winddir', 'precip', 'visibility', 'cloudcover', 'source', 'qualidade']
+
+# 12 colunas x 500 linhas = 6000 parâmetros por comando, bem abaixo do limite de 65535 do protocolo
+TAMANHO_LOTE = 500
+
+# Uma hora preenchida pela etapa de qualidade ('interp') é substituída pela observação real
+SUBSTITUI_PREENCHIDA = """
+    DO UPDATE SET {atualizacao}
+    WHERE {tabela}.source = 'interp' AND EXCLUDED.source = 'obs'
+"""
+
+def conflict_clause(tabela, colunas):
+    atualizacao = ', '.join(f"{col} = EXCLUDED.{col}" for col in colunas if col not in ('site', 'timestamp'))
+    return SUBSTITUI_PREENCHIDA.format(atualizacao=atualizacao, tabela=tabela)
+
+def insert_rows(cur, data_list, tabela='citrus1', site=None):
+    """Insere uma linha por comando (caminho original); retorna quantas foram inseridas"""
+    colunas = COLUNAS if site is None else ['site'] + COLUNAS
+    chave = 'timestamp' if site is None else 'site, timestamp'
+    inseridos = 0
+    for record in data_list:
+        # Registros que não passaram pela etapa de qualidade ficam com qualidade NULL
+        valores = [record.get(col) for col in COLUNAS]
+        cur.execute(f"""
+            INSERT INTO {tabela} ({', '.join(colunas)})
+            VALUES ({', '.join(['%s'] * len(colunas))})
+            ON CONFLICT ({chave}) {conflict_clause(tabela, colunas)};
+        """, valores if site is None else [site] + valores)
+        inseridos += max(cur.rowcount, 0)
+    return inseridos
+
+def insert_batch(cur, data_list, tabela='citrus1', tamanho_lote=TAMANHO_LOTE, site=None):
+    """Insere em lotes com VALUES de várias linhas; retorna quantas foram inseridas"""
+    colunas = COLUNAS if site is None else ['site'] + COLUNAS
+    chave = 'timestamp' if site is None else 'site, timestamp'
+    inseridos = 0
+    placeholder = '(' + ', '.join(['%s'] * len(colunas)) + ')'
+    for i in range(0, len(data_list), tamanho_lote):
+        lote = data_list[i:i + tamanho_lote]
+        params = []
+        for record in lote:
+            if site is not None:
+                params.append(site)
+            params.extend(record.get(col) for col in COLUNAS)
+        # RETURNING só devolve as linhas inseridas ou que substituíram uma hora preenchida
+        cur.execute(f"""
+            INSERT INTO {tabela} ({', '.join(colunas)})
+            VALUES {', '.join([placeholder] * len(lote))}
+            ON CONFLICT ({chave}) {conflict_clause(tabela, colunas)}
+            RETURNING timestamp;
+        """, params)
+        inseridos += len(cur.fetchall())
+    return inseridos
+
+def create_quality_columns_if_not_exist():
+    """Coluna `qualidade` (máscara de bits da etapa de qualidade) em citrus1 e citrus_sites1"""
+    with transaction() as cur:
+        for tabela in ('citrus1', 'citrus_sites1'):
+            cur.execute(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS qualidade SMALLINT")
+
+def insert_data_to_db(data_list, modo='lote', site=None):
+    """Insere lista de dados no banco com ON CONFLICT; retorna contagem de inseridos e ignorados
+
+    Sem `site` ou com o site legado grava em citrus1; com outro `site` grava em citrus_sites1.
+    """
+    if not data_list:
+        return {'inseridos': 0, 'ignorados': 0}
     
-    dados_horarios = []
+    if site == SITE_LEGADO:
+        site = None
+    tabela = observation_table(site or SITE_LEGADO)
+    # Partições criadas numa transação própria: uma falha na gravação não as desfaz
+    with transaction() as cur:
+        ensure_partitions(cur, data_list[0]['timestamp'], data_list[-1]['timestamp'], tabela)
     
-    for dia in dados['days']:
-        data_dia = dia['datetime']
-        
-        for hora in dia.get('hours', []):
-            # Só processar dados observados
-            if hora.get('source') == 'obs':
-                registro = {
-                    'timestamp': f"{data_dia} {hora['datetime']}",
-                    'temp': convert_to_float(hora.get('temp')),
-                    'pressure': convert_to_float(hora.get('pressure')),
-                    'humidity': convert_to_float(hora.get('humidity')),
-                    'dew': convert_to_float(hora.get('dew')),
-                    'windspeed': convert_to_float(hora.get('windspeed')),
-                    'winddir': convert_to_float(hora.get('winddir')),
-                    'precip': convert_to_float(hora.get('precip')),
-                    'visibility': convert_to_float(hora.get('visibility')),
-                    'cloudcover': convert_to_float(hora.get('cloudcover')),
-                    'source': hora.get('source')
-                }
-                dados_horarios.append(registro)
+    with transaction() as cur:
+        if modo == 'linha':
+            inseridos = insert_rows(cur, data_list, tabela, site=site)
+        else:
+            inseridos = insert_batch(cur, data_list, tabela, site=site)
+    return {'inseridos': inseridos, 'ignorados': len(data_list) - inseridos}
+
+def quality_batches(estagio, registros):
+    """Lotes de `registros` tratados pela etapa de qualidade; as horas retidas no fim saem no flush"""
+    for lote in iter_batches(registros, TAMANHO_LOTE):
+        with metricas.span('qualidade'):
+            tratado = estagio.process(lote)
+        yield tratado
+    with metricas.span('qualidade'):
+        tratado = estagio.flush()
+    yield tratado
+
+def ingest_site(site, chave_api, data_fim, data_inicio=None, cache=None):
+    """Ingestão de um site: watermark próprio, busca na API e gravação na tabela do site
+    (citrus1 para o site legado, citrus_sites1 para os demais)
+
+    Sem `data_inicio`, pede só as horas depois do watermark do site (precisão de hora);
+    com `data_inicio`, reprocessa o período inteiro (o que já existe é ignorado pelo
+    ON CONFLICT e a resposta pode vir do cache). Com horas novas gravadas, publica
+    um evento 'observacoes' com a faixa para a fila da inferência.
+    """
+    inicio_etapa = time.time()
+    minimo = ''
+    contexto = None
+    if data_inicio is None:
+        with metricas.span('watermark'):
+            watermark = get_watermark(site['site'])
+        if watermark is None:
+            inicio = INICIO_PADRAO
+        else:
+            inicio = watermark + timedelta(hours=1)
+            minimo = watermark.strftime('%Y-%m-%d %H:%M:%S')
+            # Última hora gravada como lado esquerdo de uma lacuna logo no começo
+            contexto = get_stored_hour(site['site'], watermark)
+        if inicio > data_fim:
+            print(f"[{site['site']}] Nenhuma hora nova depois de {watermark}")
+            return {'site': site['site'], 'period': None, 'records_processed': 0,
+                    'records_inserted': 0, 'records_skipped': 0, 'features_updated': 0}
+        data_inicio = inicio
+    periodo_inicio, periodo_fim = data_inicio.strftime(FORMATO_HORA), data_fim.strftime(FORMATO_HORA)
+    print(f"[{site['site']}] Buscando dados de {periodo_inicio} até {periodo_fim}")
     
-    # Remover duplicatas baseado no timestamp
-    unique_data = {}
-    for registro in dados_horarios:
-        timestamp = registro['timestamp']
-        if timestamp not in unique_data:
-            unique_data[timestamp] = registro
+    registros = stream_meteorological_data(site['latitude'], site['longitude'], periodo_inicio, periodo_fim,
+                                           chave_api, cache=cache, site=site['site'], bruto=True)
+    # Horas já gravadas (ex.: resposta em cache que cobre mais que o pedido) nem chegam ao banco
+    registros = (r for r in registros if r['timestamp'] > minimo)
     
-    return list(unique_data.values())
-
-def convert_to_float(value):
-    """Converte valor para float, retorna None se não conseguir"""
-    if value is None:
-        return None
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
-
-def get_last_timestamp_from_db():
-    """Busca o último timestamp no banco de dados"""
-    # Buscar credenciais do banco do Secrets Manager
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
+    # Cada lote é gravado assim que é lido da resposta; só um lote fica em memória
+    estagio = QualityStage(contexto=contexto)
+    processados, inseridos, ignorados = 0, 0, 0
+    primeiro, ultimo = None, None
+    for lote in quality_batches(estagio, registros):
+        if not lote:
+            continue
+        # O tempo fora de 'gravacao' dentro de 'site' é a busca + parsing da resposta
+        with metricas.span('gravacao'):
+            contagem = insert_data_to_db(lote, site=site['site'])
+            # Avança a cada lote: uma nova tentativa recomeça depois do último lote gravado
+            with transaction() as cur:
+                save_watermark(cur, site['site'], lote[-1]['timestamp'])
+        
+        processados += len(lote)
+        inseridos += contagem['inseridos']
+        ignorados += contagem['ignorados']
+        if contagem['inseridos']:
+            primeiro = min(primeiro or lote[0]['timestamp'], lote[0]['timestamp'])
+            ultimo = max(ultimo or lote[-1]['timestamp'], lote[-1]['timestamp'])
     
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge",
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
+    metricas.count('linhas_recebidas', processados)
+    metricas.count('linhas_inseridas', inseridos)
+    for nome, valor in estagio.contagens.items():
+        metricas.count(nome, valor)
     
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT MAX(timestamp) FROM citrus1")
-            result = cur.fetchone()[0]
-            
-            if result:
-                # Converter para string YYYY-MM-DD
-                return result.strftime('%Y-%m-%d')
-            else:
-                # Se não tem dados, começar de uma data padrão
-                return "2024-01-01"
-    finally:
-        conn.close()
-
-def insert_data_to_db(data_list):
-    """Insere lista de dados no banco com ON CONFLICT"""
-    if not data_list:
-        return
+    features_atualizadas = 0
+    if inseridos:
+        with metricas.span('features'), transaction() as cur:
+            features_atualizadas = refresh_features(cur, primeiro, ultimo, site['site'])
+        publish_observations(site['site'], primeiro, ultimo, inicio_etapa)
     
-    # Buscar credenciais do banco do Secrets Manager
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
-        
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge", 
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
+    return {
+        'site': site['site'],
+        'period': f"{periodo_inicio} to {periodo_fim}",
+        'records_processed': processados,
+        'records_inserted': inseridos,
+        'records_skipped': ignorados,
+        'features_updated': features_atualizadas,
+        'quality': estagio.contagens
+    }
+
+def publish_observations(site, primeiro, ultimo, inicio_etapa):
+    """Evento 'observacoes' com a faixa de horas gravada; a origem da cadeia é o início da ingestão"""
+    evento = eventos.make_event('observacoes', origem_em=inicio_etapa, site=site, inicio=primeiro, fim=ultimo)
+    eventos.record_stage(evento, 'ingestao', inicio_etapa)
+    if eventos.publish('inferencia', evento):
+        metricas.count('eventos_publicados')
+        print(f"[{site}] Evento de observações {primeiro} a {ultimo} publicado")
+
+def ingest_sites(sites, chave_api, data_fim, max_concorrencia=MAX_CONCORRENCIA, data_inicio=None, cache=None):
+    """Ingestão concorrente de vários sites; falhas de um site não interrompem os demais"""
+    def executar(site):
+        try:
+            with metricas.span('site'):
+                return ingest_site(site, chave_api, data_fim, data_inicio, cache)
+        except Exception as e:
+            print(f"[{site['site']}] Erro: {str(e)}")
+            return {'site': site['site'], 'error': str(e)}
     
-    try:
-        with conn.cursor() as cur:
-            for record in data_list:
-                cur.execute("""
-                    INSERT INTO citrus1 (timestamp, temp, pressure, humidity, dew, windspeed, winddir, precip, visibility, cloudcover, source)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (timestamp) DO NOTHING;
-                """, [
-                    record['timestamp'],
-                    record['temp'],
-                    record['pressure'], 
-                    record['humidity'],
-                    record['dew'],
-                    record['windspeed'],
-                    record['winddir'],
-                    record['precip'],
-                    record['visibility'],
-                    record['cloudcover'],
-                    record['source']
-                ])
-            conn.commit()
-    finally:
-        conn.close()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concorrencia, len(sites)))) as pool:
+        return list(pool.map(executar, sites))
 
+@metricas.instrumented('ingestao_diaria')
 def lambda_handler(event, context):
-    """Handler principal da Lambda"""
+    """Handler principal da Lambda
+
+    O evento pode trazer `sites`: lista de {'site', 'latitude', 'longitude'}, e
+    `inicio`/`fim` (YYYY-MM-DDTHH:MM:SS) para reprocessar um período fixo em vez de
+    seguir o watermark.
+    """
     
     try:
-        # Coordenadas fixas 
-        latitude = -22.5901
-        longitude = -47.4600
+        event = event or {}
+        sites = event.get('sites') or SITES_PADRAO
         
         # Buscar API key do Secrets Manager
         api_secret = get_secret('citrus_edge/visual_crossing_api_key')
         chave_api = api_secret['visual_crossing'] 
         
-        # 1. Buscar última data no banco
-        data_inicio = get_last_timestamp_from_db()
+        with metricas.span('ddl'):
+            with transaction() as cur:
+                create_sites_table_if_not_exists(cur)
+            create_quality_columns_if_not_exist()
+            create_state_table_if_not_exists()
+            with transaction() as cur:
+                create_feature_table_if_not_exists(cur)
         
-        # 2. Data de hoje
-        data_fim = datetime.now().strftime('%Y-%m-%d')
+        cache = get_response_cache()
+        cache.evict()
         
-        print(f"Buscando dados de {data_inicio} até {data_fim}")
+        # Horas futuras voltam como previsão e são descartadas; o watermark para na última observada
+        data_fim = datetime.fromisoformat(event['fim']) if event.get('fim') else datetime.now().replace(minute=0, second=0, microsecond=0)
+        data_inicio = datetime.fromisoformat(event['inicio']) if event.get('inicio') else None
         
-        # 3. Buscar dados meteorológicos
-        weather_data = get_meteorological_data(latitude, longitude, data_inicio, data_fim, chave_api)
-        
-        if not weather_data:
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Nenhum dado novo encontrado',
-                    'period': f"{data_inicio} to {data_fim}"
-                })
-            }
-        
-        # 4. Inserir no banco
-        insert_data_to_db(weather_data)
+        resultados = ingest_sites(sites, chave_api, data_fim, data_inicio=data_inicio, cache=cache)
+        falhas = [r for r in resultados if 'error' in r]
         
         return {
-            'statusCode': 200,
+            'statusCode': 500 if len(falhas) == len(resultados) else 200,
             'body': json.dumps({
-                'message': 'Dados inseridos com sucesso',
-                'period': f"{data_inicio} to {data_fim}",
-                'records_processed': len(weather_data)
+                'message': 'Dados inseridos com sucesso' if not falhas else f'{len(falhas)} site(s) com erro',
+                'sites': resultados,
+                'records_processed': sum(r.get('records_processed', 0) for r in resultados),
+                'records_inserted': sum(r.get('records_inserted', 0) for r in resultados),
+                'records_skipped': sum(r.get('records_skipped', 0) for r in resultados)
             })
         }
         
@@ -188,4 +377,4 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
@@ -1,54 +1,192 @@
+import os
 import json
-import pg8000
-import boto3
+import time
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-def get_secret(secret_name):
-    """Busca secret do Secrets Manager"""
-    secrets_client = boto3.client('secretsmanager')
-    try:
-        response = secrets_client.get_secret_value(SecretId=secret_name)
-        return json.loads(response['SecretString'])
-    except Exception as e:
-        print(f"Erro ao buscar secret {secret_name}: {str(e)}")
-        raise
+from citrus_comum import SITE_LEGADO, eventos, metricas
+from citrus_comum.db import get_client, transaction
+from citrus_comum.previsoes import TABELA_ULTIMAS, create_prediction_indexes_if_not_exist
 
-def get_last_prediction():
-    """Busca a última previsão da tabela predictions1"""
-    db_secret = get_secret('citrus_edge/citrus_edge_db')
-    
-    conn = pg8000.connect(
-        host="citrus-edge-db-instance-1.cywyalcolhuz.us-east-1.rds.amazonaws.com",
-        port=5432,
-        database="citrusedge",
-        user=db_secret['username'],
-        password=db_secret['password']
-    )
-    
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT dia_previsto, score, sistema
-                FROM predictions1
-                ORDER BY dia_previsto DESC, created_at DESC
-                LIMIT 1
+# Assinante original, semeado em subscribers1 na criação da tabela
+TELEFONE_PADRAO = "+5511976805886"
+SISTEMA_PADRAO = "pulverizar_c1_v0"
+
+MAX_WORKERS = int(os.environ.get("SMS_WORKERS", "16"))
+# Limite de SMS/s da conta no SNS (padrão 20; pode ser ampliado via suporte da AWS)
+MENSAGENS_POR_SEGUNDO = float(os.environ.get("SMS_POR_SEGUNDO", "20"))
+TAMANHO_LOTE = 500
+# Reserva 'pendente' mais antiga que isso é de uma execução que caiu no meio do envio
+# (acima do timeout máximo da Lambda) e pode ser assumida por outra
+RESERVA_SEGUNDOS = int(os.environ.get("SMS_RESERVA_SEGUNDOS", "900"))
+
+def create_tables_if_not_exist():
+    """Cria subscribers1 (assinantes por site/sistema) e notificacoes1 (idempotência)"""
+    with transaction() as cur:
+        create_prediction_indexes_if_not_exist(cur)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS subscribers1 (
+                telefone VARCHAR(20) NOT NULL,
+                site VARCHAR(100) NOT NULL,
+                sistema VARCHAR(100) NOT NULL,
+                limiar FLOAT NOT NULL DEFAULT 0,
+                ativo BOOLEAN NOT NULL DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (site, sistema, telefone)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS notificacoes1 (
+                chave VARCHAR(300) PRIMARY KEY,
+                telefone VARCHAR(20) NOT NULL,
+                site VARCHAR(100) NOT NULL,
+                sistema VARCHAR(100) NOT NULL,
+                dia_previsto DATE NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+                message_id VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        """)
+        cur.execute("ALTER TABLE notificacoes1 ADD COLUMN IF NOT EXISTS reservado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+        # Para desligar o assinante original use ativo = FALSE (apagar a linha faz ela voltar)
+        cur.execute("""
+            INSERT INTO subscribers1 (telefone, site, sistema)
+            VALUES (%s, %s, %s)
+            ON CONFLICT DO NOTHING
+        """, [TELEFONE_PADRAO, SITE_LEGADO, SISTEMA_PADRAO])
+
+def get_pending_notifications(previsoes=None):
+    """
+    Numa única consulta: última previsão de cada (site, sistema) casada com os
+    assinantes ativos cujo limiar ela atinge. Com `previsoes` (dicts com site,
+    sistema, dia_previsto e score vindos de eventos), casa só essas previsões, e só
+    as de hoje em diante.
+    """
+    if previsoes is not None:
+        hoje = datetime.now().date().isoformat()
+        previsoes = [p for p in previsoes if str(p['dia_previsto'])[:10] >= hoje]
+        if not previsoes:
+            return []
+    with transaction() as cur:
+        if previsoes is None:
+            cur.execute(f"""
+                SELECT s.telefone, u.site, u.sistema, u.dia_previsto, u.score
+                FROM {TABELA_ULTIMAS} u
+                JOIN subscribers1 s ON s.site = u.site AND s.sistema = u.sistema
+                WHERE s.ativo AND u.score >= s.limiar
             """)
-            
-            result = cur.fetchone()
-            if result:
-                return {
-                    'dia_previsto': result[0].isoformat() if hasattr(result[0], 'isoformat') else str(result[0]),
-                    'score': float(result[1]),
-                    'sistema': result[2]
-                }
-            return None
-    finally:
-        conn.close()
+        else:
+            params = []
+            for p in previsoes:
+                params.extend([p['site'], p['sistema'], p['dia_previsto'], p['score']])
+            cur.execute(f"""
+                SELECT s.telefone, v.site, v.sistema, v.dia_previsto::date, v.score::float
+                FROM (VALUES {', '.join(['(%s, %s, %s, %s)'] * len(previsoes))}) AS v (site, sistema, dia_previsto, score)
+                JOIN subscribers1 s ON s.site = v.site AND s.sistema = v.sistema
+                WHERE s.ativo AND v.score::float >= s.limiar
+            """, params)
+        rows = cur.fetchall()
+
+    return [{
+        'telefone': row[0],
+        'site': row[1],
+        'sistema': row[2],
+        'dia_previsto': row[3].isoformat() if hasattr(row[3], 'isoformat') else str(row[3]),
+        'score': float(row[4])
+    } for row in rows]
+
+def prediction_key(previsao):
+    """
+    Site, sistema, dia previsto e score com a precisão da mensagem (0,1%): uma
+    previsão revisada para o mesmo dia gera chave nova e é enviada de novo
+    """
+    return f"{previsao['site']}:{previsao['sistema']}:{previsao['dia_previsto']}:{float(previsao['score']):.3f}"
+
+def idempotency_key(notificacao):
+    """Uma mensagem por telefone e previsão (ver `prediction_key`)"""
+    return f"{notificacao['telefone']}:{prediction_key(notificacao)}"
+
+def claim_notifications(notificacoes, reserva_segundos=RESERVA_SEGUNDOS):
+    """
+    Reserva as chaves em notificacoes1 e devolve só as notificações ainda não enviadas.
+    Uma nova execução (retry da Lambda) não reenvia o que já foi reservado, exceto
+    reservas 'pendente' com mais de `reserva_segundos`, deixadas por uma execução
+    que caiu antes de registrar o resultado.
+    """
+    # A mesma previsão pode vir em mais de um evento do lote; o upsert não aceita chave repetida
+    notificacoes = list({idempotency_key(n): n for n in notificacoes}.values())
+    reservadas = set()
+    for i in range(0, len(notificacoes), TAMANHO_LOTE):
+        lote = notificacoes[i:i + TAMANHO_LOTE]
+        params = []
+        for n in lote:
+            params.extend([idempotency_key(n), n['telefone'], n['site'], n['sistema'], n['dia_previsto']])
+        params.append(reserva_segundos)
+        with transaction() as cur:
+            cur.execute(f"""
+                INSERT INTO notificacoes1 (chave, telefone, site, sistema, dia_previsto)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(lote))}
+                ON CONFLICT (chave) DO UPDATE SET reservado_em = CURRENT_TIMESTAMP
+                WHERE notificacoes1.status = 'pendente'
+                  AND notificacoes1.reservado_em < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                RETURNING chave
+            """, params)
+            reservadas.update(row[0] for row in cur.fetchall())
+    return [n for n in notificacoes if idempotency_key(n) in reservadas]
+
+def record_results(resultados):
+    """
+    Grava o desfecho dos envios em lote: marca os enviados e libera as chaves que
+    falharam, para que a próxima execução tente de novo
+    """
+    enviados = [r for r in resultados if 'message_id' in r]
+    falhas = [r['chave'] for r in resultados if 'error' in r]
+    with transaction() as cur:
+        for i in range(0, len(enviados), TAMANHO_LOTE):
+            lote = enviados[i:i + TAMANHO_LOTE]
+            params = []
+            for r in lote:
+                params.extend([r['chave'], r['message_id']])
+            cur.execute(f"""
+                UPDATE notificacoes1 AS n
+                SET status = 'enviado', message_id = v.message_id, sent_at = CURRENT_TIMESTAMP
+                FROM (VALUES {', '.join(['(%s, %s)'] * len(lote))}) AS v (chave, message_id)
+                WHERE n.chave = v.chave
+            """, params)
+        for i in range(0, len(falhas), TAMANHO_LOTE):
+            lote = falhas[i:i + TAMANHO_LOTE]
+            cur.execute(f"""
+                DELETE FROM notificacoes1
+                WHERE status = 'pendente' AND chave IN ({', '.join(['%s'] * len(lote))})
+            """, lote)
+
+def report_events(lidos, inicio_etapa):
+    """Fecha a etapa de notificação de cada evento e registra as latências da cadeia"""
+    for _, evento in lidos:
+        eventos.report_latencies(eventos.record_stage(evento, 'notificacao', inicio_etapa))
+
+class RateLimiter:
+    """Limita o ritmo global de chamadas entre as threads (intervalo fixo entre envios)"""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo
+        self.proximo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            agora = time.monotonic()
+            espera = self.proximo - agora
+            self.proximo = max(self.proximo, agora) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
 
 def send_sms(phone_number, message):
     """Envia SMS via SNS"""
-    sns_client = boto3.client('sns')
-    
+    sns_client = get_client('sns')
+
     try:
         response = sns_client.publish(
             PhoneNumber=phone_number,
@@ -64,54 +202,120 @@ def format_message(score, dia_previsto):
     """Formata a mensagem do SMS"""
     score_percent = score * 100
     message = f"A propensão de amanhã ser um bom dia para pulverizar é: {score_percent:.1f}%"
-    
+
     return message
 
+def deliver(notificacoes, max_workers=MAX_WORKERS, por_segundo=MENSAGENS_POR_SEGUNDO):
+    """
+    Envia as notificações em paralelo, respeitando o limite de mensagens por segundo.
+    As threads só falam com o SNS; o banco é atualizado depois, em lote.
+    """
+    limitador = RateLimiter(por_segundo)
+
+    def enviar(notificacao):
+        chave = idempotency_key(notificacao)
+        limitador.wait()
+        try:
+            response = send_sms(notificacao['telefone'], format_message(notificacao['score'], notificacao['dia_previsto']))
+        except Exception as e:
+            return {'chave': chave, 'error': str(e)}
+        return {'chave': chave, 'message_id': response['MessageId']}
+
+    if not notificacoes:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(notificacoes))) as pool:
+        return list(pool.map(enviar, notificacoes))
+
+def read_events(event):
+    """
+    Eventos 'previsoes' recebidos: [(id da mensagem, evento)]. Aceita o lote da fila
+    SQS (`Records`) ou uma lista direta em `eventos`; vazio na execução agendada.
+    """
+    if event.get('Records'):
+        return [(r['messageId'], json.loads(r['body'])) for r in event['Records']]
+    return [(evento['id'], evento) for evento in event.get('eventos', [])]
+
+def failed_messages(lidos, resultados):
+    """Mensagens com algum envio que falhou, no formato de resposta parcial do SQS"""
+    chaves = [r['chave'] for r in resultados if 'error' in r]
+    falhas = []
+    for mensagem, evento in lidos:
+        # Chave: telefone:prediction_key
+        sufixos = tuple(f":{prediction_key(p)}" for p in evento['previsoes'])
+        if any(chave.endswith(sufixos) for chave in chaves):
+            falhas.append({'itemIdentifier': mensagem})
+    return falhas
+
+@metricas.instrumented('notificacao_sms')
 def lambda_handler(event, context):
-    """Handler principal da Lambda"""
-    
+    """Handler principal da Lambda
+
+    Na execução agendada notifica a última previsão de cada (site, sistema). Disparada
+    pela fila de eventos, notifica só as previsões novas ou alteradas dos eventos e
+    devolve em `batchItemFailures` as mensagens com envio falho, que o SQS entrega de
+    novo; o que já foi enviado não se repete (chaves em notificacoes1).
+    """
+    inicio_etapa = time.time()
+    lidos = read_events(event or {})
+
     try:
         print("Iniciando notificação SMS...")
-        
-        prediction = get_last_prediction()
-        
-        if not prediction:
+
+        with metricas.span('ddl'):
+            create_tables_if_not_exist()
+
+        with metricas.span('consulta'):
+            if lidos:
+                notificacoes = get_pending_notifications([p for _, evento in lidos for p in evento['previsoes']])
+            else:
+                notificacoes = get_pending_notifications()
+        if not notificacoes:
+            report_events(lidos, inicio_etapa)
+            if lidos:
+                return {'batchItemFailures': []}
             return {
                 'statusCode': 404,
-                'body': json.dumps({'error': 'Nenhuma previsão encontrada'})
+                'body': json.dumps({'error': 'Nenhuma previsão com assinantes a notificar'})
             }
-        
-        phone_number = "+5511976805886"
-        
-        message = format_message(
-            prediction['score'],
-            prediction['dia_previsto']
-        )
-        
-        print(f"Enviando SMS para {phone_number}")
-        print(f"Mensagem: {message}")
-        
-        send_sms(phone_number, message)
-        
+
+        with metricas.span('reserva'):
+            a_enviar = claim_notifications(notificacoes)
+        print(f"{len(notificacoes)} notificações elegíveis, {len(a_enviar)} ainda não enviadas")
+
+        with metricas.span('envio'):
+            resultados = deliver(a_enviar)
+        with metricas.span('registro'):
+            record_results(resultados)
+        falhas = [r for r in resultados if 'error' in r]
+        metricas.count('sms_enviados', len(resultados) - len(falhas))
+        metricas.count('sms_falhas', len(falhas))
+        report_events(lidos, inicio_etapa)
+        if lidos:
+            return {'batchItemFailures': failed_messages(lidos, resultados)}
+
         return {
-            'statusCode': 200,
+            'statusCode': 200 if not falhas else 207,
             'body': json.dumps({
-                'message': 'SMS enviado com sucesso',
-                'dia_previsto': prediction['dia_previsto'],
-                'score': prediction['score'],
+                'message': 'SMS enviados com sucesso' if not falhas else f'{len(falhas)} SMS com erro',
+                'elegiveis': len(notificacoes),
+                'enviados': len(resultados) - len(falhas),
+                'ja_enviados': len(notificacoes) - len(a_enviar),
+                'falhas': falhas,
                 'timestamp': datetime.now().isoformat()
             })
         }
-        
+
     except Exception as e:
         print(f"Erro no processamento: {str(e)}")
         import traceback
         traceback.print_exc()
-        
+
+        if lidos:
+            # O lote inteiro volta para a fila
+            return {'batchItemFailures': [{'itemIdentifier': mensagem} for mensagem, _ in lidos]}
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
             })
         }
-
@@ -0,0 +1,212 @@
+"""
+Backtest walk-forward do modelo em CPU, com grade de hiperparâmetros.
+
+Cada dobra treina com as âncoras anteriores ao início de um mês, menos um dia de
+separação, e avalia nesse mês (origem móvel mensal). Dobras x combinações da grade rodam num pool de processos:
+a matriz de features é gravada uma vez em `.npy` e aberta por memmap em cada
+worker, e o CatBoost de cada worker usa só a sua fatia dos núcleos
+(`thread_count`), evitando que N processos disputem todos os núcleos.
+
+Saída: tabela por dobra (AUC, precisão e recall no limiar 0.5) e, por combinação,
+o limiar que maximiza F1 nas previsões fora da amostra de todas as dobras (com
+empate, o menor).
+
+Uso:
+    python backtest.py --inicio 2023-01-01 --workers 4
+    python backtest.py --grade '{"depth": [4, 6, 8], "learning_rate": [0.03, 0.1]}'
+"""
+import os
+import json
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import treino
+from citrus_comum import SITE_LEGADO
+from citrus_comum.alvo import NOME_ALVO
+from citrus_comum.features import LAGS, feature_names
+
+GRADE = {
+    'depth': [4, 6],
+    'learning_rate': [0.03, 0.1],
+    'iterations': [500],
+}
+
+LIMIAR_PADRAO = 0.5
+# O alvo da âncora do dia d é o dia d+1: sem a separação, o alvo da última âncora
+# de treino seria o primeiro dia do mês de teste
+SEPARACAO = pd.Timedelta(days=1)
+
+# Estado de cada worker, preenchido pelo initializer
+_X = None
+_y = None
+_threads = 1
+
+def init_worker(caminho_X, caminho_y, threads):
+    """Abre as matrizes compartilhadas por memmap e limita os threads do processo"""
+    global _X, _y, _threads
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    _X = np.load(caminho_X, mmap_mode='r')
+    _y = np.load(caminho_y, mmap_mode='r')
+    _threads = threads
+
+def walk_forward_folds(timestamps, inicio, fim=None, meses_treino=None, separacao=SEPARACAO):
+    """
+    Dobras (nome, linhas de treino, linhas de teste) com origem móvel mensal.
+
+    Treino: âncoras até `separacao` antes do mês (ou só as dos últimos `meses_treino`
+    meses); teste: o mês.
+    """
+    timestamps = pd.DatetimeIndex(timestamps)
+    fim = timestamps.max() if fim is None else pd.Timestamp(fim)
+    dobras = []
+    for mes in pd.date_range(pd.Timestamp(inicio).to_period('M').to_timestamp(), fim, freq='MS'):
+        proximo = mes + pd.offsets.MonthBegin(1)
+        inicio_treino = timestamps.min() if meses_treino is None else mes - pd.DateOffset(months=meses_treino)
+        treino_idx = np.flatnonzero((timestamps >= inicio_treino) & (timestamps < mes - separacao))
+        teste_idx = np.flatnonzero((timestamps >= mes) & (timestamps < proximo))
+        if len(treino_idx) and len(teste_idx):
+            dobras.append((mes.strftime('%Y-%m'), treino_idx, teste_idx))
+    return dobras
+
+def binary_metrics(y, scores, limiar):
+    """Precisão e recall de `scores >= limiar`"""
+    previsto = scores >= limiar
+    verdadeiros = np.sum(previsto & (y == 1))
+    precisao = verdadeiros / previsto.sum() if previsto.any() else 0.0
+    recall = verdadeiros / (y == 1).sum() if (y == 1).any() else 0.0
+    return float(precisao), float(recall)
+
+def roc_auc(y, scores):
+    """AUC pela estatística de Mann-Whitney (empates com posto médio)"""
+    positivos = y == 1
+    n_pos, n_neg = positivos.sum(), (~positivos).sum()
+    if n_pos == 0 or n_neg == 0:
+        return float('nan')
+    postos = pd.Series(scores).rank().to_numpy()
+    return float((postos[positivos].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+def best_threshold(y, scores):
+    """Limiar que maximiza F1 entre os scores observados; com empate, o menor"""
+    ordem = np.argsort(-scores, kind='stable')
+    ordenados = scores[ordem]
+    verdadeiros = np.cumsum(y[ordem] == 1)
+    previstos = np.arange(1, len(y) + 1)
+    f1 = 2 * verdadeiros / (previstos + (y == 1).sum())
+    # `scores >= limiar` inclui todos os scores iguais: só o fim de cada grupo é um corte possível
+    f1[np.append(ordenados[1:] == ordenados[:-1], False)] = -1
+    melhor = len(f1) - 1 - int(np.argmax(f1[::-1]))
+    return float(ordenados[melhor]), float(f1[melhor])
+
+def run_fold(tarefa):
+    """Treina e avalia uma dobra com uma combinação de parâmetros (roda no worker)"""
+    from catboost import CatBoostClassifier
+
+    id_parametros, parametros, dobra, treino_idx, teste_idx = tarefa
+    y_treino = np.asarray(_y[treino_idx])
+    if len(np.unique(y_treino)) < 2:
+        return id_parametros, dobra, teste_idx, None
+
+    modelo = CatBoostClassifier(**{**treino.PARAMETROS, **parametros}, thread_count=_threads,
+                                allow_writing_files=False, verbose=False)
+    modelo.fit(np.asarray(_X[treino_idx]), y_treino)
+    scores = modelo.predict_proba(np.asarray(_X[teste_idx]))[:, 1]
+    return id_parametros, dobra, teste_idx, scores
+
+def run(site=SITE_LEGADO, inicio='2023-01-01', fim=None, grade=GRADE, workers=None,
+        meses_treino=None, saida='backtest', dados=treino.DIRETORIO_DADOS):
+    diretorio_site = os.path.join(dados, site)
+    diretorio_cache = os.path.join(diretorio_site, 'cache')
+
+    # Mesmas etapas (e mesmo cache) do pipeline de treino
+    df, hash_snapshot = treino.snapshot(site, os.path.join(diretorio_site, 'obs'))
+    target, chave_alvo = treino.build_target(df, hash_snapshot, diretorio_cache)
+    feats, chave_features = treino.build_features(df, hash_snapshot, diretorio_cache, site)
+    dados_treino = feats.join(target, how='inner').sort_index()
+
+    chave = treino.stable_hash(chave_alvo, chave_features)
+    caminho_X = os.path.join(diretorio_cache, f"X-{chave}.npy")
+    caminho_y = os.path.join(diretorio_cache, f"y-{chave}.npy")
+    if not os.path.exists(caminho_X):
+        np.save(caminho_X, dados_treino[feature_names(LAGS)].to_numpy(dtype=np.float32))
+        np.save(caminho_y, dados_treino[NOME_ALVO].to_numpy(dtype=np.int8))
+
+    dobras = walk_forward_folds(dados_treino.index, inicio, fim, meses_treino)
+    combinacoes = [dict(zip(grade, valores)) for valores in itertools.product(*grade.values())]
+    tarefas = [(i, parametros, nome, treino_idx, teste_idx)
+               for i, parametros in enumerate(combinacoes)
+               for nome, treino_idx, teste_idx in dobras]
+
+    workers = workers or min(os.cpu_count() or 1, len(tarefas)) or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"{len(dobras)} dobras x {len(combinacoes)} combinações = {len(tarefas)} treinos "
+          f"({workers} workers x {threads} threads)")
+
+    y = np.load(caminho_y)
+    linhas, fora_da_amostra = [], {i: [] for i in range(len(combinacoes))}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(caminho_X, caminho_y, threads)) as pool:
+        for id_parametros, dobra, teste_idx, scores in pool.map(run_fold, tarefas):
+            if scores is None:
+                print(f"{dobra}: treino com uma única classe, dobra ignorada")
+                continue
+            y_teste = y[teste_idx]
+            precisao, recall = binary_metrics(y_teste, scores, LIMIAR_PADRAO)
+            linhas.append({
+                'parametros': id_parametros,
+                'dobra': dobra,
+                'n_teste': len(teste_idx),
+                'positivos': float(y_teste.mean()),
+                'auc': roc_auc(y_teste, scores),
+                'precisao': precisao,
+                'recall': recall,
+            })
+            fora_da_amostra[id_parametros].append((y_teste, scores))
+
+    resumo = []
+    for i, parametros in enumerate(combinacoes):
+        if not fora_da_amostra[i]:
+            continue
+        y_oos = np.concatenate([a for a, _ in fora_da_amostra[i]])
+        scores_oos = np.concatenate([b for _, b in fora_da_amostra[i]])
+        limiar, f1 = best_threshold(y_oos, scores_oos)
+        precisao, recall = binary_metrics(y_oos, scores_oos, limiar)
+        resumo.append({
+            'parametros': i,
+            **parametros,
+            'auc_oos': roc_auc(y_oos, scores_oos),
+            'limiar': limiar,
+            'f1': f1,
+            'precisao': precisao,
+            'recall': recall,
+        })
+
+    tabela = pd.DataFrame(linhas).sort_values(['parametros', 'dobra'])
+    resumo = pd.DataFrame(resumo).sort_values('auc_oos', ascending=False)
+
+    os.makedirs(saida, exist_ok=True)
+    tabela.to_csv(os.path.join(saida, 'dobras.csv'), index=False)
+    resumo.to_csv(os.path.join(saida, 'resumo.csv'), index=False)
+    print(tabela.groupby('parametros')[['auc', 'precisao', 'recall']].mean().to_string())
+    print(resumo.to_string(index=False))
+    return tabela, resumo
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backtest walk-forward com grade de hiperparâmetros")
+    parser.add_argument("--site", default=SITE_LEGADO)
+    parser.add_argument("--inicio", default="2023-01-01", help="primeiro mês avaliado")
+    parser.add_argument("--fim", default=None)
+    parser.add_argument("--grade", type=json.loads, default=GRADE, help="grade em JSON ({parâmetro: [valores]})")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--meses-treino", type=int, default=None, help="janela móvel de treino (padrão: expansiva)")
+    parser.add_argument("--saida", default="backtest")
+    parser.add_argument("--dados", default=treino.DIRETORIO_DADOS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.site, args.inicio, args.fim, args.grade, args.workers, args.meses_treino, args.saida, args.dados)
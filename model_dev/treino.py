@@ -0,0 +1,241 @@
+"""
+Pipeline de treino reprodutível, em etapas com cache em disco.
+
+1. snapshot: observações do site em Parquet particionado por mês
+   (`dados/<site>/obs/ano=AAAA/mes=MM/dados.parquet`). Só o último mês salvo em
+   diante é buscado de novo no banco; `--completo` refaz tudo.
+2. alvo e features: matrizes salvas em `dados/<site>/cache/`, com nome dado pelo
+   hash do snapshot, da configuração e do código do módulo que as gera. Mudou uma
+   feature, só a etapa de features é refeita. As features vêm de features_hourly,
+   a mesma tabela lida pela inferência; âncoras que faltarem nela são calculadas a
+   partir do snapshot.
+3. treino: CatBoost com divisão temporal; o modelo sai como `cb_vN.cbm` + manifesto
+   (formato carregado pelo container de inferência). Se já existe um modelo com a
+   mesma chave de treino, ele é reaproveitado.
+
+Uso:
+    python treino.py
+    python treino.py --site c1 --corte 2024-01-01 --saida ../deploy/inferencia_diaria
+"""
+import os
+import re
+import sys
+import json
+import glob
+import hashlib
+import inspect
+import argparse
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from citrus_comum import SITE_LEGADO, alvo, features
+from citrus_comum.alvo import NOME_ALVO, make_target
+from citrus_comum.clima import load_observations
+from citrus_comum.db import transaction
+from citrus_comum.feature_store import feature_set_version, read_features
+from citrus_comum.features import LAGS, HORA_ANCORA, feature_names, make_lag_features
+from citrus_comum.modelo import export_model, read_manifest
+
+DIRETORIO_DADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dados')
+
+PARAMETROS = {
+    'loss_function': 'Logloss',
+    'random_seed': 0,
+}
+
+def stable_hash(*partes):
+    """Hash curto e estável de objetos serializáveis em JSON"""
+    texto = json.dumps(partes, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()[:16]
+
+def code_hash(modulo):
+    """Hash do código-fonte de um módulo: mudar a implementação invalida o cache"""
+    return stable_hash(inspect.getsource(modulo))
+
+def frame_hash(df):
+    """Hash do conteúdo de um DataFrame (índice incluído)"""
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()[:16]
+
+# --- snapshot ---------------------------------------------------------------
+
+def partition_path(diretorio, ano, mes):
+    return os.path.join(diretorio, f"ano={ano:04d}", f"mes={mes:02d}", "dados.parquet")
+
+def read_snapshot_manifest(diretorio):
+    caminho = os.path.join(diretorio, '_snapshot.json')
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho) as f:
+        return json.load(f)
+
+def write_snapshot_manifest(diretorio, manifesto):
+    caminho = os.path.join(diretorio, '_snapshot.json')
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w') as f:
+        json.dump(manifesto, f, indent=1, sort_keys=True)
+    os.replace(temporario, caminho)
+
+def snapshot(site, diretorio, completo=False):
+    """
+    Atualiza o snapshot Parquet do site e retorna (observações, hash do snapshot).
+
+    O último mês salvo é sempre buscado de novo (pode ter ficado incompleto); meses
+    anteriores só com `completo`.
+    """
+    manifesto = {} if completo else read_snapshot_manifest(diretorio)
+    inicio = None
+    if manifesto:
+        ultimo = max(manifesto)
+        inicio = pd.Timestamp(f"{ultimo}-01").to_pydatetime()
+
+    print(f"Buscando observações de {site} desde {inicio or 'o início'}...")
+    with transaction() as cur:
+        novos = load_observations(cur, inicio=inicio, site=site)
+    novos = novos.drop(columns=['timestamp'])
+
+    for (ano, mes), parte in novos.groupby([novos.index.year, novos.index.month]):
+        chave = f"{ano:04d}-{mes:02d}"
+        hash_parte = frame_hash(parte)
+        if manifesto.get(chave, {}).get('hash') == hash_parte:
+            continue
+        caminho = partition_path(diretorio, ano, mes)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        parte.to_parquet(caminho)
+        manifesto[chave] = {'hash': hash_parte, 'linhas': len(parte)}
+        print(f"Partição {chave}: {len(parte)} linhas")
+    write_snapshot_manifest(diretorio, manifesto)
+
+    if not manifesto:
+        raise ValueError(f"Nenhuma observação encontrada para o site {site}")
+
+    df = pd.concat([pd.read_parquet(partition_path(diretorio, *map(int, chave.split('-'))))
+                    for chave in sorted(manifesto)])
+    return df, stable_hash(sorted((k, v['hash']) for k, v in manifesto.items()))
+
+# --- etapas com cache -------------------------------------------------------
+
+def cached_stage(nome, chave, diretorio, calcular):
+    """Lê `nome-chave.parquet` do cache ou calcula e grava"""
+    caminho = os.path.join(diretorio, f"{nome}-{chave}.parquet")
+    if os.path.exists(caminho):
+        print(f"{nome}: cache {chave}")
+        return pd.read_parquet(caminho)
+    print(f"{nome}: calculando {chave}...")
+    resultado = calcular()
+    os.makedirs(diretorio, exist_ok=True)
+    resultado.to_parquet(caminho)
+    return resultado
+
+def build_target(df, hash_snapshot, diretorio, hora=HORA_ANCORA):
+    chave = stable_hash(hash_snapshot, hora, code_hash(alvo))
+    return cached_stage('alvo', chave, diretorio, lambda: make_target(df, hora)), chave
+
+def store_features(df, site, lags=LAGS, hora=HORA_ANCORA):
+    """Features das âncoras do snapshot lidas de features_hourly, completadas a partir do snapshot"""
+    with transaction() as cur:
+        armazenadas = read_features(cur, df.index.min().to_pydatetime(), df.index.max().to_pydatetime(), site, lags)
+    ancoras = df.index[df.index.hour == hora]
+    faltantes = ancoras.difference(armazenadas.index)
+    if len(faltantes) == 0:
+        return armazenadas
+    print(f"{len(faltantes)} âncoras ausentes em features_hourly; calculadas a partir do snapshot")
+    calculadas = make_lag_features(df, lags, hora=hora)
+    return pd.concat([armazenadas, calculadas.loc[calculadas.index.isin(faltantes)]]).sort_index()
+
+def build_features(df, hash_snapshot, diretorio, site=SITE_LEGADO, lags=LAGS, hora=HORA_ANCORA):
+    chave = stable_hash(hash_snapshot, site, feature_set_version(lags), lags, hora, code_hash(features))
+    return cached_stage('features', chave, diretorio, lambda: store_features(df, site, lags, hora)), chave
+
+# --- treino -----------------------------------------------------------------
+
+def model_versions(saida):
+    """Versões N dos cb_vN.cbm existentes em `saida`"""
+    versoes = {}
+    for caminho in glob.glob(os.path.join(saida, 'cb_v*.cbm')):
+        encontrado = re.fullmatch(r'cb_v(\d+)\.cbm', os.path.basename(caminho))
+        if encontrado:
+            versoes[int(encontrado.group(1))] = caminho
+    return versoes
+
+def find_model(saida, chave_treino):
+    """Modelo já treinado com a mesma chave, se houver"""
+    for versao, caminho in sorted(model_versions(saida).items()):
+        try:
+            if read_manifest(caminho).get('chave_treino') == chave_treino:
+                return caminho
+        except FileNotFoundError:
+            continue
+    return None
+
+def train(dados, corte, parametros, gpu=False):
+    """Treina com as âncoras antes de `corte` e avalia AUC nas posteriores"""
+    from catboost import CatBoostClassifier, Pool
+    from catboost.utils import eval_metric
+
+    nomes = feature_names(LAGS)
+    treino = dados[dados.index < corte]
+    validacao = dados[dados.index >= corte]
+    if treino.empty:
+        raise ValueError(f"Nenhuma âncora antes de {corte.date()}")
+
+    modelo = CatBoostClassifier(**parametros, task_type='GPU' if gpu else 'CPU',
+                                allow_writing_files=False, verbose=False)
+    modelo.fit(Pool(treino[nomes], label=treino[NOME_ALVO]))
+
+    metricas = {'treino': len(treino), 'validacao': len(validacao)}
+    if not validacao.empty and validacao[NOME_ALVO].nunique() > 1:
+        scores = modelo.predict_proba(Pool(validacao[nomes]))[:, 1]
+        metricas['auc_validacao'] = float(eval_metric(validacao[NOME_ALVO].to_numpy(), scores, 'AUC')[0])
+    return modelo, metricas
+
+def run(site=SITE_LEGADO, saida='.', corte='2024-01-01', completo=False, gpu=False, dados=DIRETORIO_DADOS):
+    diretorio_site = os.path.join(dados, site)
+    diretorio_cache = os.path.join(diretorio_site, 'cache')
+
+    df, hash_snapshot = snapshot(site, os.path.join(diretorio_site, 'obs'), completo)
+    print(f"Snapshot {hash_snapshot}: {len(df)} observações")
+
+    target, chave_alvo = build_target(df, hash_snapshot, diretorio_cache)
+    feats, chave_features = build_features(df, hash_snapshot, diretorio_cache, site)
+
+    corte = pd.Timestamp(corte)
+    chave_treino = stable_hash(chave_alvo, chave_features, corte, PARAMETROS, gpu)
+    existente = find_model(saida, chave_treino)
+    if existente:
+        print(f"Modelo {existente} já treinado com a chave {chave_treino}")
+        return existente
+
+    dados_treino = feats.join(target, how='inner')
+    modelo, metricas = train(dados_treino, corte, PARAMETROS, gpu)
+
+    versao = max(model_versions(saida), default=-1) + 1
+    caminho = os.path.join(saida, f"cb_v{versao}.cbm")
+    manifesto = export_model(
+        modelo, caminho, f"pulverizar_{site}_v{versao}", feature_names(LAGS),
+        extra={
+            'site': site,
+            'chave_treino': chave_treino,
+            'snapshot': hash_snapshot,
+            'corte': corte.date().isoformat(),
+            'parametros': PARAMETROS,
+            'metricas': metricas,
+        },
+    )
+    print(f"Modelo salvo em {caminho}")
+    print(json.dumps(manifesto['metricas'], indent=2))
+    return caminho
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Treino do modelo de pulverização")
+    parser.add_argument("--site", default=SITE_LEGADO)
+    parser.add_argument("--saida", default=".", help="diretório dos cb_vN.cbm")
+    parser.add_argument("--corte", default="2024-01-01", help="início da validação (YYYY-MM-DD)")
+    parser.add_argument("--completo", action="store_true", help="refaz o snapshot inteiro a partir do banco")
+    parser.add_argument("--gpu", action="store_true")
+    parser.add_argument("--dados", default=DIRETORIO_DADOS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.site, args.saida, args.corte, args.completo, args.gpu, args.dados)
@@ -0,0 +1,98 @@
+"""
+Fixtures compartilhadas: raiz do repositório no sys.path, os substitutos locais de
+bench.locais (sem AWS nem Visual Crossing) e o carregamento dos jobs de deploy/.
+"""
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, RAIZ)
+
+from bench.locais import FakeServices
+from bench.run import load_job
+from bench.sintetico import generate, make_sites
+
+@pytest.fixture(scope='session')
+def sites():
+    return make_sites(2)
+
+@pytest.fixture(scope='session')
+def dados(sites):
+    # Três dias por site
+    return generate(sites, escala=len(sites) * 72 / 93_928)
+
+@pytest.fixture
+def servicos(sites, dados, monkeypatch):
+    """FakeServices no ar, com as variáveis de ambiente dos jobs apontando para ele"""
+    servicos = FakeServices(dados, sites).start()
+    for nome, valor in servicos.environment().items():
+        monkeypatch.setenv(nome, valor)
+    yield servicos
+    servicos.stop()
+
+@pytest.fixture
+def ingestao(servicos):
+    """Lambda de ingestão importada depois do ambiente (BASE_URL é lido no import)"""
+    return load_job('ingestao_diaria_teste', 'deploy/ingestao_diaria/lambda_function.py')
+
+class RecordingCursor:
+    """Cursor que guarda os comandos; `respostas` decide o fetchall de cada um"""
+
+    def __init__(self, respostas=None):
+        self.comandos = []
+        self.respostas = respostas or (lambda sql, params: [])
+        self._resultado = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        params = list(params or [])
+        assert sql.count('%s') == len(params), sql
+        self.comandos.append((sql, params))
+        self._resultado = self.respostas(sql, params)
+        self.rowcount = len(self._resultado)
+
+    def fetchall(self):
+        return self._resultado
+
+    def fetchone(self):
+        return self._resultado[0] if self._resultado else None
+
+@pytest.fixture
+def cursor():
+    return RecordingCursor()
+
+class Conexao:
+    """Conexão falsa: conta commits e rollbacks"""
+
+    def __init__(self, cursor):
+        self.cursor_falso = cursor
+        self.eventos = []
+
+    def cursor(self):
+        conexao = self
+
+        class Contexto:
+            def __enter__(self):
+                return conexao.cursor_falso
+
+            def __exit__(self, *args):
+                return False
+        return Contexto()
+
+    def commit(self):
+        self.eventos.append('commit')
+
+    def rollback(self):
+        self.eventos.append('rollback')
+
+@pytest.fixture
+def conexao(cursor, monkeypatch):
+    """db.transaction() sem banco: a conexão falsa entrega `cursor`"""
+    from citrus_comum import db
+
+    conexao = Conexao(cursor)
+    monkeypatch.setattr(db, 'acquire', lambda: conexao)
+    monkeypatch.setattr(db, 'release', lambda conn, descartar=False: None)
+    return conexao
@@ -0,0 +1,38 @@
+"""Alvo do dia seguinte: deslocamento por dia calendário, inclusive com dia faltando"""
+import numpy as np
+import pandas as pd
+
+from citrus_comum.alvo import NOME_ALVO, make_target, realized_outcomes
+
+def days(resultados, inicio='2025-03-01'):
+    """Horas de dias consecutivos; dia com resultado 0 tem chuva às 10h"""
+    indice = pd.date_range(inicio, periods=24 * len(resultados), freq='h', name='timestamp')
+    df = pd.DataFrame({'windspeed': 5.0, 'humidity': 60.0, 'temp': 25.0, 'precip': 0.0}, index=indice)
+    for i, atendido in enumerate(resultados):
+        if not atendido:
+            df.loc[indice[24 * i + 10], 'precip'] = 1.0
+    return df
+
+def test_target_is_next_calendar_day_when_a_day_is_missing():
+    df = days([1, 1, 0, 1, 0, 1])
+    # Sem nenhuma hora do dia 03/03: a âncora de 02/03 não pode usar o resultado de 04/03
+    df = df[df.index.normalize() != pd.Timestamp('2025-03-03')]
+
+    alvo = make_target(df)[NOME_ALVO]
+
+    assert alvo.index.strftime('%d').tolist() == ['01', '02', '04', '05', '06']
+    assert alvo.tolist() == [1, 0, 0, 1, 0]
+    # O deslocamento posicional teria trazido o 1 de 04/03 para a âncora de 02/03
+    assert realized_outcomes(df)[NOME_ALVO].loc['2025-03-04'] == 1
+
+def test_contiguous_data_matches_positional_shift():
+    rng = np.random.default_rng(11)
+    df = days(rng.integers(0, 2, 30).tolist())
+    df = df.mask(rng.random(df.shape) < 0.01)
+
+    alvo = make_target(df)[NOME_ALVO]
+
+    diarios = realized_outcomes(df)[NOME_ALVO]
+    esperado = diarios.shift(-1).fillna(0).astype('int8')
+    assert alvo.index.normalize().equals(diarios.index)
+    np.testing.assert_array_equal(alvo.to_numpy(), esperado.to_numpy())
@@ -0,0 +1,53 @@
+"""Cache de partições (só depois do commit), migração num banco sem citrus_sites1 e agregados sob demanda"""
+import pytest
+
+from citrus_comum import armazenamento, db
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(armazenamento, '_particoes', set())
+    monkeypatch.setattr(armazenamento, '_particionadas', set())
+
+def test_partitions_are_cached_after_commit_only(cursor, conexao):
+    cursor.respostas = lambda sql, params: [(True,)] if 'pg_partitioned_table' in sql else []
+
+    with pytest.raises(RuntimeError):
+        with db.transaction() as cur:
+            armazenamento.ensure_partitions(cur, '2025-01-01', '2025-12-31')
+            raise RuntimeError("falha na gravação")
+    assert armazenamento._particoes == set()
+
+    with db.transaction() as cur:
+        assert armazenamento.ensure_partitions(cur, '2025-01-01', '2025-12-31') == 1
+    assert armazenamento._particoes == {'citrus1_2025'}
+    with db.transaction() as cur:
+        assert armazenamento.ensure_partitions(cur, '2025-06-01', '2025-06-30') == 0
+
+def test_migrate_without_citrus_sites1(cursor, conexao, monkeypatch):
+    def respostas(sql, params):
+        if 'to_regclass' in sql:
+            existe = 'citrus1' if params == ['citrus1'] else None
+            return [(existe,)] if params else [('citrus1', None)]
+        return [(True,)] if 'pg_partitioned_table' in sql else []
+    cursor.respostas = respostas
+    monkeypatch.setattr(armazenamento, 'refresh_rollups', lambda cur, inicio, fim, site: 0)
+
+    armazenamento.migrate()
+
+    assert not any('FROM citrus_sites1' in sql for sql, _ in cursor.comandos)
+
+def test_refresh_all_rollups_covers_every_site(cursor, conexao, monkeypatch):
+    def respostas(sql, params):
+        if 'to_regclass' in sql:
+            return [('citrus1', 'citrus_sites1')]
+        return [('c1',), ('c2',), ('c3',)] if 'DISTINCT site' in sql else []
+    cursor.respostas = respostas
+    recalculados = []
+    monkeypatch.setattr(armazenamento, 'refresh_rollups',
+                        lambda cur, inicio, fim, site: recalculados.append((site, inicio, fim)) or 0)
+
+    armazenamento.refresh_all_rollups(inicio='2025-01-01')
+
+    assert recalculados == [('c1', '2025-01-01', None), ('c2', '2025-01-01', None), ('c3', '2025-01-01', None)]
+    # Uma transação para criar as tabelas e listar os sites, outra por site
+    assert conexao.eventos.count('commit') == 4
@@ -0,0 +1,35 @@
+"""Dobras do backtest walk-forward e escolha do limiar"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'model_dev'))
+import backtest
+
+def test_folds_leave_one_day_before_test_month():
+    ancoras = pd.date_range('2025-01-01 15:00', '2025-03-31 15:00', freq='D')
+    dobras = backtest.walk_forward_folds(ancoras, '2025-02-01')
+
+    assert [nome for nome, _, _ in dobras] == ['2025-02', '2025-03']
+    for nome, treino_idx, teste_idx in dobras:
+        mes = pd.Timestamp(nome)
+        assert ancoras[treino_idx].max() == mes - pd.Timedelta(days=2) + pd.Timedelta(hours=15)
+        assert ancoras[teste_idx].min() == mes + pd.Timedelta(hours=15)
+
+def test_best_threshold_prefers_lowest_on_tie():
+    # Cortes em 0.9 (1 de 1 previsto) e em 0.3 (2 de 4) dão o mesmo F1, 2/3
+    y = np.array([1, 0, 0, 1])
+    scores = np.array([0.9, 0.7, 0.5, 0.3])
+
+    assert backtest.best_threshold(y, scores) == (0.3, 2 / 3)
+    # Mesmos dados em outra ordem: mesmo resultado
+    ordem = np.array([2, 0, 3, 1])
+    assert backtest.best_threshold(y[ordem], scores[ordem]) == (0.3, 2 / 3)
+
+def test_best_threshold_keeps_tied_scores_together():
+    y = np.array([1, 0, 0])
+    scores = np.array([0.8, 0.8, 0.1])
+    # Cortar no meio do empate em 0.8 daria F1 1.0, mas `scores >= 0.8` inclui o negativo
+    assert backtest.best_threshold(y, scores) == (0.8, 2 / 3)
@@ -0,0 +1,84 @@
+"""Cache em disco das respostas: acertos por faixa coberta, faltas, TTL e limpeza"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from citrus_comum import cache_respostas
+from citrus_comum.cache_respostas import ResponseCache
+
+LOCAL = '-22.59,-47.46'
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """time.time() do módulo controlado pelo teste"""
+    relogio = SimpleNamespace(agora=1_000_000.0)
+    monkeypatch.setattr(cache_respostas, 'time', SimpleNamespace(time=lambda: relogio.agora))
+    return relogio
+
+@pytest.fixture
+def cache(tmp_path, relogio):
+    return ResponseCache(str(tmp_path), ttl=3600)
+
+def store(cache, corpo, site='c1', local=LOCAL, inicio='2025-01-01', fim='2025-01-03', tamanho=5):
+    pedacos = [corpo[i:i + tamanho] for i in range(0, len(corpo), tamanho)]
+    # store é um gerador: grava enquanto os pedaços são consumidos
+    assert b''.join(cache.store(site, local, inicio, fim, pedacos)) == corpo
+
+def test_hit_when_range_is_covered(cache):
+    store(cache, b'{"days": [1, 2, 3]}')
+
+    digest = cache.lookup('c1', LOCAL, '2025-01-02', '2025-01-03')
+
+    assert digest is not None
+    assert b''.join(cache.read(digest, tamanho_pedaco=4)) == b'{"days": [1, 2, 3]}'
+
+@pytest.mark.parametrize('site, local, inicio, fim', [
+    ('c1', LOCAL, '2024-12-31', '2025-01-02'),  # começa antes
+    ('c1', LOCAL, '2025-01-02', '2025-01-04'),  # termina depois
+    ('c1', '0.0,0.0', '2025-01-01', '2025-01-03'),  # outro local
+    ('c2', LOCAL, '2025-01-01', '2025-01-03'),  # outro site
+])
+def test_miss_when_not_covered(cache, site, local, inicio, fim):
+    store(cache, b'{"days": []}')
+
+    assert cache.lookup(site, local, inicio, fim) is None
+
+def test_newest_entry_wins(cache, relogio):
+    store(cache, b'antiga')
+    relogio.agora += 60
+    store(cache, b'nova')
+
+    assert b''.join(cache.read(cache.lookup('c1', LOCAL, '2025-01-01', '2025-01-03'))) == b'nova'
+
+def test_entry_expires_after_ttl(cache, relogio):
+    store(cache, b'{"days": []}')
+
+    relogio.agora += 3599
+    assert cache.lookup('c1', LOCAL, '2025-01-01', '2025-01-03') is not None
+    relogio.agora += 1
+    assert cache.lookup('c1', LOCAL, '2025-01-01', '2025-01-03') is None
+
+def test_evict_removes_only_expired_objects(cache, relogio, tmp_path):
+    store(cache, b'vencida', inicio='2024-12-01', fim='2024-12-02')
+    relogio.agora += 3000
+    store(cache, b'valida')
+    # Mesmo conteúdo em outro site: um só objeto, ainda usado
+    store(cache, b'valida', site='c2')
+    relogio.agora += 1000
+
+    assert cache.evict() == 1
+    assert len(os.listdir(tmp_path / 'objetos')) == 1
+    assert cache.lookup('c1', LOCAL, '2025-01-01', '2025-01-02') is not None
+    assert cache.lookup('c2', LOCAL, '2025-01-01', '2025-01-02') is not None
+
+def test_interrupted_response_is_not_cached(cache, tmp_path):
+    def pedacos():
+        yield b'{"days": ['
+        raise ConnectionError("conexão caiu")
+
+    with pytest.raises(ConnectionError):
+        list(cache.store('c1', LOCAL, '2025-01-01', '2025-01-03', pedacos()))
+
+    assert cache.lookup('c1', LOCAL, '2025-01-01', '2025-01-03') is None
+    assert os.listdir(tmp_path / 'objetos') == []
@@ -0,0 +1,84 @@
+"""Nova tentativa de conexão com o secret atualizado quando a senha é rotacionada; after_commit"""
+import pg8000
+import pytest
+
+from citrus_comum import db
+
+@pytest.fixture
+def secrets(monkeypatch):
+    """Secret Manager falso: devolve as senhas de `senhas` em ordem e conta as buscas"""
+    senhas = ['antiga', 'nova']
+    buscas = []
+
+    class Cliente:
+        def get_secret_value(self, SecretId):
+            buscas.append(SecretId)
+            senha = senhas[min(len(buscas), len(senhas)) - 1]
+            return {'SecretString': f'{{"username": "citrus", "password": "{senha}"}}'}
+
+    monkeypatch.setattr(db, 'get_client', lambda servico: Cliente())
+    monkeypatch.setattr(db, '_secrets', {})
+    return buscas
+
+def falha(codigo):
+    return pg8000.DatabaseError({'S': 'FATAL', 'C': codigo, 'M': 'falha'})
+
+def test_rotated_password_refreshes_secret_and_retries(secrets, monkeypatch):
+    tentativas = []
+
+    def connect(**kwargs):
+        tentativas.append(kwargs['password'])
+        if kwargs['password'] == 'antiga':
+            raise falha(db.SENHA_INVALIDA)
+        return 'conexao'
+
+    monkeypatch.setattr(db.pg8000, 'connect', connect)
+    assert db._open_connection() == 'conexao'
+    assert tentativas == ['antiga', 'nova']
+    assert len(secrets) == 2
+    assert db._secrets[db.DB_SECRET][1]['password'] == 'nova'
+
+def test_other_database_errors_are_not_retried(secrets, monkeypatch):
+    tentativas = []
+
+    def connect(**kwargs):
+        tentativas.append(kwargs['password'])
+        raise falha('3D000')   # banco inexistente
+
+    monkeypatch.setattr(db.pg8000, 'connect', connect)
+    with pytest.raises(pg8000.DatabaseError):
+        db._open_connection()
+    assert tentativas == ['antiga']
+    assert len(secrets) == 1
+
+def test_network_errors_keep_cached_secret(secrets, monkeypatch):
+    def connect(**kwargs):
+        raise pg8000.InterfaceError("Can't create a connection")
+
+    monkeypatch.setattr(db.pg8000, 'connect', connect)
+    with pytest.raises(pg8000.InterfaceError):
+        db._open_connection()
+    assert len(secrets) == 1
+    assert db.DB_SECRET in db._secrets
+
+def test_after_commit_runs_only_after_commit(conexao):
+    with db.transaction() as cur:
+        db.after_commit(cur, lambda: conexao.eventos.append('cache'))
+        assert conexao.eventos == []
+
+    assert conexao.eventos == ['commit', 'cache']
+    assert db._apos_commit == {}
+
+def test_after_commit_is_dropped_on_rollback(conexao):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as cur:
+            db.after_commit(cur, lambda: conexao.eventos.append('cache'))
+            raise RuntimeError("falha na transação")
+
+    assert conexao.eventos == ['rollback']
+    assert db._apos_commit == {}
+
+def test_after_commit_outside_transaction_runs_now(cursor):
+    chamadas = []
+    db.after_commit(cursor, lambda: chamadas.append(1))
+    assert chamadas == [1]
@@ -0,0 +1,179 @@
+"""Filas em memória (LocalQueue) e a cadeia observações -> inferência -> notificação"""
+import os
+import sys
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from bench.run import RAIZ, load_job
+from citrus_comum import db, eventos
+
+sys.path.insert(0, os.path.join(RAIZ, 'deploy', 'inferencia_diaria', 'app'))
+import previsao
+
+def run_consumer(fila, handler, **kwargs):
+    """Consome `fila` numa thread até ela esvaziar"""
+    parar = threading.Event()
+    consumidor = threading.Thread(target=eventos.consume, args=(fila, handler),
+                                  kwargs={'parar': parar, 'espera': 0.05, 'espera_base': 0.0, **kwargs})
+    consumidor.start()
+    assert fila.join(timeout=10)
+    parar.set()
+    consumidor.join()
+
+def test_failed_event_is_retried_then_acked():
+    fila = eventos.LocalQueue()
+    chamadas = []
+
+    def handler(evento):
+        chamadas.append(evento['id'])
+        if len(chamadas) == 1:
+            raise RuntimeError("falha passageira")
+
+    fila.send(eventos.make_event('observacoes', site='c1'))
+    run_consumer(fila, handler)
+
+    assert len(chamadas) == 2
+    assert fila.mortas == []
+
+def test_repeated_event_is_processed_once():
+    fila = eventos.LocalQueue()
+    chamadas = []
+    evento = eventos.make_event('observacoes', site='c1', inicio='2025-01-01', fim='2025-01-02')
+
+    # Reenvio do mesmo evento (retry de quem publica)
+    fila.send(evento)
+    fila.send(evento)
+    run_consumer(fila, lambda e: chamadas.append(e['id']))
+
+    assert chamadas == [evento['id']]
+
+def test_new_run_over_same_range_is_processed():
+    fila = eventos.LocalQueue()
+    chamadas = []
+    # Duas ingestões da mesma faixa (ex.: reingestão depois de corrigir dados)
+    primeira = eventos.make_event('observacoes', origem_em=100.0, site='c1', inicio='2025-01-01', fim='2025-01-02')
+    segunda = eventos.make_event('observacoes', origem_em=200.0, site='c1', inicio='2025-01-01', fim='2025-01-02')
+
+    fila.send(primeira)
+    fila.send(segunda)
+    run_consumer(fila, lambda e: chamadas.append(e['id']))
+
+    assert chamadas == [primeira['id'], segunda['id']]
+    assert primeira['id'] != segunda['id']
+
+def test_republished_stage_keeps_the_id():
+    origem = eventos.make_event('observacoes', site='c1', inicio='2025-01-01', fim='2025-01-02')
+
+    # Inferência refeita sobre o mesmo evento publica o mesmo 'previsoes'
+    assert (eventos.make_event('previsoes', anterior=origem, previsoes=[])['id']
+            == eventos.make_event('previsoes', anterior=origem, previsoes=[])['id'])
+
+def test_event_goes_to_dead_letter_after_max_attempts():
+    fila = eventos.LocalQueue(max_tentativas=3)
+    chamadas = []
+
+    def handler(evento):
+        chamadas.append(evento['id'])
+        raise RuntimeError("falha permanente")
+
+    fila.send(eventos.make_event('observacoes', site='c1'))
+    run_consumer(fila, handler)
+
+    assert len(chamadas) == 3
+    assert [e['site'] for e in fila.mortas] == ['c1']
+
+def test_latencies_per_stage():
+    evento = eventos.make_event('observacoes', origem_em=100.0, site='c1')
+    eventos.record_stage(evento, 'inferencia', 100.5, 101.0)
+    seguinte = eventos.make_event('previsoes', anterior=evento, previsoes=[])
+    eventos.record_stage(seguinte, 'notificacao', 101.25, 101.5)
+
+    assert eventos.latencies(seguinte) == {
+        'inferencia_espera': 500.0, 'inferencia': 500.0,
+        'notificacao_espera': 250.0, 'notificacao': 250.0,
+        'ponta_a_ponta': 1500.0,
+    }
+
+@pytest.fixture
+def filas():
+    filas = {nome: eventos.LocalQueue() for nome in eventos.FILAS}
+    for nome, fila in filas.items():
+        eventos.set_queue(nome, fila)
+    yield filas
+    for nome in filas:
+        eventos.set_queue(nome, None)
+
+@pytest.fixture
+def banco(cursor, conexao):
+    """Assinante único em cada (site, sistema); toda reserva em notificacoes1 é nova"""
+    def respostas(sql, params):
+        if 'JOIN subscribers1' in sql:
+            return [('+5519000000001', site, sistema, date.fromisoformat(dia), float(score))
+                    for site, sistema, dia, score in zip(params[::4], params[1::4], params[2::4], params[3::4])]
+        if sql.lstrip().startswith('INSERT INTO notificacoes1'):
+            return [(params[i],) for i in range(0, len(params) - 1, 5)]
+        return []
+    cursor.respostas = respostas
+    return cursor
+
+def test_chain_publishes_and_notifies_only_today_onwards(servicos, filas, banco, monkeypatch):
+    monkeypatch.setattr(db, '_clients', {})
+    inferencia = load_job('inferencia_main_teste', 'deploy/inferencia_diaria/app/main.py')
+    notificacao = load_job('notificacao_sms_eventos', 'deploy/notificacao_sms/lambda_function.py')
+    hoje = date.today()
+    # A repontuação alcançou um dia já passado e o de amanhã
+    alteradas = [(hoje - timedelta(days=2), 'pulverizar_c2_v1', 0.9, b''),
+                 (hoje + timedelta(days=1), 'pulverizar_c2_v1', 0.7, b'')]
+    monkeypatch.setattr(previsao, 'score_changed', lambda cur, modelos, site, inicio, fim: alteradas)
+
+    filas['inferencia'].send(eventos.make_event('observacoes', site='c2', inicio='2025-01-01', fim='2025-01-02'))
+    run_consumer(filas['inferencia'], lambda e: inferencia.handle_observations(e, {'c2': {'pulverizar_c2_v1': None}}))
+
+    latencias = []
+
+    def notificar(evento):
+        resposta = notificacao.lambda_handler({'eventos': [evento]}, None)
+        assert resposta == {'batchItemFailures': []}
+        latencias.append(eventos.latencies(evento))
+    run_consumer(filas['notificacao'], notificar)
+
+    assert [m for _, m in servicos.sms] == [notificacao.format_message(0.7, None)]
+    assert set(latencias[0]) == {'inferencia_espera', 'inferencia', 'notificacao_espera',
+                                 'notificacao', 'ponta_a_ponta'}
+    assert filas['inferencia'].mortas == filas['notificacao'].mortas == []
+
+def test_past_days_are_not_published(filas, conexao, monkeypatch):
+    inferencia = load_job('inferencia_main_passado', 'deploy/inferencia_diaria/app/main.py')
+    ontem = date.today() - timedelta(days=1)
+    monkeypatch.setattr(previsao, 'score_changed', lambda *args: [(ontem, 'pulverizar_c2_v1', 0.9, b'')])
+
+    evento = eventos.make_event('observacoes', site='c2', inicio='2025-01-01', fim='2025-01-02')
+    assert inferencia.handle_observations(evento, {'c2': {'pulverizar_c2_v1': None}}) is None
+    assert filas['notificacao'].join(timeout=0)
+
+def test_notification_events_skip_past_days(banco, conexao):
+    notificacao = load_job('notificacao_sms_passado', 'deploy/notificacao_sms/lambda_function.py')
+    ontem, amanha = date.today() - timedelta(days=1), date.today() + timedelta(days=1)
+    previsoes = [{'site': 'c2', 'sistema': 'pulverizar_c2_v1', 'dia_previsto': dia.isoformat(), 'score': 0.8}
+                 for dia in (ontem, amanha)]
+
+    pendentes = notificacao.get_pending_notifications(previsoes)
+
+    assert [p['dia_previsto'] for p in pendentes] == [amanha.isoformat()]
+    assert notificacao.get_pending_notifications(previsoes[:1]) == []
+
+def test_existing_scores_are_matched_by_site(cursor, monkeypatch):
+    dia = date(2025, 1, 2)
+    cursor.respostas = lambda sql, params: [(dia, 'c2', 'pulverizar_c2_v1', 0.5)] if 'FROM predictions1' in sql else []
+    monkeypatch.setattr(previsao, '_score_anchors', lambda *args: [
+        (dia, 'pulverizar_c2_v1', 0.5, b''), (dia + timedelta(days=1), 'pulverizar_c2_v1', 0.5, b'')])
+    gravadas = []
+    monkeypatch.setattr(previsao, 'insert_predictions', lambda cur, previsoes, site: gravadas.extend(previsoes))
+
+    alteradas = previsao.score_changed(cursor, {'pulverizar_c2_v1': None}, 'c2', '2025-01-01', '2025-01-02')
+
+    assert alteradas == gravadas == [(dia + timedelta(days=1), 'pulverizar_c2_v1', 0.5, b'')]
+    sql, params = cursor.comandos[0]
+    assert 'site = %s' in sql and params[0] == 'c2'
@@ -0,0 +1,65 @@
+"""features_hourly quando o conjunto de features muda: colunas novas e leitura só do esquema atual"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from citrus_comum import feature_store
+from citrus_comum.features import LAGS, VARIAVEIS, feature_names, make_lag_features
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'model_dev'))
+
+# Conjunto antigo: um lag a menos em cada grupo
+LAGS_ANTIGOS = {tag: lags[:-1] for tag, lags in LAGS.items()}
+
+def colunas(nomes):
+    """Resposta de information_schema com as colunas de uma tabela já criada com `nomes`"""
+    return lambda sql, params: ([(n,) for n in ['site', 'timestamp', 'updated_at', 'esquema'] + nomes]
+                                if 'information_schema' in sql else [])
+
+def test_new_features_are_added_as_columns(cursor):
+    cursor.respostas = colunas(feature_names(LAGS_ANTIGOS))
+
+    feature_store.create_feature_table_if_not_exists(cursor)
+
+    alter = [sql for sql, _ in cursor.comandos if 'ALTER TABLE' in sql]
+    novas = sorted(set(feature_names(LAGS)) - set(feature_names(LAGS_ANTIGOS)))
+    assert len(alter) == 1
+    assert sorted(n for n in novas if f"ADD COLUMN IF NOT EXISTS {n} FLOAT" in alter[0]) == novas
+
+def test_no_alter_when_columns_exist(cursor):
+    cursor.respostas = colunas(feature_names(LAGS))
+    feature_store.create_feature_table_if_not_exists(cursor)
+    assert not any('ALTER TABLE' in sql for sql, _ in cursor.comandos)
+
+def test_read_with_missing_columns_returns_empty(cursor):
+    cursor.respostas = colunas(feature_names(LAGS_ANTIGOS))
+
+    lidas = feature_store.read_features(cursor, site='c2')
+
+    assert lidas.empty and list(lidas.columns) == feature_names(LAGS)
+    assert not any('FROM features_hourly' in sql for sql, _ in cursor.comandos)
+
+def test_read_and_write_carry_feature_set_version(cursor):
+    cursor.respostas = colunas(feature_names(LAGS))
+    feature_store.read_features(cursor, site='c2')
+    sql, params = cursor.comandos[-1]
+    assert 'esquema = %s' in sql and params[:2] == ['c2', feature_store.feature_set_version()]
+
+    features = pd.DataFrame([[1.0] * len(feature_names(LAGS))], columns=feature_names(LAGS),
+                            index=pd.DatetimeIndex(['2025-01-01 15:00']))
+    feature_store.upsert_features(cursor, features, 'c2')
+    assert cursor.comandos[-1][1][:3] == ['c2', features.index[0].to_pydatetime(), feature_store.feature_set_version()]
+
+def test_training_falls_back_to_snapshot_after_feature_change(cursor, conexao):
+    import treino
+
+    cursor.respostas = colunas(feature_names(LAGS_ANTIGOS))
+    rng = np.random.default_rng(0)
+    indice = pd.date_range('2025-01-01', periods=30 * 24, freq='h')
+    df = pd.DataFrame(rng.normal(size=(len(indice), len(VARIAVEIS))), index=indice, columns=VARIAVEIS)
+
+    resultado = treino.store_features(df, 'c2')
+
+    pd.testing.assert_frame_equal(resultado, make_lag_features(df, LAGS, hora=treino.HORA_ANCORA), check_freq=False)
@@ -0,0 +1,68 @@
+"""Paridade de make_lag_features com o make_lags original (shift posicional) da inferência"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from citrus_comum.features import LAGS, HORA_ANCORA, VARIAVEIS, all_lags, feature_names, make_lag_features
+
+def make_lags(df2, lags_hours, tag):
+    """make_lags do main.py original, copiado sem alterações como referência"""
+    cols = ['temp', 'pressure', 'humidity', 'dew', 'windspeed',
+            'winddir', 'precip', 'visibility', 'cloudcover']
+
+    lag_features = []
+
+    for lag in lags_hours:
+        lagged = df2[cols].shift(lag).add_suffix(f'_{tag}_lag{lag}h')
+        lag_features.append(lagged)
+
+    return pd.concat(lag_features, axis=1)
+
+def make_lags_original(df):
+    return pd.concat([make_lags(df, lags, tag) for tag, lags in LAGS.items()], axis=1)
+
+@pytest.fixture
+def observacoes():
+    rng = np.random.default_rng(0)
+    indice = pd.date_range('2025-01-01', periods=10 * 24, freq='h')
+    return pd.DataFrame(rng.normal(size=(len(indice), len(VARIAVEIS))), index=indice, columns=VARIAVEIS)
+
+def test_contiguous_data_matches_original(observacoes):
+    original = make_lags_original(observacoes)[feature_names(LAGS)]
+    novo = make_lag_features(observacoes)
+
+    assert list(novo.columns) == list(original.columns)
+    pd.testing.assert_frame_equal(novo, original, check_freq=False)
+
+def test_anchor_hour_matches_original(observacoes):
+    original = make_lags_original(observacoes)[feature_names(LAGS)]
+    original = original[original.index.hour == HORA_ANCORA]
+    novo = make_lag_features(observacoes, hora=HORA_ANCORA)
+
+    assert len(novo) == 10
+    pd.testing.assert_frame_equal(novo, original, check_freq=False)
+
+def test_gaps_become_nan_instead_of_shifting(observacoes):
+    ausentes = pd.to_datetime(['2025-01-05 14:00', '2025-01-05 12:00'])
+    com_lacunas = observacoes.drop(ausentes)
+    novo = make_lag_features(com_lacunas, hora=HORA_ANCORA)
+    ancora = pd.Timestamp('2025-01-05 15:00')
+
+    for lag in all_lags(LAGS):
+        origem = ancora - pd.Timedelta(hours=lag)
+        colunas = [n for n in feature_names(LAGS) if n.endswith(f'_lag{lag}h')]
+        valores = novo.loc[ancora, colunas].to_numpy(dtype=np.float64)
+        if origem in ausentes:
+            assert np.isnan(valores).all()
+        else:
+            # Cada lag aponta para a hora certa, não para a linha anterior na tabela
+            np.testing.assert_array_equal(valores, observacoes.loc[origem, VARIAVEIS].to_numpy())
+
+    # Nas âncoras longe das lacunas nada muda
+    original = make_lags_original(observacoes)[feature_names(LAGS)]
+    seguras = [ts for ts in novo.index if ts >= ancora + pd.Timedelta(hours=max(all_lags(LAGS)))]
+    pd.testing.assert_frame_equal(novo.loc[seguras], original.loc[seguras], check_freq=False)
+    # O shift posicional, ao contrário, lê a hora errada quando a janela cruza a lacuna
+    deslocado = make_lags_original(com_lacunas)
+    assert deslocado.loc[ancora, 'temp_short_lag6h'] == observacoes.loc[ancora - pd.Timedelta(hours=8), 'temp']
+    assert novo.loc[ancora, 'temp_short_lag6h'] == observacoes.loc[ancora - pd.Timedelta(hours=6), 'temp']
@@ -0,0 +1,124 @@
+"""Busca no Visual Crossing falso (bench.locais), retentativas, watermark e roteamento das gravações"""
+from contextlib import contextmanager
+
+import pytest
+import requests
+
+from bench.run import load_job
+from citrus_comum import cache_respostas, clima
+from citrus_comum.cache_respostas import ResponseCache
+
+@pytest.fixture
+def esperas(monkeypatch):
+    """Esperas pedidas pelo backoff, sem dormir de fato"""
+    esperas = []
+    monkeypatch.setattr(clima.time, 'sleep', esperas.append)
+    return esperas
+
+def buscar(ingestao, local, inicio, fim, **kwargs):
+    return list(ingestao.stream_meteorological_data(local['latitude'], local['longitude'], inicio, fim, 'teste', **kwargs))
+
+def test_stream_returns_observed_hours_in_range(ingestao, sites, dados):
+    site = sites[1]
+    df = dados[site['site']]
+    inicio, fim = df.index[0], df.index[0] + (df.index[-1] - df.index[0]) / 2
+    inicio, fim = inicio.floor('h'), fim.floor('h')
+
+    registros = buscar(ingestao, site, inicio.strftime('%Y-%m-%dT%H:%M:%S'), fim.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    esperado = df[(df.index >= inicio) & (df.index <= fim)]
+    assert [r['timestamp'] for r in registros] == esperado.index.strftime('%Y-%m-%d %H:%M:%S').tolist()
+    assert registros[0]['temp'] == pytest.approx(esperado['temp'].iloc[0])
+    assert all(r['source'] == 'obs' for r in registros)
+
+def test_retry_on_429_and_5xx(ingestao, servicos, sites, dados, esperas):
+    servicos.falhas_timeline = [503, 429]
+    dia = dados[sites[0]['site']].index[0].strftime('%Y-%m-%d')
+
+    registros = buscar(ingestao, sites[0], dia, dia)
+
+    assert len(registros) == 24
+    assert servicos.pedidos_timeline == 3
+    # Backoff exponencial a partir de 1s; Retry-After 0 não reduz a espera
+    assert esperas == [1.0, 2.0]
+
+def test_retry_gives_up_after_max_attempts(ingestao, servicos, sites, dados, esperas):
+    servicos.falhas_timeline = [503] * clima.MAX_TENTATIVAS
+    dia = dados[sites[0]['site']].index[0].strftime('%Y-%m-%d')
+
+    with pytest.raises(requests.HTTPError):
+        buscar(ingestao, sites[0], dia, dia)
+    assert servicos.pedidos_timeline == clima.MAX_TENTATIVAS
+    assert len(esperas) == clima.MAX_TENTATIVAS - 1
+
+def test_client_error_is_not_retried(ingestao, servicos, esperas):
+    # Coordenadas desconhecidas: o substituto responde 400
+    with pytest.raises(requests.HTTPError):
+        list(ingestao.stream_meteorological_data(0.0, 0.0, '2025-01-01', '2025-01-01', 'teste'))
+    assert servicos.pedidos_timeline == 1
+    assert esperas == []
+
+def test_cached_response_skips_api(ingestao, servicos, sites, dados, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    site = sites[0]
+    dias = dados[site['site']].index.strftime('%Y-%m-%d')
+
+    primeira = buscar(ingestao, site, dias[0], dias[-1], cache=cache, site=site['site'])
+    # Faixa contida na anterior: atendida pelo cache
+    segunda = buscar(ingestao, site, dias[0], dias[0], cache=cache, site=site['site'])
+
+    assert servicos.pedidos_timeline == 1
+    assert segunda == primeira
+
+@pytest.fixture
+def banco(ingestao, cursor, monkeypatch):
+    """transaction() da Lambda entregando o cursor que grava os comandos"""
+    @contextmanager
+    def transacao():
+        yield cursor
+    monkeypatch.setattr(ingestao, 'transaction', transacao)
+    return cursor
+
+def test_watermark_comes_from_state_table(ingestao, banco):
+    banco.respostas = lambda sql, params: [('2025-01-02 10:00:00',)] if ingestao.TABELA_ESTADO in sql else []
+
+    assert ingestao.get_watermark('c2') == '2025-01-02 10:00:00'
+    assert len(banco.comandos) == 1 and banco.comandos[0][1] == ['c2']
+
+@pytest.mark.parametrize('site, tabela', [(clima.SITE_LEGADO, 'citrus1'), ('c2', 'citrus_sites1')])
+def test_watermark_falls_back_to_observations(ingestao, banco, site, tabela):
+    banco.respostas = lambda sql, params: [] if ingestao.TABELA_ESTADO in sql else [('2025-01-01 23:00:00',)]
+
+    assert ingestao.get_watermark(site) == '2025-01-01 23:00:00'
+    sql, params = banco.comandos[1]
+    assert f'FROM {tabela}' in sql
+    assert params == ([] if tabela == 'citrus1' else [site])
+
+def test_watermark_is_none_for_a_new_site(ingestao, banco):
+    banco.respostas = lambda sql, params: [] if ingestao.TABELA_ESTADO in sql else [(None,)]
+
+    assert ingestao.get_watermark('c9') is None
+
+def test_response_cache_is_created_on_first_use(servicos, monkeypatch):
+    criados = []
+
+    class Registro:
+        def __init__(self):
+            criados.append(self)
+    monkeypatch.setattr(cache_respostas, 'ResponseCache', Registro)
+
+    ingestao = load_job('ingestao_diaria_cache', 'deploy/ingestao_diaria/lambda_function.py')
+    # Importar não toca o disco; o cache nasce na primeira invocação e é reaproveitado
+    assert criados == []
+    assert ingestao.get_response_cache() is ingestao.get_response_cache() is criados[0]
+
+def test_legacy_site_is_written_to_citrus1_only(ingestao, banco, monkeypatch):
+    monkeypatch.setattr(ingestao, 'ensure_partitions', lambda *args: None)
+    lote = [{'timestamp': '2025-01-01 00:00:00', 'temp': 20.0, 'source': 'obs', 'qualidade': 0}]
+
+    ingestao.insert_data_to_db(lote, site=clima.SITE_LEGADO)
+    ingestao.insert_data_to_db(lote, site='c2')
+
+    tabelas = [sql.split('INSERT INTO')[1].split()[0] for sql, _ in banco.comandos]
+    assert tabelas == ['citrus1', 'citrus_sites1']
+    assert banco.comandos[1][1][0] == 'c2'
@@ -0,0 +1,87 @@
+"""Carga histórica: tabela de destino por site, DDL e partições antes dos blocos paralelos"""
+from contextlib import contextmanager
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from bench.run import load_job
+from citrus_comum import armazenamento
+
+class FakeEngine:
+    """engine.begin() do SQLAlchemy entregando sempre o mesmo cursor"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @contextmanager
+    def begin(self):
+        cursor = self.cursor
+
+        class Conexao:
+            class connection:
+                @staticmethod
+                def cursor():
+                    return cursor
+        yield Conexao()
+
+@pytest.fixture
+def carga(cursor, tmp_path, monkeypatch):
+    """ingestao_inicial com tabelas particionadas e blocos de 24 horas vindos da memória"""
+    modulo = load_job('ingestao_inicial_teste', 'ingestao_inicial/ingestao_inicial.py')
+    monkeypatch.setattr(armazenamento, '_particoes', set())
+    monkeypatch.setattr(armazenamento, '_particionadas', set())
+    cursor.respostas = lambda sql, params: [(True,)] if 'pg_partitioned_table' in sql else []
+    cursor.copy_expert = lambda sql, buffer: None
+
+    def dados(latitude, longitude, inicio, fim, chave_api):
+        horas = pd.date_range(inicio, periods=24, freq='h')
+        return pd.DataFrame({col: 1.0 for col in modulo.COLUNAS} | {'timestamp': horas, 'source': 'obs'})
+    monkeypatch.setattr(modulo, 'get_meteorological_data', dados)
+    reconstruidos = []
+    monkeypatch.setattr(modulo, 'rebuild_features', lambda cur, site: reconstruidos.append(site) or 0)
+
+    def executar(site):
+        modulo.backfill(FakeEngine(cursor), -22.5, -47.4, date(2024, 11, 15), date(2025, 2, 10),
+                        'chave', str(tmp_path / f"{site}.json"), site=site, workers=4)
+        return reconstruidos
+    return executar
+
+def sql_indices(cursor, trecho):
+    return [i for i, (sql, _) in enumerate(cursor.comandos) if trecho in sql]
+
+def test_partitions_are_created_once_before_the_chunks(carga, cursor):
+    carga('c2')
+
+    particoes = sql_indices(cursor, 'PARTITION OF')
+    assert [cursor.comandos[i][0].split()[5] for i in particoes] == ['citrus_sites1_2024', 'citrus_sites1_2025']
+    assert max(particoes) < min(sql_indices(cursor, 'CREATE TEMP TABLE staging'))
+    assert len(sql_indices(cursor, 'CREATE TEMP TABLE staging')) == 4
+
+def test_legacy_site_goes_to_citrus1(carga, cursor):
+    assert carga('c1') == ['c1']
+
+    insercoes = [sql for sql, _ in cursor.comandos if 'SELECT timestamp' in sql or 'ON CONFLICT (' in sql]
+    assert insercoes and all('INSERT INTO citrus1 ' in sql for sql in insercoes)
+    assert not sql_indices(cursor, 'citrus_sites1')
+
+def test_sites_table_is_created_before_alter(carga, cursor):
+    assert carga('c2') == ['c2']
+
+    criacao = sql_indices(cursor, 'CREATE TABLE IF NOT EXISTS citrus_sites1')
+    alteracao = sql_indices(cursor, 'ALTER TABLE citrus_sites1')
+    assert criacao and alteracao and criacao[0] < alteracao[0]
+
+def test_url_comes_from_environment(monkeypatch):
+    monkeypatch.setenv('VISUAL_CROSSING_URL', 'http://127.0.0.1:9/timeline/')
+    modulo = load_job('ingestao_inicial_url', 'ingestao_inicial/ingestao_inicial.py')
+    pedidos = []
+
+    def get(url, **kwargs):
+        pedidos.append(url)
+        raise RuntimeError("sem rede")
+    monkeypatch.setattr(modulo, 'get_with_retry', get)
+
+    with pytest.raises(RuntimeError):
+        modulo.get_meteorological_data(-22.5, -47.4, '2025-01-01', '2025-01-31', 'chave')
+    assert pedidos[0].startswith('http://127.0.0.1:9/timeline/-22.5,-47.4/2025-01-01/2025-01-31?')
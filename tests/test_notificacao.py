@@ -0,0 +1,135 @@
+"""Reserva e registro das notificações (idempotência) e o limite de envio, com o SNS falso"""
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from bench.run import load_job
+from citrus_comum import db
+
+class FakeNotifications:
+    """notificacoes1 em memória, respondendo aos comandos da reserva e do registro"""
+
+    def __init__(self):
+        self.linhas = {}
+        self.agora = 0.0
+
+    def __call__(self, sql, params):
+        if sql.lstrip().startswith('INSERT INTO notificacoes1'):
+            reserva = params[-1]
+            reservadas = []
+            for i in range(0, len(params) - 1, 5):
+                chave = params[i]
+                linha = self.linhas.get(chave)
+                if linha is None:
+                    self.linhas[chave] = {'status': 'pendente', 'reservado_em': self.agora}
+                elif linha['status'] == 'pendente' and linha['reservado_em'] < self.agora - reserva:
+                    linha['reservado_em'] = self.agora
+                else:
+                    continue
+                reservadas.append((chave,))
+            return reservadas
+        if sql.lstrip().startswith('UPDATE notificacoes1'):
+            for chave, message_id in zip(params[::2], params[1::2]):
+                self.linhas[chave].update(status='enviado', message_id=message_id)
+        elif sql.lstrip().startswith('DELETE FROM notificacoes1'):
+            for chave in params:
+                if self.linhas.get(chave, {}).get('status') == 'pendente':
+                    del self.linhas[chave]
+        return []
+
+@pytest.fixture
+def tabela():
+    return FakeNotifications()
+
+@pytest.fixture
+def notificacao(servicos, tabela, cursor, monkeypatch):
+    """Lambda de notificação com o SNS falso e notificacoes1 em memória"""
+    modulo = load_job('notificacao_sms_teste', 'deploy/notificacao_sms/lambda_function.py')
+    # Clientes boto3 de outros testes apontam para outra porta
+    monkeypatch.setattr(db, '_clients', {})
+
+    cursor.respostas = tabela
+
+    @contextmanager
+    def transacao():
+        yield cursor
+    monkeypatch.setattr(modulo, 'transaction', transacao)
+    return modulo
+
+def previsao(telefone, score=0.8, dia='2025-01-02'):
+    return {'telefone': telefone, 'site': 'c2', 'sistema': 'pulverizar_c2_v1', 'dia_previsto': dia, 'score': score}
+
+def send(notificacao, notificacoes):
+    resultados = notificacao.deliver(notificacao.claim_notifications(notificacoes), por_segundo=1000)
+    notificacao.record_results(resultados)
+    return resultados
+
+def test_sent_notifications_are_not_repeated(notificacao, servicos):
+    notificacoes = [previsao('+5519000000001'), previsao('+5519000000002')]
+
+    assert len(send(notificacao, notificacoes)) == 2
+    # Retry da Lambda e a mesma previsão repetida no lote não reenviam nada
+    assert send(notificacao, notificacoes + notificacoes) == []
+    assert sorted(t for t, _ in servicos.sms) == ['+5519000000001', '+5519000000002']
+
+def test_failed_sends_are_released_for_retry(notificacao, servicos, tabela):
+    servicos.falhas_sns = {'+5519000000002'}
+    notificacoes = [previsao('+5519000000001'), previsao('+5519000000002')]
+
+    resultados = send(notificacao, notificacoes)
+    assert [r['chave'] for r in resultados if 'error' in r] == [notificacao.idempotency_key(notificacoes[1])]
+    assert len(tabela.linhas) == 1
+
+    servicos.falhas_sns = set()
+    assert len(send(notificacao, notificacoes)) == 1
+    assert [t for t, _ in servicos.sms] == ['+5519000000001', '+5519000000002']
+
+def test_revised_prediction_is_sent_again(notificacao, servicos):
+    send(notificacao, [previsao('+5519000000001', score=0.8)])
+    # Mesmo dia com score revisado: chave nova; score igual na precisão da mensagem: não
+    send(notificacao, [previsao('+5519000000001', score=0.8000001)])
+    send(notificacao, [previsao('+5519000000001', score=0.35)])
+
+    assert [m for _, m in servicos.sms] == [notificacao.format_message(0.8, None), notificacao.format_message(0.35, None)]
+
+def test_stale_pending_claim_is_taken_over(notificacao, tabela):
+    notificacoes = [previsao('+5519000000001')]
+    # Execução que reservou e caiu antes de enviar
+    assert notificacao.claim_notifications(notificacoes, reserva_segundos=900) == notificacoes
+
+    tabela.agora += 60
+    assert notificacao.claim_notifications(notificacoes, reserva_segundos=900) == []
+    tabela.agora += 900
+    assert notificacao.claim_notifications(notificacoes, reserva_segundos=900) == notificacoes
+
+def test_failed_messages_match_event_predictions(notificacao):
+    p1, p2 = previsao('+5519000000001', dia='2025-01-02'), previsao('+5519000000001', dia='2025-01-03')
+    lidos = [('m1', {'previsoes': [p1]}), ('m2', {'previsoes': [p2]})]
+    resultados = [{'chave': notificacao.idempotency_key(p1), 'message_id': 'x'},
+                  {'chave': notificacao.idempotency_key(p2), 'error': 'recusado'}]
+
+    assert notificacao.failed_messages(lidos, resultados) == [{'itemIdentifier': 'm2'}]
+
+def test_rate_limiter_spaces_sends(notificacao, servicos):
+    notificacoes = [previsao(f"+5519{i:09d}") for i in range(10)]
+
+    inicio = time.monotonic()
+    resultados = notificacao.deliver(notificacoes, max_workers=8, por_segundo=50)
+    decorrido = time.monotonic() - inicio
+
+    assert all('message_id' in r for r in resultados)
+    # 10 envios a 50/s: o primeiro sai na hora, os outros 9 espaçados de 20 ms
+    assert decorrido >= 9 / 50
+    assert servicos.publicadas == 10
+
+def test_rate_limiter_does_not_accumulate_idle_credit():
+    limitador = load_job('notificacao_sms_limite', 'deploy/notificacao_sms/lambda_function.py').RateLimiter(20)
+    limitador.wait()
+    time.sleep(0.2)
+
+    # Depois de parado, volta ao ritmo de 20/s em vez de disparar uma rajada
+    inicio = time.monotonic()
+    for _ in range(4):
+        limitador.wait()
+    assert time.monotonic() - inicio >= 3 / 20
@@ -0,0 +1,73 @@
+"""Cache das leituras de previsões: consulta da versão por TTL e invalidação depois do commit da gravação"""
+from datetime import date, datetime
+
+import pytest
+
+from citrus_comum import db, previsoes
+
+@pytest.fixture
+def banco(cursor):
+    """predictions1_latest com uma linha; a versão avança a cada gravação"""
+    estado = {'versao': datetime(2025, 1, 1)}
+
+    def respostas(sql, params):
+        if 'max(updated_at)' in sql:
+            return [(estado['versao'],)]
+        if sql.lstrip().startswith('SELECT site, sistema'):
+            return [('c1', 'pulverizar_c1_v0', date(2025, 1, 2), 0.7, estado['versao'])]
+        return []
+    cursor.respostas = respostas
+    previsoes.cache.clear()
+    yield cursor, estado
+    previsoes.cache.clear()
+
+def consultas(cursor, trecho):
+    return sum(trecho in sql for sql, _ in cursor.comandos)
+
+def test_version_is_checked_once_per_ttl(banco):
+    cursor, _ = banco
+    for _ in range(5):
+        previsoes.latest_predictions(cursor, 'c1')
+
+    assert consultas(cursor, 'max(updated_at)') == 1
+    assert consultas(cursor, 'FROM predictions1_latest\n') == 1
+
+def test_expired_ttl_sees_writes_from_other_processes(banco, monkeypatch):
+    cursor, estado = banco
+    previsoes.latest_predictions(cursor, 'c1')
+    estado['versao'] = datetime(2025, 1, 2)
+    monkeypatch.setattr(previsoes, 'TTL_VERSAO', 0.0)
+
+    assert previsoes.latest_predictions(cursor, 'c1')[0]['created_at'] == '2025-01-02T00:00:00'
+    assert consultas(cursor, 'max(updated_at)') == 2
+
+def test_record_latest_invalidates_cache(banco):
+    cursor, estado = banco
+    previsoes.latest_predictions(cursor, 'c1')
+    estado['versao'] = datetime(2025, 1, 2)
+
+    previsoes.record_latest(cursor, [('c1', 'pulverizar_c1_v0', '2025-01-02', 0.7)])
+
+    assert previsoes.latest_predictions(cursor, 'c1')[0]['created_at'] == '2025-01-02T00:00:00'
+
+def test_cache_is_cleared_after_commit(banco, conexao):
+    cursor, estado = banco
+    with db.transaction() as cur:
+        previsoes.record_latest(cur, [('c1', 'pulverizar_c1_v0', '2025-01-02', 0.7)])
+        # Leitura antes do commit ainda vê (e guarda) a versão anterior
+        assert previsoes.latest_predictions(cur, 'c1')[0]['created_at'] == '2025-01-01T00:00:00'
+        estado['versao'] = datetime(2025, 1, 2)
+
+    assert previsoes.latest_predictions(cursor, 'c1')[0]['created_at'] == '2025-01-02T00:00:00'
+
+def test_rollback_keeps_cache(banco, conexao):
+    cursor, _ = banco
+    previsoes.latest_predictions(cursor, 'c1')
+
+    with pytest.raises(RuntimeError):
+        with db.transaction() as cur:
+            previsoes.record_latest(cur, [('c1', 'pulverizar_c1_v0', '2025-01-02', 0.7)])
+            raise RuntimeError("falha na gravação")
+    previsoes.latest_predictions(cursor, 'c1')
+
+    assert consultas(cursor, 'max(updated_at)') == 1
@@ -0,0 +1,76 @@
+"""Etapa de qualidade em lotes: mesmo resultado de um lote único, qualquer que seja a divisa"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from citrus_comum.features import VARIAVEIS
+from citrus_comum.qualidade import QualityStage
+
+@pytest.fixture(scope='module')
+def registros():
+    """Três dias com horas ausentes, nulos e um valor fora da faixa, perto das divisas testadas"""
+    rng = np.random.default_rng(0)
+    indice = pd.date_range('2025-01-01', periods=72, freq='h')
+    df = pd.DataFrame(rng.uniform(10, 30, size=(len(indice), len(VARIAVEIS))), index=indice, columns=VARIAVEIS)
+    df.iloc[10:12, 0] = np.nan           # lacuna curta numa variável
+    df.iloc[30, 4] = -5.0                # windspeed fora da faixa
+    df.iloc[50:56, 1] = np.nan           # lacuna longa demais para preencher
+    df = df.drop(indice[[20, 21, 40, 64, 65, 66]])   # horas que não vieram
+    return [{'timestamp': ts.strftime('%Y-%m-%d %H:%M:%S'),
+             **{v: None if np.isnan(x) else float(x) for v, x in linha.items()}}
+            for ts, linha in df.iterrows()]
+
+def run(registros, divisas, **kwargs):
+    estagio = QualityStage(**kwargs)
+    saida = []
+    for inicio, fim in zip([0] + divisas, divisas + [len(registros)]):
+        saida += estagio.process(registros[inicio:fim])
+    return saida + estagio.flush(), estagio.contagens
+
+def test_single_batch_fills_internal_gaps(registros):
+    saida, contagens = run(registros, [])
+
+    assert len(saida) == 72
+    por_hora = {r['timestamp']: r for r in saida}
+    assert por_hora['2025-01-01 20:00:00']['source'] == 'interp'
+    assert por_hora['2025-01-01 10:00:00']['temp'] is not None
+    assert por_hora['2025-01-03 04:00:00']['pressure'] is None
+    assert contagens['horas_criadas'] == 6
+
+@pytest.mark.parametrize('divisa', range(1, 66))
+def test_split_point_does_not_change_output(registros, divisa):
+    assert run(registros, [divisa]) == run(registros, [])
+
+def test_many_small_batches(registros):
+    assert run(registros, list(range(5, 66, 5))) == run(registros, [])
+    assert run(registros, list(range(1, 66))) == run(registros, [])
+
+def test_trailing_gap_waits_for_next_batch(registros):
+    # Lote termina logo antes das horas 20 e 21, que faltam
+    estagio = QualityStage()
+    primeiro = estagio.process(registros[:20])
+    assert primeiro[-1]['timestamp'] == '2025-01-01 19:00:00'
+    # temp da hora 10-11 já foi preenchida; nada das horas 20-21 saiu ainda
+    segundo = estagio.process(registros[20:])
+    assert [r['timestamp'] for r in segundo[:2]] == ['2025-01-01 20:00:00', '2025-01-01 21:00:00']
+    assert all(r['source'] == 'interp' and r['temp'] is not None for r in segundo[:2])
+
+def test_trailing_value_held_until_flush(registros):
+    estagio = QualityStage()
+    # A última hora do lote tem temp nula: fica retida
+    saida = estagio.process(registros[:11])
+    assert saida[-1]['timestamp'] == '2025-01-01 09:00:00'
+    resto = estagio.flush()
+    assert [r['timestamp'] for r in resto] == ['2025-01-01 10:00:00']
+    assert resto[0]['temp'] is None
+
+def test_context_from_stored_row(registros):
+    completo, _ = run(registros, [])
+    # Gravado até a hora 19; a próxima execução começa com as horas 20 e 21 ausentes
+    guardada = completo[19]
+    contexto = (guardada['timestamp'], [guardada[v] for v in VARIAVEIS])
+
+    estagio = QualityStage(contexto=contexto)
+    continuacao = estagio.process(registros[19:]) + estagio.flush()
+
+    assert continuacao == completo[20:]
@@ -0,0 +1,75 @@
+"""Janelas móveis nas âncoras: paridade com o rolling do pandas e estado incremental"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from citrus_comum.features import HORA_ANCORA, VARIAVEIS
+from citrus_comum.rolling import JANELAS, RollingFeatures, make_rolling_features
+
+@pytest.fixture(scope='module')
+def horas():
+    """40 dias horários com NaN esparsos, uma variável toda NaN por 4 dias e horas faltando"""
+    rng = np.random.default_rng(7)
+    indice = pd.date_range('2025-01-01', periods=40 * 24, freq='h', name='timestamp')
+    df = pd.DataFrame(rng.normal(20, 5, (len(indice), len(VARIAVEIS))), index=indice, columns=VARIAVEIS)
+    df = df.mask(rng.random(df.shape) < 0.05)
+    df.loc['2025-01-10':'2025-01-13', VARIAVEIS[0]] = np.nan
+    # Lacunas na grade: um dia inteiro e horas soltas, incluindo âncoras
+    faltando = pd.date_range('2025-01-20', periods=30, freq='h').append(
+        pd.DatetimeIndex(['2025-01-05 15:00', '2025-01-28 14:00', '2025-02-02 15:00']))
+    return df.drop(faltando)
+
+def pandas_reference(df):
+    """rolling(janela, min_periods=1, closed='both') em todas as linhas, filtrado nas 15h"""
+    blocos = []
+    for tag, janela in JANELAS.items():
+        janelas = df[VARIAVEIS].rolling(janela, min_periods=1, closed='both')
+        estatisticas = {
+            'min': janelas.min(), 'max': janelas.max(), 'mean': janelas.mean(),
+            'p25': janelas.quantile(0.25), 'p50': janelas.quantile(0.50), 'p75': janelas.quantile(0.75),
+            'std': janelas.std(),
+        }
+        for stat, valores in estatisticas.items():
+            blocos.append(valores.add_suffix(f'_{tag}_{stat}'))
+    referencia = pd.concat(blocos, axis=1)
+    return referencia[referencia.index.hour == HORA_ANCORA]
+
+def test_batch_matches_pandas_rolling(horas):
+    features = make_rolling_features(horas)
+    referencia = pandas_reference(horas)[features.columns]
+
+    assert features.index.equals(referencia.index)
+    pd.testing.assert_frame_equal(features, referencia, check_freq=False, check_names=False, atol=1e-9)
+
+def test_window_with_only_nan_is_nan(horas):
+    features = make_rolling_features(horas)
+    coluna = f'{VARIAVEIS[0]}_short_mean'
+
+    # 3 dias dentro do trecho todo NaN: sem valor na janela curta, a longa ainda tem
+    assert np.isnan(features.loc['2025-01-13 15:00', coluna])
+    assert not np.isnan(features.loc['2025-01-13 15:00', f'{VARIAVEIS[0]}_long_mean'])
+
+def test_since_only_evaluates_later_anchors(horas):
+    corte = pd.Timestamp('2025-01-25 15:00')
+    completas = make_rolling_features(horas)
+
+    parciais = make_rolling_features(horas, desde=corte)
+
+    pd.testing.assert_frame_equal(parciais, completas[completas.index > corte])
+
+@pytest.mark.parametrize('tamanho', [1, 7, 24, 100, 500])
+def test_incremental_update_matches_batch(horas, tamanho):
+    estado = RollingFeatures()
+    # Lotes sobrepostos: linhas já vistas são ignoradas
+    partes = [estado.update(horas.iloc[max(i - 3, 0):i + tamanho]) for i in range(0, len(horas), tamanho)]
+
+    incremental = pd.concat([p for p in partes if not p.empty])
+    pd.testing.assert_frame_equal(incremental, make_rolling_features(horas), check_freq=False)
+
+def test_incremental_state_keeps_only_the_tail(horas):
+    estado = RollingFeatures()
+    estado.update(horas)
+
+    assert estado.ultimo_timestamp == horas.index[-1]
+    assert estado._cauda.index[0] >= horas.index[-1] - pd.Timedelta(JANELAS['long'])
+    assert estado.update(horas).empty
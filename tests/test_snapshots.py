@@ -0,0 +1,52 @@
+"""Versões do esquema de features: leitura sem gravar e cache só depois do commit"""
+import numpy as np
+import pytest
+
+from citrus_comum import db, snapshots
+from citrus_comum.features import LAGS, feature_names
+
+NOMES = feature_names(LAGS)
+
+@pytest.fixture(autouse=True)
+def versoes(monkeypatch):
+    monkeypatch.setattr(snapshots, '_versoes', {})
+
+def escritas(cursor):
+    return [sql for sql, _ in cursor.comandos if sql.split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+
+def test_load_snapshots_only_reads(cursor, conexao):
+    X = np.arange(2 * len(NOMES), dtype=np.float32).reshape(2, -1)
+    linhas = [('2025-01-02', 'pulverizar_c1_v0', 'c1', 0.4), ('2025-01-03', 'pulverizar_c1_v0', 'c1', 0.6)]
+
+    def respostas(sql, params):
+        if 'FROM feature_schemas1' in sql:
+            return [(3,)]
+        return [linha + (dados,) for linha, dados in zip(linhas, snapshots.encode(X))]
+    cursor.respostas = respostas
+
+    with db.transaction() as cur:
+        lidas, matriz = snapshots.load_snapshots(cur, NOMES, sistema='pulverizar_c1_v0')
+
+    assert escritas(cursor) == []
+    assert lidas == linhas
+    np.testing.assert_array_equal(matriz, X)
+    assert cursor.comandos[-1][1][0] == 3
+
+def test_load_snapshots_unknown_schema(cursor, conexao):
+    with pytest.raises(ValueError):
+        with db.transaction() as cur:
+            snapshots.load_snapshots(cur, NOMES)
+    assert escritas(cursor) == []
+
+def test_registered_version_is_cached_after_commit(cursor, conexao):
+    cursor.respostas = lambda sql, params: [(7,)] if sql.lstrip().startswith('SELECT') else []
+
+    with pytest.raises(RuntimeError):
+        with db.transaction() as cur:
+            assert snapshots.register_schema(cur, NOMES) == 7
+            raise RuntimeError("falha na gravação da previsão")
+    assert snapshots._versoes == {}
+
+    with db.transaction() as cur:
+        snapshots.register_schema(cur, NOMES)
+    assert snapshots._versoes == {snapshots.schema_hash(NOMES): 7}
@@ -0,0 +1,105 @@
+"""Leitura incremental da resposta timeline: pedaços arbitrários, chaves "days" falsas, dias e horas repetidos"""
+import json
+
+import numpy as np
+import pytest
+
+from bench.sintetico import timeline_chunks
+from citrus_comum.timeline import VARIAVEIS, iter_array_items, iter_observations
+
+# Descrição com caracteres de 2, 3 e 4 bytes em UTF-8 em cada dia
+DESCRICAO = 'céu ☀ 🌧'.encode()
+
+@pytest.fixture
+def resposta(sites, dados):
+    """Resposta gerada pelo bench, com texto multibyte no cabeçalho e em cada dia"""
+    site = sites[0]
+    corpo = b''.join(timeline_chunks(dados[site['site']], site['latitude'], site['longitude']))
+    corpo = corpo.replace(b'"America/Sao_Paulo"', '"América/São_Paulo"'.encode())
+    return corpo.replace(b'{"datetime": ', b'{"description": "' + DESCRICAO + b'", "datetime": ')
+
+def split_at(corpo, posicoes):
+    posicoes = [0, *sorted(posicoes), len(corpo)]
+    return [corpo[a:b] for a, b in zip(posicoes, posicoes[1:])]
+
+def as_matrix(registros):
+    return [r['timestamp'] for r in registros], np.array([[r[c] for c in VARIAVEIS] for r in registros])
+
+def test_single_chunk_matches_frame(resposta, sites, dados):
+    df = dados[sites[0]['site']]
+
+    timestamps, valores = as_matrix(list(iter_observations([resposta])))
+
+    assert timestamps == df.index.strftime('%Y-%m-%d %H:%M:%S').tolist()
+    np.testing.assert_array_equal(valores, df[VARIAVEIS].to_numpy())
+
+@pytest.mark.parametrize('tamanho', [1, 2, 3, 5, 64, 1000])
+def test_fixed_size_chunks_give_same_records(resposta, tamanho):
+    pedacos = [resposta[i:i + tamanho] for i in range(0, len(resposta), tamanho)]
+
+    assert list(iter_observations(pedacos)) == list(iter_observations([resposta]))
+
+def test_random_chunk_boundaries_give_same_records(resposta):
+    rng = np.random.default_rng(3)
+    esperado = list(iter_observations([resposta]))
+    for _ in range(20):
+        posicoes = rng.choice(len(resposta), size=50, replace=False)
+        assert list(iter_observations(split_at(resposta, posicoes))) == esperado
+
+def test_boundaries_inside_multibyte_characters(resposta):
+    inicio = resposta.index(DESCRICAO)
+    # Cortes no meio de 'é' (2 bytes), '☀' (3 bytes) e '🌧' (4 bytes)
+    cortes = [inicio + 2, inicio + 5, inicio + 6, inicio + 9, inicio + 10, inicio + 11]
+    pedacos = split_at(resposta, cortes)
+    with pytest.raises(UnicodeDecodeError):
+        pedacos[1].decode()
+
+    assert list(iter_observations(pedacos)) == list(iter_observations([resposta]))
+    dias = list(iter_array_items(pedacos))
+    assert dias[0]['description'] == DESCRICAO.decode()
+
+def hour(datetime, temp, source='obs'):
+    return {'datetime': datetime, 'temp': temp, 'source': source}
+
+def test_nested_days_key_is_ignored():
+    falso = {'datetime': '1999-01-01', 'hours': [hour('00:00:00', -1.0)]}
+    resposta = json.dumps({
+        'queryCost': 1,
+        'nota': '"days": [ dentro de uma string',
+        'estacoes': {'A': {'days': [falso]}, 'lista': [{'days': [falso]}]},
+        'days': [{'datetime': '2025-01-01', 'hours': [hour('00:00:00', 20.0)]}],
+        'alertas': {'days': [falso]},
+    }, ensure_ascii=False).encode()
+
+    for tamanho in (1, 7, len(resposta)):
+        pedacos = [resposta[i:i + tamanho] for i in range(0, len(resposta), tamanho)]
+        registros = list(iter_observations(pedacos))
+        assert [(r['timestamp'], r['temp']) for r in registros] == [('2025-01-01 00:00:00', 20.0)]
+
+def test_repeated_hours_are_emitted_once():
+    # Hora repetida na troca de horário de verão e horas que não são observação
+    resposta = json.dumps({'days': [
+        {'datetime': '2025-02-16', 'hours': [hour('22:00:00', 21.0), hour('23:00:00', 20.0),
+                                             hour('23:00:00', 19.5), hour('23:30:00', 19.0, 'fcst')]},
+        {'datetime': '2025-02-17', 'hours': [hour('00:00:00', 18.0), hour('00:00:00', 18.0),
+                                             hour('01:00:00', 17.0, 'stats')]},
+    ]}).encode()
+
+    registros = list(iter_observations([resposta[:40], resposta[40:]]))
+
+    assert [(r['timestamp'], r['temp']) for r in registros] == [
+        ('2025-02-16 22:00:00', 21.0), ('2025-02-16 23:00:00', 20.0), ('2025-02-17 00:00:00', 18.0)]
+
+def test_repeated_day_is_emitted_once():
+    dia = {'datetime': '2025-01-01', 'hours': [hour('00:00:00', 20.0), hour('01:00:00', 19.0)]}
+    seguinte = {'datetime': '2025-01-02', 'hours': [hour('00:00:00', 18.0)]}
+    resposta = json.dumps({'days': [dia, dia, seguinte, dia]}).encode()
+
+    registros = list(iter_observations([resposta[i:i + 16] for i in range(0, len(resposta), 16)]))
+
+    assert [r['timestamp'] for r in registros] == ['2025-01-01 00:00:00', '2025-01-01 01:00:00',
+                                                   '2025-01-02 00:00:00']
+
+def test_truncated_response_raises(resposta):
+    with pytest.raises(ValueError):
+        list(iter_observations([resposta[:len(resposta) // 2]]))